@@ -0,0 +1,277 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+from catalog import is_group_chat
+from chat_render import TYPE_LABELS
+from chat_store import load_index, stream_chat
+
+# Per-chat partial rollups for the whole account, in one file next to index.json.
+# Each table is an int64 array with one row per (chat, key); "chat" is a position in `uuids`.
+# A chat is recomputed only when its file's size/mtime change; the dashboards are
+# groupby-sums over these tables, so they never touch the chat files.
+ROLLUP_NAME = "analytics.npz"
+TABLES = {
+    "hours": ["chat", "slot", "count"],             # slot = weekday * 24 + hour
+    "months": ["chat", "month", "count", "sent"],   # month = year * 12 + (month - 1)
+    "types": ["chat", "type", "count"],
+    "latency": ["chat", "bin", "mine", "theirs"],  # reply delays, private chats only
+}
+# Reply delay bins in seconds; a gap longer than a day starts a new conversation
+LATENCY_EDGES = [0, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600]
+LATENCY_LABELS = ["<10s", "10-30s", "30s-1m", "1-2m", "2-5m", "5-10m", "10-30m", "30m-1h", "1-3h", "3-6h", "6-12h", "12-24h"]
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# Messages per vectorized batch (several chats are rolled up by one groupby)
+BATCH_MESSAGES = 200_000
+
+
+def _chat_columns(chat_path):
+    """(timestamps as datetime64[s], is_sender, type) of one chat."""
+    import numpy as np
+
+    _meta, messages = stream_chat(chat_path)
+    ts, sender, types = [], [], []
+    for msg in messages:
+        ts.append(msg.get("timestamp") or "NaT")
+        sender.append(bool(msg.get("is_sender")))
+        types.append(msg.get("type") or 0)
+    return (
+        np.array(ts, dtype="datetime64[s]"),
+        np.array(sender, dtype=bool),
+        np.array(types, dtype=np.int64),
+    )
+
+
+def _rollup_batch(chats):
+    """
+    Partial rollups for a batch of chats, given as [(chat position, is_group, columns)].
+    Returns {table: int64 array} in TABLES layout.
+    """
+    import numpy as np
+    import pandas as pd
+
+    chat = np.concatenate([np.full(len(cols[0]), pos, dtype=np.int64) for pos, _g, cols in chats])
+    df = pd.DataFrame({
+        "chat": chat,
+        "ts": np.concatenate([cols[0] for _p, _g, cols in chats]),
+        "sent": np.concatenate([cols[1] for _p, _g, cols in chats]),
+        "type": np.concatenate([cols[2] for _p, _g, cols in chats]),
+        "private": np.concatenate([np.full(len(cols[0]), not g) for _p, g, cols in chats]),
+    })
+    out = {}
+    out["types"] = df.groupby(["chat", "type"]).size().reset_index().to_numpy(np.int64)
+
+    # Latency: delay between consecutive messages of one private chat where the sender flips
+    # (messages are stored in time order, so no sort is needed)
+    seconds = df["ts"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    valid = df["ts"].notna().to_numpy()
+    same_chat = np.r_[False, chat[1:] == chat[:-1]]
+    sent = df["sent"].to_numpy()
+    flip = same_chat & np.r_[False, sent[1:] != sent[:-1]] & df["private"].to_numpy() & valid & np.r_[False, valid[:-1]]
+    gap = np.r_[0, np.diff(seconds)]
+    reply = flip & (gap >= 0) & (gap < LATENCY_EDGES[-1])
+    bins = np.searchsorted(LATENCY_EDGES, gap[reply], side="right") - 1
+    lat = pd.DataFrame({"chat": chat[reply], "bin": bins, "mine": sent[reply], "theirs": ~sent[reply]})
+    out["latency"] = lat.groupby(["chat", "bin"])[["mine", "theirs"]].sum().reset_index().to_numpy(np.int64)
+
+    df = df[valid]
+    ts = df["ts"].dt
+    df = df.assign(slot=ts.dayofweek * 24 + ts.hour, month=ts.year * 12 + ts.month - 1)
+    out["hours"] = df.groupby(["chat", "slot"]).size().reset_index().to_numpy(np.int64)
+    out["months"] = df.groupby(["chat", "month"]).agg(count=("sent", "size"), sent=("sent", "sum")).reset_index().to_numpy(np.int64)
+    return out
+
+
+class Rollups:
+    """Per-chat partial rollups of one parse output; update() recomputes changed chats only."""
+
+    def __init__(self, parsed_dir):
+        import numpy as np
+
+        self.parsed_dir = Path(parsed_dir)
+        self.path = self.parsed_dir / ROLLUP_NAME
+        self.uuids = np.array([], dtype=str)
+        self.versions = np.zeros((0, 2), dtype=np.int64)  # (size, mtime_ns) per chat
+        self.tables = {name: np.zeros((0, len(cols)), dtype=np.int64) for name, cols in TABLES.items()}
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self.uuids = data["uuids"]
+                self.versions = data["versions"]
+                self.tables = {name: data[name] for name in TABLES}
+
+    def save(self):
+        import numpy as np
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp.npz")
+        np.savez(tmp_path, uuids=self.uuids, versions=self.versions, **self.tables)
+        os.replace(tmp_path, self.path)
+
+    def update(self, progress=None):
+        """Bring the rollups in line with index.json. Returns the number of chats recomputed."""
+        import numpy as np
+
+        rows = load_index(self.parsed_dir / "index.json")
+        chats_dir = self.parsed_dir / "chats"
+        known = {u: tuple(v) for u, v in zip(self.uuids.tolist(), self.versions.tolist())}
+        current, changed = {}, []
+        for row in rows:
+            try:
+                st = os.stat(chats_dir / f"{row['file_uuid']}.json")
+            except OSError:
+                continue
+            current[row["file_uuid"]] = (st.st_size, st.st_mtime_ns)
+            if known.get(row["file_uuid"]) != current[row["file_uuid"]]:
+                changed.append(row)
+        if not changed and len(current) == len(known):
+            return 0
+
+        # Keep the rows of unchanged chats, renumbered into the new uuid order
+        changed_ids = {row["file_uuid"] for row in changed}
+        kept = [u for u in self.uuids.tolist() if u in current and u not in changed_ids]
+        uuids = kept + [row["file_uuid"] for row in changed]
+        old_pos = {u: i for i, u in enumerate(self.uuids.tolist())}
+        remap = np.full(len(self.uuids) + 1, -1, dtype=np.int64)
+        remap[[old_pos[u] for u in kept]] = np.arange(len(kept))
+        parts = {name: [] for name in TABLES}
+        for name, table in self.tables.items():
+            table = table.copy()
+            table[:, 0] = remap[table[:, 0]]
+            parts[name].append(table[table[:, 0] >= 0])
+
+        batch, batch_size = [], 0
+        for done, row in enumerate(changed, 1):
+            cols = _chat_columns(chats_dir / f"{row['file_uuid']}.json")
+            batch.append((len(kept) + done - 1, is_group_chat(row.get("friend_id")), cols))
+            batch_size += len(cols[0])
+            if batch_size >= BATCH_MESSAGES or done == len(changed):
+                for name, table in _rollup_batch(batch).items():
+                    parts[name].append(table)
+                batch, batch_size = [], 0
+            if progress:
+                progress(done, len(changed))
+
+        self.uuids = np.array(uuids, dtype=str)
+        self.versions = np.array([current[u] for u in uuids], dtype=np.int64).reshape(-1, 2)
+        self.tables = {
+            name: np.concatenate(parts[name]) if parts[name] else np.zeros((0, len(TABLES[name])), dtype=np.int64)
+            for name in TABLES
+        }
+        self.save()
+        return len(changed)
+
+    def frame(self, name, is_group=None):
+        """One table as a DataFrame with friend_name / is_group columns; is_group filters chats."""
+        import pandas as pd
+
+        df = pd.DataFrame(self.tables[name], columns=TABLES[name])
+        rows = {r["file_uuid"]: r for r in load_index(self.parsed_dir / "index.json")}
+        info = pd.DataFrame({
+            "chat": range(len(self.uuids)),
+            "friend_name": [rows.get(u, {}).get("friend_name", u) for u in self.uuids.tolist()],
+            "is_group": [is_group_chat(rows.get(u, {}).get("friend_id")) for u in self.uuids.tolist()],
+        })
+        df = df.merge(info, on="chat", how="left")
+        if is_group is not None:
+            df = df[df["is_group"] == is_group]
+        return df
+
+
+def load_rollups(parsed_dir, progress=None):
+    rollups = Rollups(parsed_dir)
+    rollups.update(progress)
+    return rollups
+
+
+# --- dashboards (all vectorized over the rollup tables) ---
+
+def activity_heatmap(rollups, is_group=None):
+    """Messages per weekday (rows) x hour of day (columns)."""
+    import numpy as np
+    import pandas as pd
+
+    df = rollups.frame("hours", is_group)
+    counts = np.bincount(df["slot"].to_numpy(), weights=df["count"].to_numpy(), minlength=7 * 24)
+    return pd.DataFrame(counts.reshape(7, 24).astype(np.int64), index=WEEKDAYS, columns=range(24))
+
+
+def top_contacts_over_time(rollups, top=10, is_group=None):
+    """Messages per month (rows, "YYYY-MM") for the `top` busiest chats (columns)."""
+    df = rollups.frame("months", is_group)
+    busiest = df.groupby("chat")["count"].sum().nlargest(top).index
+    df = df[df["chat"].isin(busiest)]
+    # Chats that share a display name are told apart by their position
+    shared = df.groupby("friend_name")["chat"].transform("nunique") > 1
+    df = df.assign(name=df["friend_name"].where(~shared, df["friend_name"] + " #" + df["chat"].astype(str)))
+    table = df.pivot_table(index="month", columns="name", values="count", aggfunc="sum", fill_value=0)
+    table.index = [f"{m // 12}-{m % 12 + 1:02d}" for m in table.index]
+    return table[table.sum().sort_values(ascending=False).index]
+
+
+def monthly_totals(rollups, is_group=None):
+    """Sent / received messages per month."""
+    df = rollups.frame("months", is_group)
+    table = df.groupby("month")[["count", "sent"]].sum()
+    table["received"] = table["count"] - table["sent"]
+    table.index = [f"{m // 12}-{m % 12 + 1:02d}" for m in table.index]
+    return table[["sent", "received"]]
+
+
+def latency_distribution(rollups):
+    """Reply delays in private chats: counts per delay bin for my replies and theirs."""
+    import pandas as pd
+
+    df = rollups.frame("latency", is_group=False)
+    table = df.groupby("bin")[["mine", "theirs"]].sum().reindex(range(len(LATENCY_LABELS)), fill_value=0)
+    table.index = pd.CategoricalIndex(LATENCY_LABELS, categories=LATENCY_LABELS, ordered=True)
+    return table
+
+
+def median_latency(table):
+    """Approximate median delay per column of latency_distribution(), as a bin label."""
+    medians = {}
+    for column in table.columns:
+        cum = table[column].cumsum()
+        medians[column] = table.index[(cum >= cum.iloc[-1] / 2).argmax()] if cum.iloc[-1] else None
+    return medians
+
+
+def type_mix(rollups, is_group=None):
+    """Message count per type, labelled where the type is known."""
+    df = rollups.frame("types", is_group)
+    counts = df.groupby("type")["count"].sum().sort_values(ascending=False)
+    counts.index = [TYPE_LABELS.get(t, "💬 [Text]" if t == 1 else f"type {t}") for t in counts.index]
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the analytics rollups and print account-wide summaries.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output directory")
+    parser.add_argument("--top", type=int, default=10, help="Busiest chats to show")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    rollups = Rollups(args.parsed_dir)
+    changed = rollups.update(progress=lambda done, total: print(f"\r  {done}/{total} chats", end="", flush=True))
+    print(f"\nRollups: {changed} chats recomputed in {time.perf_counter() - t0:.1f}s")
+
+    t0 = time.perf_counter()
+    heat = activity_heatmap(rollups)
+    top = top_contacts_over_time(rollups, args.top)
+    latency = latency_distribution(rollups)
+    mix = type_mix(rollups)
+    print(f"Dashboards computed in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    print("\nMessages by weekday / hour:")
+    print(heat.to_string())
+    print("\nBusiest chats:")
+    print(top.sum().to_string())
+    print("\nReply delays (private chats):")
+    print(latency.to_string())
+    print(f"Median: {median_latency(latency)}")
+    print("\nMessage types:")
+    print(mix.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import queue
+import re
+import socket
+import threading
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from catalog import ORDERS, Catalog, open_catalog
+from chat_store import MISSING_TS, file_key, load_index, memoize, open_chat, ts_key
+from contact_index import load_contact_index
+from search_index import INDEX_NAME, SearchIndex
+from thumbnail_cache import chat_media_files
+
+# Read-only HTTP API over a parse output (and optionally its extraction, for media):
+#   GET /api/health
+#   GET /api/chats?offset=&limit=&order=&desc=&kind=group|private&has_voice=1&since=YYYY-MM-DD&q=
+#   GET /api/chats/<uuid>
+#   GET /api/chats/<uuid>/messages?offset=&limit=&since=&until=
+#   GET /api/search?q=&page=&order=relevance|recent
+#   GET /api/media/<uuid>/<message id>?kind=thumb|image|image_hd|video
+# Every response carries an ETag and Last-Modified derived from the files it was built
+# from, so clients revalidate with a 304 instead of downloading again. Bodies are built
+# once per ETag (shared chat_store LRU), gzipped for clients that accept it, and
+# connections are kept alive (HTTP/1.1).
+DEFAULT_PORT = 8765
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+GZIP_MIN_BYTES = 1024
+KEEPALIVE_SECONDS = 30
+UUID_RE = re.compile(r"[0-9A-Za-z_\-]+")   # chat file names (md5 hex); no path separators
+MEDIA_TYPES = {
+    ".pic": "image/jpeg", ".pic_hd": "image/jpeg", ".pic_thum": "image/jpeg",
+    ".video_thum": "image/jpeg", ".mp4": "video/mp4",
+}
+MEDIA_KINDS = ("thumb", "image", "image_hd", "video")
+# Host names accepted besides the bound address; anything else (e.g. a web page's domain
+# re-bound to 127.0.0.1 by DNS rebinding) is refused
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int(params, name, default, lo=0, hi=None):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    value = max(lo, value)
+    return min(hi, value) if hi is not None else value
+
+
+def _versions(paths):
+    """file_key of every existing path: the version an ETag is derived from."""
+    return tuple(file_key(p) for p in paths if os.path.exists(p))
+
+
+@contextmanager
+def _pooled(pool, factory):
+    """A connection from `pool` (new if none is free), returned to it afterwards."""
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = factory()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+class Archive:
+    """
+    The parse output behind the API. Each request thread borrows a Catalog / SearchIndex
+    from a pool, so SQLite connections are never shared by two requests at once.
+    """
+
+    def __init__(self, parsed_dir, extract_dir=None):
+        self.parsed_dir = Path(parsed_dir)
+        self.index_path = self.parsed_dir / "index.json"
+        self.chats_dir = self.parsed_dir / "chats"
+        self.extract_dir = Path(extract_dir) if extract_dir else None
+        self._catalogs = queue.LifoQueue()
+        self._search_indexes = queue.LifoQueue()
+        self._catalog_lock = threading.Lock()
+        self._catalog_version = None
+
+    def catalog(self):
+        version = _versions([self.index_path])
+        if version != self._catalog_version:
+            # index.json changed (re-parse): bring catalog.sqlite up to date once
+            with self._catalog_lock:
+                if version != self._catalog_version:
+                    open_catalog(self.parsed_dir).close()
+                    self._catalog_version = version
+        return _pooled(self._catalogs, lambda: Catalog(self.parsed_dir))
+
+    def search_index(self):
+        return _pooled(self._search_indexes, lambda: SearchIndex(self.parsed_dir))
+
+    def close(self):
+        """Close the idle pooled connections."""
+        for pool in (self._catalogs, self._search_indexes):
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    def chat_path(self, uuid):
+        if not UUID_RE.fullmatch(uuid):
+            raise ApiError(404, "unknown chat")
+        path = self.chats_dir / f"{uuid}.json"
+        if not path.exists():
+            raise ApiError(404, "unknown chat")
+        return path
+
+    # --- endpoints: each returns (version files, build) so the handler can answer 304s without building ---
+
+    def health(self, params):
+        return [self.index_path], lambda: {"chats": len(load_index(self.index_path)) if self.index_path.exists() else 0}
+
+    def chats(self, params):
+        offset = _int(params, "offset", 0)
+        limit = _int(params, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+        order = params.get("order", "last_ts")
+        if order not in ORDERS:
+            raise ApiError(400, f"order must be one of {', '.join(ORDERS)}")
+        desc = params.get("desc", "1") not in ("0", "false")
+        filters = {
+            "is_group": {"group": True, "private": False}.get(params.get("kind")),
+            "has_voice": params.get("has_voice") in ("1", "true"),
+            "active_since": params.get("since"),
+        }
+        query = params.get("q", "").strip()
+
+        def build():
+            with self.catalog() as catalog:
+                if query:
+                    # Contact search ranks the matches; the catalog filters them
+                    hits = load_contact_index(self.index_path).search(query, limit=MAX_LIMIT)
+                    rank = {h["file_uuid"]: i for i, h in enumerate(hits)}
+                    rows = sorted(catalog.query(uuids=rank, **filters), key=lambda r: rank[r["file_uuid"]])
+                    return {"total": len(rows), "offset": offset, "limit": limit, "chats": rows[offset:offset + limit]}
+                return {
+                    "total": catalog.count(**filters), "offset": offset, "limit": limit,
+                    "chats": catalog.query(order=order, desc=desc, limit=limit, offset=offset, **filters),
+                }
+
+        return [self.index_path], build
+
+    def chat(self, params, uuid):
+        path = self.chat_path(uuid)
+
+        def build():
+            handle = open_chat(path)
+            row = next((r for r in load_index(self.index_path) if r.get("file_uuid") == uuid), {})
+            return {**row, **handle.meta, "file_uuid": uuid, "message_count": handle.count}
+
+        return [path, self.index_path], build
+
+    def messages(self, params, uuid):
+        path = self.chat_path(uuid)
+        offset = _int(params, "offset", 0)
+        limit = _int(params, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+        since, until = params.get("since"), params.get("until")
+        if any(value and ts_key(value) == MISSING_TS for value in (since, until)):
+            raise ApiError(400, "since/until must be ISO dates")
+
+        def build():
+            handle = open_chat(path)
+            # Date bounds come from the timestamp index; offset/limit page inside them
+            start, stop = handle.range(since, until) if since or until else (0, handle.count)
+            first = min(stop, start + offset)
+            return {
+                "total": stop - start, "offset": offset, "limit": limit, "start": first,
+                "messages": handle.read(first, min(stop, first + limit)),
+            }
+
+        return [path], build
+
+    def search(self, params):
+        query = params.get("q", "").strip()
+        page = _int(params, "page", 0)
+        order = params.get("order", "relevance")
+        if order not in ("relevance", "recent"):
+            raise ApiError(400, "order must be relevance or recent")
+        index_path = self.parsed_dir / INDEX_NAME
+
+        def build():
+            with self.search_index() as index:
+                total, hits = index.search(query, page=page, order=order)
+                return {"total": total, "page": page, "hits": index.load_hits(hits)}
+
+        return [index_path, Path(f"{index_path}-wal"), self.index_path], build
+
+    def media(self, params, uuid, msg_id):
+        if self.extract_dir is None or not UUID_RE.fullmatch(uuid) or not msg_id.isdigit():
+            raise ApiError(404, "no media")
+        kind = params.get("kind", "thumb")
+        if kind not in MEDIA_KINDS:
+            raise ApiError(400, f"kind must be one of {', '.join(MEDIA_KINDS)}")
+        files = chat_media_files(self.extract_dir, uuid).get(int(msg_id), {})
+        path = files.get(kind) or (files.get("image") if kind == "image_hd" else None)
+        if not path:
+            raise ApiError(404, "no media")
+        return path
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive: every response has a Content-Length
+    timeout = KEEPALIVE_SECONDS     # idle keep-alive connections are closed after this
+    server_version = "WeChatArchiveAPI/1.0"
+    archive = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without this, Nagle + delayed ACK add ~40 ms per keep-alive request
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def host_allowed(self):
+        host, port = self.server.server_address[:2]
+        names = set(LOCAL_HOSTS)
+        if host not in ("0.0.0.0", "::"):
+            names.add(f"[{host}]" if ":" in host else host)
+        return (self.headers.get("Host") or "").strip().lower() in {f"{name}:{port}" for name in names}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        try:
+            if not self.host_allowed():
+                raise ApiError(403, "host not allowed")
+            if parts[:1] != ["api"]:
+                raise ApiError(404, "not found")
+            route = parts[1:]
+            if route == ["health"]:
+                versions, build = self.archive.health(params)
+            elif route == ["chats"]:
+                versions, build = self.archive.chats(params)
+            elif len(route) == 2 and route[0] == "chats":
+                versions, build = self.archive.chat(params, route[1])
+            elif len(route) == 3 and route[0] == "chats" and route[2] == "messages":
+                versions, build = self.archive.messages(params, route[1])
+            elif route == ["search"]:
+                versions, build = self.archive.search(params)
+            elif len(route) == 3 and route[0] == "media":
+                self.send_file(self.archive.media(params, route[1], route[2]))
+                return
+            else:
+                raise ApiError(404, "not found")
+            self.send_json(url, versions, build)
+        except ApiError as e:
+            self.send_error_json(e.status, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self.send_error_json(500, f"{type(e).__name__}: {e}")
+
+    # --- responses ---
+
+    def not_modified(self, etag, mtime_ns):
+        """True if the client's copy (If-None-Match, else If-Modified-Since) is current."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since and mtime_ns:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= mtime_ns // 1_000_000_000
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_json(self, url, versions, build):
+        versions = _versions(versions)
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        # gzip and identity bodies are different representations (Vary: Accept-Encoding): own ETags
+        key = repr((versions, url.path, url.query, use_gzip)).encode("utf-8")
+        etag = '"' + hashlib.blake2b(key, digest_size=12).hexdigest() + ("-gz" if use_gzip else "") + '"'
+        mtime_ns = max((v[1] for v in versions), default=0)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if mtime_ns:
+            headers["Last-Modified"] = formatdate(mtime_ns / 1e9, usegmt=True)
+        if self.not_modified(etag, mtime_ns):
+            self.send_body(304, b"", headers)
+            return
+
+        def encode():
+            body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            if use_gzip and len(body) >= GZIP_MIN_BYTES:
+                return b"g" + gzip.compress(body, compresslevel=5)
+            return b"-" + body
+
+        # One build per ETag (and encoding); the version is part of the ETag, so stale bodies are never served
+        body = memoize(("api", etag, use_gzip), encode, len)
+        if body[:1] == b"g":
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Type"] = "application/json; charset=utf-8"
+        self.send_body(200, body[1:], headers)
+
+    def send_file(self, path):
+        st = os.stat(path)
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        headers = {
+            "ETag": etag, "Last-Modified": formatdate(st.st_mtime, usegmt=True), "Cache-Control": "max-age=86400",
+            "Content-Type": MEDIA_TYPES.get(Path(path).suffix, "application/octet-stream"),
+        }
+        if self.not_modified(etag, st.st_mtime_ns):
+            self.send_body(304, b"", headers)
+            return
+        with open(path, "rb") as f:
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(st.st_size))
+            self.end_headers()
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def send_body(self, status, body, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        body = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+        self.send_body(status, body, {"Content-Type": "application/json; charset=utf-8"})
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, parsed_dir, extract_dir=None, host="127.0.0.1", port=DEFAULT_PORT, verbose=False):
+        self.archive = Archive(parsed_dir, extract_dir)
+        handler = type("Handler", (ApiHandler,), {"archive": self.archive})
+        self.verbose = verbose
+        super().__init__((host, port), handler)
+
+    def server_close(self):
+        super().server_close()
+        self.archive.close()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve_in_background(parsed_dir, extract_dir=None, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Start (once per process and port) a server thread, e.g. from the Streamlit app. Returns its URL.
+    A server started for other directories on the same port is stopped and replaced.
+    """
+    dirs = (str(Path(parsed_dir)), str(Path(extract_dir)) if extract_dir else None, host)
+    with _servers_lock:
+        server, server_dirs = _servers.get(port, (None, None))
+        if server is not None and server_dirs != dirs:
+            server.shutdown()
+            server.server_close()
+            server = None
+        if server is None:
+            server = ApiServer(parsed_dir, extract_dir, host, port)
+            _servers[port] = (server, dirs)
+            threading.Thread(target=server.serve_forever, name="api-server", daemon=True).start()
+        return server.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a parse output over a local read-only HTTP API.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output (index.json + chats/)")
+    parser.add_argument("--extract_dir", type=Path, default=None, help="Extraction folder, for /api/media")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (keep it local: the data is private)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = ApiServer(args.parsed_dir, args.extract_dir, args.host, args.port, args.verbose)
+    print(f"Serving {args.parsed_dir} on {server.url}/api/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import heapq
+import shutil
+import sqlite3
+import time
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+from catalog import chat_stats
+from chat_store import ChatHandle, append_chat, idx_path, load_index, read_idx, stream_chat, ts_key, write_chat
+from parse_db import write_index
+from search_index import update_index as update_search_index
+
+# An archive is a parse output that only ever grows: each new parse of a fresher backup is
+# merged into it, so messages deleted on the phone stay in the archive.
+# Per chat, archive.sqlite keeps a watermark (latest timestamp archived) and a Bloom filter
+# of (MesLocalID, CreateTime) keys. Messages after the watermark are new by definition and
+# are appended to the chat file in place; messages at or before it are only checked against
+# the Bloom filter when the new backup can contain unseen ones. A Bloom hit can be a false
+# positive, so each one is confirmed against the archived messages of that second.
+STATE_NAME = "archive.sqlite"
+BITS_PER_KEY = 24   # with HASHES below: ~1e-5 false positives at full capacity
+HASHES = 16
+MIN_CAPACITY = 1024
+
+
+def message_key(msg):
+    """64-bit key of one message: MesLocalID + CreateTime (as stored in the chat)."""
+    raw = f"{msg.get('id')}\x1f{msg.get('timestamp') or ''}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit keys (double hashing), vectorized with numpy."""
+
+    def __init__(self, capacity, data=None):
+        import numpy as np
+
+        self.capacity = capacity
+        self.nbits = capacity * BITS_PER_KEY
+        self.bits = np.frombuffer(data, dtype=np.uint8).copy() if data else np.zeros(self.nbits // 8 + 1, dtype=np.uint8)
+
+    def _positions(self, keys):
+        import numpy as np
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        h1 = keys & np.uint64(0xFFFFFFFF)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(HASHES, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.nbits)
+
+    def add(self, keys):
+        import numpy as np
+
+        if len(keys):
+            pos = self._positions(keys).ravel()
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8)))
+
+    def contains(self, keys):
+        """Bool array: False means definitely not added."""
+        import numpy as np
+
+        if not len(keys):
+            return np.zeros(0, dtype=bool)
+        pos = self._positions(keys)
+        return ((self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1).astype(bool)
+
+    def tobytes(self):
+        return self.bits.tobytes()
+
+
+class ArchiveState:
+    """archive.sqlite: per-chat watermark, message count and Bloom filter."""
+
+    def __init__(self, archive_dir):
+        self.conn = sqlite3.connect(Path(archive_dir) / STATE_NAME)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "file_uuid TEXT PRIMARY KEY, watermark TEXT, count INTEGER, capacity INTEGER, bloom BLOB)"
+        )
+
+    def get(self, file_uuid):
+        row = self.conn.execute(
+            "SELECT watermark, count, capacity, bloom FROM chats WHERE file_uuid = ?", (file_uuid,)
+        ).fetchone()
+        if row is None:
+            return None
+        watermark, count, capacity, bloom = row
+        return {"watermark": watermark, "count": count, "bloom": BloomFilter(capacity, bloom)}
+
+    def put(self, file_uuid, state):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?)",
+            (file_uuid, state["watermark"], state["count"], state["bloom"].capacity, state["bloom"].tobytes()),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def _timestamp(msg):
+    return msg.get("timestamp") or ""
+
+
+def _first_after(handle, ts, strict):
+    """First position whose timestamp is > ts (strict) or >= ts; the chat is in time order."""
+    if handle.timestamps is not None and ts:
+        # Timestamp index in the sidecar: no message reads
+        return (bisect_right if strict else bisect_left)(handle.timestamps, ts_key(ts))
+    lo, hi = 0, handle.count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_ts = _timestamp(handle.read(mid, mid + 1)[0])
+        if mid_ts > ts or (not strict and mid_ts == ts):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _new_state(chat_path, count):
+    """Watermark + Bloom filter (sized with room to grow) from a whole archived chat."""
+    bloom = BloomFilter(max(MIN_CAPACITY, 2 * count))
+    keys, watermark = [], ""
+    _meta, messages = stream_chat(chat_path)
+    for msg in messages:
+        keys.append(message_key(msg))
+        watermark = max(watermark, _timestamp(msg))
+    bloom.add(keys)
+    return {"watermark": watermark, "count": len(keys), "bloom": bloom}
+
+
+def _archived_keys(handle, msgs):
+    """message_key of the archived messages sharing a second with any of `msgs` (one slice read per second)."""
+    keys = set()
+    for ts in {_timestamp(m) for m in msgs}:
+        start = _first_after(handle, ts, strict=False)
+        stop = _first_after(handle, ts, strict=True)
+        keys.update(message_key(m) for m in handle.read(start, stop))
+    return keys
+
+
+def _merge_row(row, new_messages):
+    """Archive index row updated with the stats of `new_messages` (no chat re-read)."""
+    stats = chat_stats(row.get("friend_id"), new_messages)
+    merged = dict(row)
+    merged["message_count"] = row.get("message_count", 0) + len(new_messages)
+    for field in ("sent", "received", "voice_count"):
+        merged[field] = row.get(field, 0) + stats[field]
+    firsts = [ts for ts in (row.get("first_ts"), stats["first_ts"]) if ts]
+    lasts = [ts for ts in (row.get("last_ts"), stats["last_ts"]) if ts]
+    merged["first_ts"] = min(firsts) if firsts else None
+    merged["last_ts"] = max(lasts) if lasts else None
+    type_counts = dict(row.get("type_counts") or {})
+    for t, n in stats["type_counts"].items():
+        type_counts[t] = type_counts.get(t, 0) + n
+    merged["type_counts"] = type_counts
+    return merged
+
+
+def _copy_chat(src, dst):
+    """Copy a chat and its sidecar (mtime preserved, so the sidecar stays valid)."""
+    if read_idx(src) is not None:
+        shutil.copy2(idx_path(src), idx_path(dst))
+        shutil.copy2(src, dst)
+    else:
+        meta, messages = stream_chat(src)
+        write_chat(dst, {**meta, "messages": list(messages)})
+
+
+class Archive:
+    """Append-only history built from successive parse outputs."""
+
+    def __init__(self, archive_dir):
+        self.dir = Path(archive_dir)
+        self.chats_dir = self.dir / "chats"
+        self.chats_dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.dir / "index.json"
+        self.rows = {r["file_uuid"]: r for r in load_index(index_path)} if index_path.exists() else {}
+        self.state = ArchiveState(self.dir)
+
+    def merge_chat(self, row, new_path, full=False):
+        """
+        Merge one chat of a new parse into the archive. Returns the number of messages added.
+        full=True checks every older message against the Bloom filter, not only when the new
+        chat has more messages up to the watermark than the archive holds.
+        """
+        uuid = row["file_uuid"]
+        arch_path = self.chats_dir / f"{uuid}.json"
+        if not arch_path.exists():
+            _copy_chat(new_path, arch_path)
+            self.state.put(uuid, _new_state(arch_path, row.get("message_count", 0)))
+            self.rows[uuid] = row
+            return row.get("message_count", 0)
+        state = self.state.get(uuid)
+        if state is None:
+            # Chat archived without state (e.g. the archive started as a plain parse output)
+            state = _new_state(arch_path, self.rows.get(uuid, row).get("message_count", 0))
+            full = True
+
+        handle = ChatHandle(new_path)
+        # Strictly later than everything archived: new without any lookup
+        tail_start = _first_after(handle, state["watermark"], strict=True)
+        tail = handle.read(tail_start, handle.count) if tail_start < handle.count else []
+        # Same second as the watermark, or (when the counts say so) the whole older part
+        check_start = _first_after(handle, state["watermark"], strict=False)
+        if full or check_start > state["count"]:
+            check_start = 0
+        older = handle.read(check_start, tail_start) if check_start < tail_start else []
+        seen = state["bloom"].contains([message_key(m) for m in older])
+        hits = [m for m, hit in zip(older, seen) if hit]
+        # "Maybe seen" is not proof: a false positive must not drop a message for good
+        archived = _archived_keys(ChatHandle(arch_path), hits) if hits else set()
+        backfill = [m for m, hit in zip(older, seen) if not hit or message_key(m) not in archived]
+        if not tail and not backfill:
+            return 0
+
+        if backfill or not append_chat(arch_path, tail):
+            # Older messages go in the middle: one merge pass over the archived chat
+            meta, existing = stream_chat(arch_path)
+            merged = list(heapq.merge(existing, backfill, key=_timestamp)) + tail
+            write_chat(arch_path, {**meta, "messages": merged})
+
+        added = backfill + tail
+        state["count"] += len(added)
+        if tail:
+            state["watermark"] = max(state["watermark"], _timestamp(tail[-1]))
+        if state["count"] > state["bloom"].capacity:
+            state = _new_state(arch_path, state["count"])
+        else:
+            state["bloom"].add([message_key(m) for m in added])
+        self.state.put(uuid, state)
+        self.rows[uuid] = _merge_row(self.rows.get(uuid, row), added)
+        return len(added)
+
+    def merge(self, parsed_dir, full=False, progress=None):
+        """Merge a whole parse output. Returns (chats changed, messages added)."""
+        parsed_dir = Path(parsed_dir)
+        rows = load_index(parsed_dir / "index.json")
+        changed = added = 0
+        for n, row in enumerate(rows, 1):
+            new_path = parsed_dir / "chats" / f"{row['file_uuid']}.json"
+            if new_path.exists():
+                count = self.merge_chat(row, new_path, full)
+                changed += bool(count)
+                added += count
+            if progress:
+                progress(n, len(rows))
+        self.state.commit()
+        write_index(list(self.rows.values()), self.dir)
+        return changed, added
+
+    def close(self):
+        self.state.close()
+
+
+def merge_into_archive(parsed_dir, archive_dir, full=False, progress=None):
+    archive = Archive(archive_dir)
+    try:
+        changed, added = archive.merge(parsed_dir, full, progress)
+    finally:
+        archive.close()
+    reindexed = update_search_index(archive_dir)
+    print(f"Archive: {added} new messages in {changed} chats ({reindexed} chats re-indexed) -> {archive_dir}")
+    return changed, added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge a parse output into an append-only archive of all backups.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output of the newest backup")
+    parser.add_argument("--archive_dir", type=Path, required=True, help="Archive directory (created on first run)")
+    parser.add_argument("--full", action="store_true", help="Check every older message, not just the new tail")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    merge_into_archive(
+        args.parsed_dir, args.archive_dir, args.full,
+        progress=lambda done, total: print(f"\r  {done}/{total} chats", end="", flush=True),
+    )
+    print(f"Done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import dataclasses
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from transcribe_engine import SAMPLE_RATE, WINDOW_SECONDS, Clip
+
+FRAME_MS = 30
+# Silence kept around detected speech so word onsets/endings are not clipped
+PAD_SECONDS = 0.25
+# Gap of silence inserted between packed clips; whisper tends to start a new segment there
+PACK_GAP_SECONDS = 1.0
+# Only clips this short (after trimming) are worth packing together
+PACK_MAX_CLIP_SECONDS = 10.0
+# Bucketing sorts clips by size inside windows of this many clips
+BUCKET_WINDOW = 256
+
+
+def frame_energy_db(audio, sr=SAMPLE_RATE, frame_ms=FRAME_MS):
+    """RMS energy per frame in dBFS."""
+    n = int(sr * frame_ms / 1000)
+    frames = len(audio) // n
+    if frames == 0:
+        return np.empty(0, dtype=np.float32)
+    x = audio[:frames * n].reshape(frames, n)
+    rms = np.sqrt(np.mean(x * x, axis=1) + 1e-10)
+    return 20 * np.log10(rms)
+
+
+def detect_speech(audio, sr=SAMPLE_RATE, frame_ms=FRAME_MS, floor_db=-55.0, ratio=0.25, min_range_db=6.0):
+    """
+    Energy based voice activity detection.
+    Returns the (start, end) sample range from the first to the last active frame,
+    or None when the clip has no clear speech/silence contrast (nothing safe to trim).
+    """
+    db = frame_energy_db(audio, sr, frame_ms)
+    if len(db) == 0:
+        return None
+    noise = float(np.percentile(db, 10))
+    peak = float(db.max())
+    if peak - noise < min_range_db:
+        return None
+    threshold = max(floor_db, noise + ratio * (peak - noise))
+    active = np.flatnonzero(db > threshold)
+    if len(active) == 0:
+        return None
+    n = int(sr * frame_ms / 1000)
+    return int(active[0]) * n, (int(active[-1]) + 1) * n
+
+
+def trim_silence(audio, sr=SAMPLE_RATE, pad_seconds=PAD_SECONDS):
+    span = detect_speech(audio, sr)
+    if span is None:
+        return audio
+    pad = int(pad_seconds * sr)
+    return audio[max(0, span[0] - pad):min(len(audio), span[1] + pad)]
+
+
+def trim_clips(clips: List[Clip]) -> List[Clip]:
+    """Load and trim clips in place. Clips that fail to decode are reported and dropped."""
+    good = []
+    for clip in clips:
+        try:
+            clip.audio = trim_silence(clip.load())
+        except Exception as e:
+            print(f"Error loading {clip.path}: {e}")
+            continue
+        good.append(clip)
+    return good
+
+
+def bucket_clips(clips: List[Clip], window=BUCKET_WINDOW) -> List[Clip]:
+    """
+    Reorder clips so neighbours have similar length and batches waste little padding.
+    File size stands in for duration (no decoding needed). Sorting only inside windows
+    keeps clips of one chat close together, which keeps checkpoints cheap.
+    """
+    def size(clip):
+        try:
+            return os.path.getsize(clip.path)
+        except OSError:
+            return 0
+
+    out = []
+    for i in range(0, len(clips), window):
+        out.extend(sorted(clips[i:i + window], key=size))
+    return out
+
+
+@dataclasses.dataclass
+class Pack:
+    """Several short clips concatenated into one window; spans are (start, end) seconds per clip."""
+    clips: List[Clip]
+    spans: List[Tuple[float, float]]
+    audio: np.ndarray
+
+
+def pack_clips(clips: List[Clip], window=WINDOW_SECONDS, gap=PACK_GAP_SECONDS, max_clip=PACK_MAX_CLIP_SECONDS):
+    """
+    First-fit decreasing packing of short clips into `window`-second buffers.
+    Returns (packs, leftovers); leftovers are long clips or clips that ended up alone.
+    """
+    short = [c for c in clips if c.duration <= max_clip]
+    rest = [c for c in clips if c.duration > max_clip]
+
+    bins = []  # [used seconds, [clips]]
+    for clip in sorted(short, key=lambda c: c.duration, reverse=True):
+        for b in bins:
+            if b[0] + gap + clip.duration <= window:
+                b[0] += gap + clip.duration
+                b[1].append(clip)
+                break
+        else:
+            bins.append([clip.duration, [clip]])
+
+    packs = []
+    silence = np.zeros(int(gap * SAMPLE_RATE), dtype=np.float32)
+    for _used, members in bins:
+        if len(members) == 1:
+            rest.append(members[0])
+            continue
+        parts = []
+        spans = []
+        t = 0.0
+        for i, clip in enumerate(members):
+            if i:
+                parts.append(silence)
+                t += gap
+            parts.append(clip.load())
+            spans.append((t, t + clip.duration))
+            t += clip.duration
+        packs.append(Pack(members, spans, np.concatenate(parts).astype(np.float32)))
+    return packs, rest
+
+
+def split_segments(pack: Pack, segments):
+    """Assign each (start, end, text) segment to the clip whose span holds its midpoint."""
+    texts = [[] for _ in pack.clips]
+    for start, end, text in segments:
+        mid = (start + end) / 2
+        # Nearest span wins when the midpoint falls into a gap
+        best = min(
+            range(len(pack.spans)),
+            key=lambda i: 0 if pack.spans[i][0] <= mid <= pack.spans[i][1]
+            else min(abs(mid - pack.spans[i][0]), abs(mid - pack.spans[i][1])),
+        )
+        texts[best].append(text.strip())
+    return ["".join(t) if _is_cjk("".join(t)) else " ".join(t) for t in texts]
+
+
+def _is_cjk(text):
+    return any("一" <= ch <= "鿿" for ch in text)
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import plistlib
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# iOS backups live in MobileSync/Backup (Finder/iTunes default) or wherever they were copied
+SYSTEM_BACKUP_ROOT = Path.home() / "Library/Application Support/MobileSync/Backup"
+DOWNLOADS_BACKUP_ROOT = Path.home() / "Downloads"
+# Shared with pipeline_ui.py; the cache is keyed per root, so different root sets can share it
+DEFAULT_CACHE = Path.home() / "Downloads" / "wechat-back-up-export" / "backup_cache.json"
+# Cached results are returned at once; a background rescan runs when they are older than this
+REFRESH_SECONDS = 60
+
+
+def default_roots(user_root=None):
+    roots = [SYSTEM_BACKUP_ROOT, DOWNLOADS_BACKUP_ROOT]
+    if user_root:
+        roots.insert(0, Path(user_root))
+    return list(dict.fromkeys(Path(r) for r in roots))
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_plist(path):
+    try:
+        with open(path, "rb") as f:
+            return plistlib.load(f)
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return {}
+
+
+def _local_iso(value):
+    """Plist dates are naive UTC; shown in local time."""
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+def backup_size(path):
+    """Bytes used by a backup folder (files are stored one directory level deep)."""
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    with os.scandir(entry.path) as files:
+                        total += sum(f.stat(follow_symlinks=False).st_size for f in files if f.is_file(follow_symlinks=False))
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    return total
+
+
+def read_backup_info(path):
+    """Metadata of one backup from Info.plist, Status.plist and Manifest.plist."""
+    path = Path(path)
+    info = _read_plist(path / "Info.plist")
+    status = _read_plist(path / "Status.plist")
+    manifest = _read_plist(path / "Manifest.plist")
+    lockdown = manifest.get("Lockdown") or {}
+    date = _local_iso(info.get("Last Backup Date")) or _local_iso(status.get("Date"))
+    if date is None:
+        date = datetime.fromtimestamp(path.stat().st_mtime).isoformat(timespec="seconds")
+    return {
+        "path": str(path),
+        "device_name": info.get("Device Name") or info.get("Display Name") or lockdown.get("DeviceName"),
+        "product_type": info.get("Product Type"),
+        "ios_version": info.get("Product Version") or lockdown.get("ProductVersion"),
+        "date": date,
+        "encrypted": bool(manifest.get("IsEncrypted")),
+        "finished": status.get("SnapshotState", "finished") == "finished",
+        "size": None,
+    }
+
+
+def backup_label(backup):
+    """One line for a backup picker, e.g. "iPhone (iOS 17.2) · 2024-05-01 12:30 · 64.3 GB"."""
+    name = backup.get("device_name") or Path(backup["path"]).name[:12]
+    if backup.get("ios_version"):
+        name += f" (iOS {backup['ios_version']})"
+    parts = [name, backup["date"].replace("T", " ")[:16]]
+    if backup.get("size") is not None:
+        parts.append(f"{backup['size'] / 1024 ** 3:.1f} GB")
+    if backup.get("encrypted"):
+        parts.append("🔒 加密 (encrypted)")
+    if not backup.get("finished", True):
+        parts.append("⚠️ 未完成 (incomplete)")
+    return " · ".join(parts)
+
+
+class BackupDiscovery:
+    """
+    Backup folders under a set of roots, with their metadata, cached in a JSON file.
+    A root is only listed again when its mtime changes (its other folders are re-checked when
+    their own mtime does), and a backup's plists are only read again when the backup (or its
+    Manifest.db) changes; folder sizes are computed once per backup version, in the background.
+    """
+
+    def __init__(self, roots, cache_path=DEFAULT_CACHE):
+        self.roots = [Path(r) for r in roots]
+        self.cache_path = Path(cache_path)
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if isinstance(cache.get("roots"), dict) and isinstance(cache.get("backups"), dict):
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {"scanned_at": 0, "roots": {}, "backups": {}}
+
+    def _save_cache(self):
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.tmp{threading.get_ident()}")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._cache, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not save backup cache: {e}")
+
+    @property
+    def refreshing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _list_root(self, root, force):
+        """
+        Backup folders directly under `root`. The listing is cached while the root's mtime is
+        unchanged; folders without a Manifest.db yet (backup or copy in progress) are kept with
+        their own mtime and checked again once it changes.
+        """
+        mtime = _mtime_ns(root)
+        if mtime is None:
+            return []
+        cached = self._cache["roots"].get(str(root))
+        if cached and cached["mtime_ns"] == mtime and "pending" in cached and not force:
+            for path, pending_mtime in list(cached["pending"].items()):
+                current = _mtime_ns(path)
+                if current == pending_mtime:
+                    continue
+                if current is not None and os.path.exists(os.path.join(path, "Manifest.db")):
+                    del cached["pending"][path]
+                    cached["backups"].append(path)
+                else:
+                    cached["pending"][path] = current
+            return cached["backups"]
+        found, pending = [], {}
+        try:
+            for entry in os.scandir(root):
+                if not entry.is_dir():
+                    continue
+                if os.path.exists(os.path.join(entry.path, "Manifest.db")):
+                    found.append(entry.path)
+                else:
+                    pending[entry.path] = _mtime_ns(entry.path)
+            self.errors.pop(str(root), None)
+        except PermissionError as e:
+            self.errors[str(root)] = f"Permission denied: {e}"
+        except OSError as e:
+            self.errors[str(root)] = str(e)
+        self._cache["roots"][str(root)] = {"mtime_ns": mtime, "backups": found, "pending": pending}
+        return found
+
+    def _backup(self, path):
+        version = [_mtime_ns(path), _mtime_ns(os.path.join(path, "Manifest.db"))]
+        cached = self._cache["backups"].get(path)
+        if cached and cached.get("version") == version:
+            return cached
+        try:
+            backup = read_backup_info(path)
+        except OSError:
+            return None
+        backup["version"] = version
+        self._cache["backups"][path] = backup
+        return backup
+
+    def scan(self, force=False, sizes=False):
+        """Scan the roots now (cheap for unchanged folders). Returns the backups, newest first."""
+        with self._lock:
+            paths = [p for root in self.roots for p in self._list_root(root, force)]
+            backups = [b for b in map(self._backup, dict.fromkeys(paths)) if b is not None]
+        if sizes:
+            # The slow part runs outside the lock, so backups() keeps answering from the cache
+            measured = {b["path"]: backup_size(b["path"]) for b in backups if b.get("size") is None}
+        with self._lock:
+            if sizes:
+                for backup in backups:
+                    backup["size"] = measured.get(backup["path"], backup.get("size"))
+            # Forget backups under these roots that are gone, so the cache does not grow forever
+            known = {b["path"] for b in backups}
+            roots = {str(r) for r in self.roots}
+            for path in [p for p in self._cache["backups"] if p not in known and str(Path(p).parent) in roots]:
+                del self._cache["backups"][path]
+            self._cache["scanned_at"] = time.time()
+            self._save_cache()
+        return self._sorted(backups)
+
+    def backups(self):
+        """
+        Backups without waiting on the disk: the cached list (rescanned in the background
+        when older than REFRESH_SECONDS), or a quick scan without sizes on the first call.
+        """
+        with self._lock:
+            complete = all(str(r) in self._cache["roots"] for r in self.roots)
+            stale = time.time() - self._cache.get("scanned_at", 0) > REFRESH_SECONDS
+            paths = {p for r in self.roots for p in self._cache["roots"].get(str(r), {}).get("backups", [])}
+            backups = [b for p, b in self._cache["backups"].items() if p in paths]
+        if not complete:
+            backups = self.scan()
+        if not complete or stale:
+            self.refresh_in_background()
+        return self._sorted(backups)
+
+    def refresh_in_background(self, force=False):
+        """Rescan (including folder sizes) in a daemon thread, unless one is running."""
+        with self._lock:
+            if self.refreshing:
+                return
+            self._thread = threading.Thread(
+                target=self.scan, kwargs={"force": force, "sizes": True}, name="backup-discovery", daemon=True
+            )
+            self._thread.start()
+
+    @staticmethod
+    def _sorted(backups):
+        return sorted(backups, key=lambda b: b["date"], reverse=True)
+
+
+_discoveries = {}
+_discoveries_lock = threading.Lock()
+
+
+def get_discovery(roots=None, cache_path=DEFAULT_CACHE):
+    """Shared BackupDiscovery for these roots (one per process, e.g. across Streamlit reruns)."""
+    roots = default_roots() if roots is None else [Path(r) for r in roots]
+    key = (tuple(str(r) for r in roots), str(cache_path))
+    with _discoveries_lock:
+        discovery = _discoveries.get(key)
+        if discovery is None:
+            discovery = _discoveries[key] = BackupDiscovery(roots, cache_path)
+        return discovery
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List iOS backups with device name, iOS version, date and size.")
+    parser.add_argument("--root", type=Path, action="append", default=None, help="Folder to search (repeatable; default: MobileSync + Downloads)")
+    parser.add_argument("--cache", type=Path, default=DEFAULT_CACHE)
+    parser.add_argument("--sizes", action="store_true", help="Also compute folder sizes (reads every directory once)")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    discovery = BackupDiscovery(args.root or default_roots(), args.cache)
+    backups = discovery.scan(sizes=args.sizes)
+    for root, error in discovery.errors.items():
+        print(f"[{root}] {error}")
+    if args.json:
+        print(json.dumps(backups, ensure_ascii=False, indent=2))
+        return
+    for backup in backups:
+        print(f"- {backup['path']}\n    {backup_label(backup)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+from api_server import ApiServer
+from chat_store import load_index
+
+DEFAULT_QUERIES = ["哈哈", "好的", "明天", "ok"]
+
+
+def request_mix(rows, queries, page_size):
+    """Endless stream of API paths: chat list pages, message pages of random chats, searches."""
+    rows = [r for r in rows if r.get("message_count")]
+    while True:
+        roll = random.random()
+        if roll < 0.2:
+            yield f"/api/chats?offset={random.randrange(0, max(1, len(rows)), page_size)}&limit={page_size}"
+        elif roll < 0.9 and rows:
+            row = random.choice(rows)
+            pages = max(1, -(-row["message_count"] // page_size))
+            yield f"/api/chats/{row['file_uuid']}/messages?offset={random.randrange(pages) * page_size}&limit={page_size}"
+        else:
+            yield f"/api/search?q={quote(random.choice(queries))}"
+
+
+def client(base_url, paths, deadline, revalidate, stats, lock):
+    """One keep-alive connection sending requests until `deadline`."""
+    url = urlsplit(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+    etags = {}
+    latencies, statuses, received = [], {}, 0
+    while time.perf_counter() < deadline:
+        with lock:
+            path = next(paths)
+        headers = {"Accept-Encoding": "gzip"}
+        if path in etags and random.random() < revalidate:
+            headers["If-None-Match"] = etags[path]
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+            statuses["error"] = statuses.get("error", 0) + 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        statuses[resp.status] = statuses.get(resp.status, 0) + 1
+        received += len(body)
+        if resp.getheader("ETag"):
+            etags[path] = resp.getheader("ETag")
+    conn.close()
+    with lock:
+        stats["latencies"].extend(latencies)
+        stats["bytes"] += received
+        for status, n in statuses.items():
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + n
+
+
+def run(base_url, rows, clients, seconds, queries, page_size, revalidate):
+    paths = request_mix(rows, queries, page_size)
+    stats = {"latencies": [], "bytes": 0, "statuses": {}}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=client, args=(base_url, paths, deadline, revalidate, stats, lock))
+        for _ in range(clients)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return stats, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the local archive API (requests/sec, latency).")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output to serve and sample chats from")
+    parser.add_argument("--url", default=None, help="Test an already running api_server.py instead of starting one")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--page_size", type=int, default=50)
+    parser.add_argument("--revalidate", type=float, default=0.5, help="Share of repeat requests sent with If-None-Match")
+    parser.add_argument("--queries", nargs="*", default=DEFAULT_QUERIES, help="Search terms to mix in")
+    args = parser.parse_args()
+
+    rows = load_index(args.parsed_dir / "index.json")
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = ApiServer(args.parsed_dir, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = server.url
+    print(f"{len(rows)} chats, {sum(r.get('message_count', 0) for r in rows)} messages; "
+          f"{args.clients} clients for {args.seconds:.0f}s against {base_url}")
+
+    try:
+        stats, wall = run(base_url, rows, args.clients, args.seconds, args.queries, args.page_size, args.revalidate)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    latencies = sorted(stats["latencies"])
+    if not latencies:
+        print("No successful requests.")
+        return
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{len(latencies)} requests in {wall:.1f}s: {len(latencies) / wall:.0f} req/s, "
+          f"{stats['bytes'] / 1024 / 1024 / wall:.1f} MB/s received")
+    print(f"latency p50 {pct(0.5):.1f} ms | p95 {pct(0.95):.1f} ms | p99 {pct(0.99):.1f} ms")
+    print("status codes: " + json.dumps({str(k): v for k, v in sorted(stats["statuses"].items(), key=str)}))
+
+
+if __name__ == "__main__":
+    main()
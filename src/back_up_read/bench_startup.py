@@ -0,0 +1,98 @@
+import argparse
+import ast
+import importlib.util
+import subprocess
+import sys
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+
+# Streamlit apps whose module-level imports run on every cold start / code-change rerun
+APPS = ["pipeline_ui.py", "viewer.py"]
+# Must only be imported when transcription / analytics is actually used
+HEAVY_MODULES = ["torch", "whisper", "faster_whisper", "ctranslate2", "pandas", "tqdm", "numpy"]
+DEFAULT_BUDGET_MS = 300
+# Baseline every app pays regardless of our code: imported before timing starts (so a
+# module that pulls it in indirectly is not charged for it) and not counted against the budget
+BASELINE = ["streamlit"]
+
+
+def module_imports(app_path):
+    """Source of the app's module-level import statements (incl. try/except ImportError blocks)."""
+    tree = ast.parse(Path(app_path).read_text(encoding="utf-8"))
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = {alias.name.split(".")[0] for alias in node.names} | {(getattr(node, "module", None) or "").split(".")[0]}
+            if names & set(BASELINE):
+                continue
+            lines.append(ast.unparse(node))
+        elif isinstance(node, ast.Try) and any(isinstance(n, (ast.Import, ast.ImportFrom)) for n in node.body):
+            lines.append(ast.unparse(node))
+    return "\n".join(lines)
+
+
+def baseline_prelude(baseline=BASELINE):
+    """Code importing the baseline modules that are installed."""
+    return "".join(f"try:\n    import {m}\nexcept ImportError:\n    pass\n" for m in baseline)
+
+
+def measure(code, heavy=HEAVY_MODULES, exclude=(), prelude=""):
+    """
+    Run `prelude` and then `code` in a fresh interpreter with -X importtime.
+    Returns (total ms, [(cumulative ms, module)] of top-level imports, heavy modules loaded).
+    Top-level modules in `exclude` (e.g. interpreter startup, the baseline) are left out.
+    """
+    check = f"\nimport sys\nprint(','.join(m for m in {heavy!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", prelude + code + check],
+        cwd=current_dir, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    top = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Top-level imports are not indented under a parent
+        if not name.startswith("  ") and name.strip() not in exclude:
+            top.append((int(cumulative_us) / 1000, name.strip()))
+    loaded = [m for m in result.stdout.strip().splitlines()[-1].split(",") if m] if result.stdout.strip() else []
+    return sum(ms for ms, _name in top), top, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the Streamlit apps (excluding Streamlit itself).")
+    parser.add_argument("--apps", nargs="+", default=APPS)
+    parser.add_argument("--budget_ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="Show the N slowest imports")
+    args = parser.parse_args()
+
+    # Whatever a bare interpreter imports (site, encodings, ...) is not ours
+    _total, startup, _loaded = measure("pass")
+    startup = {name for _ms, name in startup}
+    baseline_ms, baseline, _loaded = measure(baseline_prelude(), heavy=(), exclude=startup)
+    installed = {name for _ms, name in baseline}
+    missing = [m for m in BASELINE if importlib.util.find_spec(m) is None]
+    print(f"baseline ({', '.join(BASELINE)}): {baseline_ms:.0f} ms, not counted")
+    if missing:
+        print(f"  not installed: {', '.join(missing)} (apps are measured without it)")
+    exclude = startup | installed
+
+    ok = True
+    for app in args.apps:
+        code = module_imports(current_dir / app)
+        total, top, loaded = measure(code, exclude=exclude, prelude=baseline_prelude())
+        status = "OK" if total <= args.budget_ms and not loaded else "FAIL"
+        ok = ok and status == "OK"
+        print(f"{app}: {total:.0f} ms (budget {args.budget_ms:.0f} ms) [{status}]")
+        for ms, name in sorted(top, reverse=True)[:args.top]:
+            print(f"  {ms:8.1f} ms  {name}")
+        if loaded:
+            print(f"  heavy modules imported at startup: {', '.join(loaded)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from audio_prep import bucket_clips
+from transcribe_engine import DEFAULT_BATCH_SIZE, Clip, available_backends, create_engine
+
+
+def collect_clips(audio_dir, limit):
+    files = sorted(f for f in os.listdir(audio_dir) if f.endswith(".mp3") or f.endswith(".wav"))
+    return [Clip(key=os.path.splitext(f)[0], path=os.path.join(audio_dir, f)) for f in files[:limit]]
+
+
+def bench_backend(backend, clips, model_name, language, batch_size, threads, trim=False, bucket=False, pack=False):
+    """
+    Returns (load_seconds, audio_seconds, wall_seconds, {key: text}) for one backend.
+    Audio is decoded before the timer starts so only preprocessing + inference is measured.
+    """
+    t0 = time.perf_counter()
+    engine = create_engine(backend, model_name=model_name, language=language, threads=threads)
+    load_seconds = time.perf_counter() - t0
+
+    for c in clips:
+        c.load()
+    audio_seconds = sum(c.duration for c in clips)
+
+    t0 = time.perf_counter()
+    if bucket:
+        clips = bucket_clips(clips)
+    texts = {clip.key: text for clip, text in engine.transcribe(clips, batch_size=batch_size, trim=trim, pack=pack)}
+    wall_seconds = time.perf_counter() - t0
+    if len(texts) < len(clips):
+        print(f"  [{backend}] {len(clips) - len(texts)} clips failed")
+    return load_seconds, audio_seconds, wall_seconds, texts
+
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def char_error_rate(reference, hypothesis):
+    """CER over all clips in `reference`; whitespace is ignored so it works for Chinese and Latin text alike."""
+    errors = 0
+    total = 0
+    for key, ref in reference.items():
+        ref = "".join(ref.split())
+        hyp = "".join(hypothesis.get(key, "").split())
+        errors += edit_distance(ref, hyp)
+        total += len(ref)
+    return errors / total if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure transcription throughput (audio-seconds per wall-second) per backend.")
+    parser.add_argument("--audio_dir", type=Path, required=True, help="Directory with converted .mp3/.wav voice notes")
+    parser.add_argument("--limit", type=int, default=50, help="Number of clips to benchmark")
+    parser.add_argument("--backends", nargs="*", default=None, help="Backends to compare (default: all installed)")
+    parser.add_argument("--model", default="small", help="Model size/name")
+    parser.add_argument("--language", default=None, help="Force language (e.g. zh) instead of auto-detect")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads per engine")
+    parser.add_argument("--compare_prep", action="store_true", help="Also run with VAD trimming, bucketing and packing")
+    parser.add_argument("--reference", type=Path, default=None, help="JSON {clip name: correct text} for accuracy (CER)")
+    args = parser.parse_args()
+
+    backends = args.backends or available_backends()
+    if not backends:
+        print("No transcription backend installed.")
+        exit(1)
+
+    # Preprocessing variants measured against the plain run on the same fixed sample
+    variants = [("plain", dict())]
+    if args.compare_prep:
+        variants.append(("trim+bucket", dict(trim=True, bucket=True)))
+        variants.append(("trim+bucket+pack", dict(trim=True, bucket=True, pack=True)))
+
+    reference = None
+    if args.reference:
+        with open(args.reference, "r", encoding="utf-8") as f:
+            reference = json.load(f)
+
+    print(f"Benchmarking {', '.join(backends)} on up to {args.limit} clips from {args.audio_dir}")
+    rows = []
+    for backend in backends:
+        backend_reference = reference
+        for variant, opts in variants:
+            clips = collect_clips(args.audio_dir, args.limit)
+            if not clips:
+                print("No audio files found.")
+                exit(1)
+            print(f"Running {backend} ({variant})...")
+            load_s, audio_s, wall_s, texts = bench_backend(
+                backend, clips, args.model, args.language, args.batch_size, args.threads, **opts
+            )
+            if backend_reference is None:
+                # Without ground truth, the plain run is the reference for the variants
+                backend_reference = texts
+            cer = char_error_rate(backend_reference, texts)
+            rows.append((backend, variant, len(clips), load_s, audio_s, wall_s, cer))
+
+    print("-" * 100)
+    print(f"{'Backend':<16} | {'Variant':<17} | {'Clips':>5} | {'Load (s)':>8} | {'Audio (s)':>9} | {'Wall (s)':>8} | {'Audio s/wall s':>14} | {'CER':>6}")
+    print("-" * 100)
+    for backend, variant, n, load_s, audio_s, wall_s, cer in rows:
+        speed = audio_s / wall_s if wall_s > 0 else 0.0
+        print(f"{backend:<16} | {variant:<17} | {n:>5} | {load_s:>8.1f} | {audio_s:>9.1f} | {wall_s:>8.1f} | {speed:>14.2f} | {cer:>6.1%}")
+    if reference is None and args.compare_prep:
+        print("CER is measured against each backend's plain run (pass --reference for ground truth).")
+
+
+if __name__ == "__main__":
+    main()
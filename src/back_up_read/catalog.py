@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+from chat_store import stream_chat
+
+CATALOG_NAME = "catalog.sqlite"
+STAT_FIELDS = ["first_ts", "last_ts", "sent", "received", "voice_count", "is_group", "type_counts"]
+ORDERS = {
+    "last_ts": "last_ts",
+    "first_ts": "first_ts",
+    "message_count": "message_count",
+    "voice_count": "voice_count",
+    "friend_name": "friend_name COLLATE NOCASE",
+}
+VOICE_TYPE = 34
+
+
+def is_group_chat(friend_id):
+    return str(friend_id or "").endswith("@chatroom")
+
+
+def chat_stats(friend_id, messages):
+    """Per-chat statistics, computed in one pass over the messages (which are in time order)."""
+    types = Counter()
+    sent = 0
+    first_ts = last_ts = None
+    for msg in messages:
+        types[msg.get("type")] += 1
+        if msg.get("is_sender"):
+            sent += 1
+        ts = msg.get("timestamp")
+        if ts:
+            if first_ts is None:
+                first_ts = ts
+            last_ts = ts
+    total = sum(types.values())
+    return {
+        "first_ts": first_ts,
+        "last_ts": last_ts,
+        "sent": sent,
+        "received": total - sent,
+        "voice_count": types.get(VOICE_TYPE, 0),
+        "is_group": is_group_chat(friend_id),
+        "type_counts": {str(t): n for t, n in types.most_common()},
+    }
+
+
+def has_stats(row):
+    return all(field in row for field in STAT_FIELDS)
+
+
+class Catalog:
+    """
+    index.json rows + statistics in an indexed SQLite table, for sorting/filtering
+    tens of thousands of chats without opening any chat file.
+    """
+
+    def __init__(self, parsed_dir):
+        self.path = Path(parsed_dir) / CATALOG_NAME
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "file_uuid TEXT PRIMARY KEY, friend_id TEXT, friend_name TEXT, message_count INTEGER, "
+            "first_ts TEXT, last_ts TEXT, sent INTEGER, received INTEGER, voice_count INTEGER, "
+            "is_group INTEGER, type_counts TEXT)"
+        )
+        for column in ("last_ts", "first_ts", "message_count", "voice_count"):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS chats_{column} ON chats ({column})")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def rebuild(self, rows):
+        """Replace the catalog with `rows` (index.json rows that carry the stat fields)."""
+        self.conn.execute("DELETE FROM chats")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    r["file_uuid"], r.get("friend_id"), r.get("friend_name"), r.get("message_count", 0),
+                    r.get("first_ts"), r.get("last_ts"), r.get("sent", 0), r.get("received", 0),
+                    r.get("voice_count", 0), int(bool(r.get("is_group"))),
+                    json.dumps(r.get("type_counts", {})),
+                )
+                for r in rows
+            ],
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    @staticmethod
+    def _where(is_group=None, has_voice=False, active_since=None, active_until=None, min_messages=0, uuids=None):
+        where, params = [], []
+        if is_group is not None:
+            where.append("is_group = ?")
+            params.append(int(is_group))
+        if has_voice:
+            where.append("voice_count > 0")
+        if active_since:
+            where.append("last_ts >= ?")
+            params.append(str(active_since))
+        if active_until:
+            # Started before the end of that day ("T99" sorts after any time of day)
+            where.append("first_ts < ?")
+            params.append(str(active_until) + "T99")
+        if min_messages:
+            where.append("message_count >= ?")
+            params.append(min_messages)
+        if uuids is not None:
+            uuids = list(uuids)
+            where.append(f"file_uuid IN ({','.join('?' * len(uuids))})")
+            params.extend(uuids)
+        return (" WHERE " + " AND ".join(where) if where else ""), params
+
+    def query(self, order="last_ts", desc=True, limit=None, offset=0, **filters):
+        """
+        Rows as dicts (index.json shape), filtered and sorted in SQLite.
+        Filters: is_group, has_voice, active_since / active_until (ISO dates, compared with
+        last_ts / first_ts), min_messages, uuids.
+        """
+        where, params = self._where(**filters)
+        sql = f"SELECT * FROM chats{where} ORDER BY {ORDERS[order]} {'DESC' if desc else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        rows = []
+        for r in self.conn.execute(sql, params):
+            row = dict(r)
+            row["is_group"] = bool(row["is_group"])
+            row["type_counts"] = json.loads(row["type_counts"] or "{}")
+            rows.append(row)
+        return rows
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        return self.conn.execute(f"SELECT COUNT(*) FROM chats{where}", params).fetchone()[0]
+
+
+def fill_missing_stats(parsed_dir, rows):
+    """Stats for rows from an index.json written before the catalog existed (reads those chats once)."""
+    filled = 0
+    for row in rows:
+        if has_stats(row):
+            continue
+        chat_path = Path(parsed_dir) / "chats" / f"{row['file_uuid']}.json"
+        if chat_path.exists():
+            _meta, messages = stream_chat(chat_path)
+            row.update(chat_stats(row.get("friend_id"), messages))
+            filled += 1
+    return filled
+
+
+def open_catalog(parsed_dir):
+    """
+    Catalog for a parse output, rebuilt from index.json if missing or older than it.
+    Old index.json files are upgraded in place with the stat fields.
+    """
+    parsed_dir = Path(parsed_dir)
+    index_path = parsed_dir / "index.json"
+    catalog = Catalog(parsed_dir)
+    catalog_mtime = catalog.path.stat().st_mtime_ns
+    stale = not len(catalog) or (index_path.exists() and os.stat(index_path).st_mtime_ns > catalog_mtime)
+    if stale and index_path.exists():
+        with open(index_path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        if fill_missing_stats(parsed_dir, rows):
+            tmp_path = index_path.with_name(index_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, index_path)
+        catalog.rebuild(rows)
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chat catalog and list chats by activity.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output directory")
+    parser.add_argument("--order", choices=sorted(ORDERS), default="last_ts")
+    parser.add_argument("--asc", action="store_true")
+    parser.add_argument("--groups", choices=["all", "only", "none"], default="all")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    catalog = open_catalog(args.parsed_dir)
+    is_group = {"all": None, "only": True, "none": False}[args.groups]
+    rows = catalog.query(order=args.order, desc=not args.asc, is_group=is_group, limit=args.limit)
+    print(f"{len(catalog)} chats ({(time.perf_counter() - t0) * 1000:.1f} ms)")
+    for r in rows:
+        print(f"{(r['last_ts'] or '')[:10]}  {r['message_count']:>7}  voice {r['voice_count']:>5}  {r['friend_name']}")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
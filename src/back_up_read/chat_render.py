@@ -0,0 +1,194 @@
+import base64
+import html
+from datetime import date
+
+from chat_store import memoize
+from thumbnail_cache import image_mime
+
+# Pages are aligned to multiples of PAGE_SIZE so a rendered page stays valid (and cached)
+# no matter which page the user navigated from.
+PAGE_SIZE = 100
+# At most this many pages are on screen; loading more drops pages from the other end
+MAX_PAGES = 5
+
+TYPE_LABELS = {3: "🖼️ [Image]", 34: "🔊 [Voice]", 43: "🎬 [Video]", 47: "😊 [Sticker]", 49: "🔗 [Link/AppMsg]"}
+
+CHAT_CSS = """
+<style>
+    .chat-page { display: flex; flex-direction: column; }
+    .chat-container { display: flex; width: 100%; margin-bottom: 5px; }
+    .sender-right { justify-content: flex-end; }
+    .sender-left { justify-content: flex-start; }
+    .chat-message {
+        padding: 10px;
+        border-radius: 10px;
+        margin-bottom: 10px;
+        max-width: 70%;
+        display: inline-block;
+        word-wrap: break-word;
+    }
+    .bubble-right { background-color: #95ec69; /* WeChat Green */ color: black; border-top-right-radius: 2px; }
+    .bubble-left { background-color: #ffffff; color: black; border: 1px solid #e0e0e0; border-top-left-radius: 2px; }
+    .meta-info { font-size: 0.75em; color: #888; margin-bottom: 4px; }
+    .page-mark { text-align: center; font-size: 0.7em; color: #b0b0b0; margin: 6px 0; }
+    .chat-thumb { display: block; max-width: 240px; max-height: 240px; border-radius: 6px; }
+</style>
+"""
+
+
+class MessageList:
+    """In-memory stand-in for a ChatHandle (count + read), e.g. for filtered messages."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.count = len(messages)
+
+    def read(self, start, stop):
+        return self.messages[max(0, start):max(0, stop)]
+
+
+class ChatSlice:
+    """Messages [start, stop) of a ChatHandle, e.g. one date range; pages stay cached per range."""
+
+    def __init__(self, handle, start, stop):
+        self.handle = handle
+        self.start = start
+        self.count = stop - start
+        self.key = handle.key + ("slice", start, stop)
+
+    def read(self, start, stop):
+        start, stop = max(0, start), min(self.count, stop)
+        return self.handle.read(self.start + start, self.start + stop) if start < stop else []
+
+    def position(self, day):
+        return max(0, min(self.count, self.handle.position(day) - self.start))
+
+
+def thumb_html(data, msg_type):
+    img = f'<img class="chat-thumb" src="data:{image_mime(data) or "image/jpeg"};base64,{base64.b64encode(data).decode("ascii")}">'
+    return img + ("🎬" if msg_type == 43 else "")
+
+
+def render_message(msg, friend_name, thumb=None):
+    is_me = msg.get("is_sender")
+    side = "right" if is_me else "left"
+    content = str(msg.get("content") or "")
+    if msg.get("type") == 34 and msg.get("transcription"):
+        content = f"🔊 {msg['transcription']}"
+    elif msg.get("type") in TYPE_LABELS:
+        content = TYPE_LABELS[msg["type"]]
+    content = thumb_html(thumb, msg.get("type")) if thumb else html.escape(content).replace("\n", "<br>")
+    sender = "我" if is_me else (msg.get("sender") or friend_name)
+    return (
+        f'<div class="chat-container sender-{side}"><div class="chat-message bubble-{side}">'
+        f'<div class="meta-info">{html.escape(str(sender))} · {str(msg.get("timestamp", ""))[:16]}</div>'
+        f"{content}</div></div>"
+    )
+
+
+def render_page(messages, friend_name, start=0, thumbs=None):
+    """One HTML block for a page of messages (a single Streamlit delta)."""
+    thumbs = thumbs or {}
+    parts = [f'<div class="chat-page"><div class="page-mark">#{start + 1}</div>']
+    parts.extend(render_message(m, friend_name, thumbs.get(m.get("id"))) for m in messages)
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def page_count(source, page_size=PAGE_SIZE):
+    return max(1, -(-source.count // page_size))
+
+
+def page_html(source, page, friend_name, page_size=PAGE_SIZE, media=None):
+    """
+    HTML for page `page`; only that page's messages are read.
+    For chat files the result is kept in the shared chat_store cache per file version.
+    `media` (thumbnail_cache.ChatMedia) adds image/video thumbnails that are ready.
+    """
+    start = page * page_size
+    messages = source.read(start, start + page_size)
+
+    def build():
+        return render_page(messages, friend_name, start, media.thumbnails(messages) if media else None)
+
+    key = getattr(source, "key", None)
+    if key is None:
+        return build()
+    if media:
+        key = key + media.page_key(messages)
+    return memoize(("page_html",) + key + (page, page_size, friend_name), build, len)
+
+
+def find_date(source, day):
+    """Index of the first message on or after `day` (binary search, one message read per step)."""
+    if hasattr(source, "position"):
+        # Chat files answer this from their timestamp index
+        return source.position(day)
+    target = day.isoformat() if isinstance(day, date) else str(day)
+    lo, hi = 0, source.count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        msg = source.read(mid, mid + 1)
+        if msg and str(msg[0].get("timestamp", "")) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def first_date(source):
+    msgs = source.read(0, 1)
+    try:
+        return date.fromisoformat(str(msgs[0]["timestamp"])[:10]) if msgs else None
+    except ValueError:
+        return None
+
+
+def show_chat_pages(source, friend_name, key, page_size=PAGE_SIZE, media=None):
+    """
+    Paged chat view: newest page first, "load older" / "newer" / jump-to-date navigation.
+    The visible window is kept in session_state, so reruns only render pages not cached yet.
+    """
+    # Only this function needs Streamlit; the HTML helpers are also used by export_engine
+    import streamlit as st
+
+    if source.count == 0:
+        st.info("没有消息 (No messages)")
+        return
+    last = page_count(source, page_size) - 1
+    # Pages are aligned from the first message: a short last page also shows the one before it,
+    # so the newest view always holds at least a full page of messages
+    newest = (max(0, last - 1) if source.count % page_size else last, last)
+    state_key = f"chat_pages_{key}"
+    first_page, last_page = st.session_state.get(state_key, newest)
+    first_page, last_page = max(0, min(first_page, last)), max(0, min(last_page, last))
+
+    col_old, col_new, col_latest, col_date = st.columns([1, 1, 1, 2])
+    if col_old.button("⬆️ 加载更早 (Load older)", key=f"{state_key}_older", disabled=first_page == 0):
+        first_page = max(0, first_page - 1)
+        last_page = min(last_page, first_page + MAX_PAGES - 1)
+    if col_new.button("⬇️ 更新的 (Newer)", key=f"{state_key}_newer", disabled=last_page == last):
+        last_page = min(last, last_page + 1)
+        first_page = max(first_page, last_page - MAX_PAGES + 1)
+    if col_latest.button("⏬ 最新 (Latest)", key=f"{state_key}_latest", disabled=last_page == last):
+        first_page, last_page = newest
+    start_day = first_date(source)
+    day = col_date.date_input("跳转日期 (Jump to date)", value=None, min_value=start_day, key=f"{state_key}_date")
+    if day is not None and st.session_state.get(f"{state_key}_day") != day:
+        # Jump only when the picked date changes; afterwards the buttons move the window
+        st.session_state[f"{state_key}_day"] = day
+        first_page = min(find_date(source, day), max(0, source.count - 1)) // page_size
+        last_page = min(first_page + 1, last)
+    st.session_state[state_key] = (first_page, last_page)
+
+    shown_from = first_page * page_size
+    shown_to = min(source.count, (last_page + 1) * page_size)
+    st.caption(f"显示第 {shown_from + 1}-{shown_to} 条 (共 {source.count} 条) | Showing {shown_from + 1}-{shown_to} of {source.count}")
+    st.markdown(CHAT_CSS, unsafe_allow_html=True)
+    for page in range(first_page, last_page + 1):
+        st.markdown(page_html(source, page, friend_name, page_size, media), unsafe_allow_html=True)
+    if media and media.cache.pending:
+        # Thumbnails are built in the background; the page shows them on the next rerun
+        col_wait, col_refresh = st.columns([3, 1])
+        col_wait.caption(f"⏳ 正在生成 {media.cache.pending} 张缩略图 (Generating thumbnails)")
+        col_refresh.button("🔄 刷新 (Refresh)", key=f"{state_key}_thumbs")
@@ -0,0 +1,132 @@
+import bisect
+import heapq
+from collections import Counter
+
+from chat_store import cached_for_file, load_index
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    # Pinyin matching is optional: `pip install pypinyin`
+    lazy_pinyin = None
+
+DEFAULT_LIMIT = 100
+# Grams shared by more than this fraction of contacts carry no signal for fuzzy matching
+COMMON_GRAM_RATIO = 0.2
+# Queries this short have no bigram inside a name (e.g. "明" in "张明华"): scan for substrings instead
+SHORT_QUERY = 2
+
+
+def _grams(text):
+    text = f" {text} "
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def search_keys(row):
+    """Lowercase strings a contact can be found by: name, id, name words, pinyin and pinyin initials."""
+    name = str(row.get("friend_name") or "").lower()
+    keys = {name, str(row.get("friend_id") or "").lower()}
+    keys.update(name.split())
+    if lazy_pinyin is not None and name:
+        syllables = lazy_pinyin(name)
+        keys.add("".join(syllables))
+        keys.add("".join(lazy_pinyin(name, style=Style.FIRST_LETTER)))
+    keys.discard("")
+    return keys
+
+
+class ContactIndex:
+    """
+    Prebuilt contact finder over index.json rows.
+    - prefix search: bisect over one sorted array of (key, contact) pairs
+    - pinyin: full and initial-letter pinyin are just more keys (when pypinyin is installed)
+    - fuzzy: bigram inverted index picks candidates, scored by gram overlap
+    - substring: linear scan, only for 1-2 character queries
+    Results are ranked by message count.
+    """
+
+    def __init__(self, rows):
+        # Position in self.rows doubles as rank: most messages first
+        self.rows = sorted(rows, key=lambda r: r.get("message_count", 0), reverse=True)
+        pairs = []
+        self._grams = {}
+        self._text = []
+        for pos, row in enumerate(self.rows):
+            keys = search_keys(row)
+            pairs.extend((key, pos) for key in keys)
+            self._text.append("\n".join(keys))
+            grams = set()
+            for key in keys:
+                grams |= _grams(key)
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(pos)
+        pairs.sort()
+        self._keys = [k for k, _pos in pairs]
+        self._positions = [pos for _k, pos in pairs]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def prefix(self, query):
+        """Positions of contacts with any key starting with `query`."""
+        found = set()
+        i = bisect.bisect_left(self._keys, query)
+        while i < len(self._keys) and self._keys[i].startswith(query):
+            found.add(self._positions[i])
+            i += 1
+        return found
+
+    def fuzzy(self, query, limit, exclude=()):
+        """Top `limit` positions by bigram overlap with the query (typos, substrings, reordered words)."""
+        grams = _grams(query)
+        if not grams:
+            return []
+        common = max(1, int(len(self.rows) * COMMON_GRAM_RATIO))
+        overlap = Counter()
+        inner = 0
+        for gram in grams:
+            postings = self._grams.get(gram, ())
+            if len(postings) <= common:
+                overlap.update(postings)
+                # Padding grams (" x", "x ") only match at a key's edges: they help ranking but
+                # must not raise the bar for substrings / typos inside a name
+                inner += gram[0] != " " and gram[-1] != " "
+        # Need at least half the usable inner grams to match; rank ties by message count (lower position)
+        need = max(1, inner // 2)
+        scored = ((-n, pos) for pos, n in overlap.items() if n >= need and pos not in exclude)
+        return [pos for _n, pos in heapq.nsmallest(limit, scored)]
+
+    def substring(self, query, limit, exclude=()):
+        """First `limit` positions (by message count) with `query` anywhere in a key."""
+        found = []
+        for pos, text in enumerate(self._text):
+            if query in text and pos not in exclude:
+                found.append(pos)
+                if len(found) == limit:
+                    break
+        return found
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Up to `limit` rows: prefix matches by message count, then substring (short queries) and
+        fuzzy matches, and a substring scan when fuzzy matching finds nothing.
+        """
+        query = (query or "").strip().lower()
+        if not query:
+            return self.rows[:limit]
+        hits = heapq.nsmallest(limit, self.prefix(query))
+        scanned = len(hits) < limit and len(query) <= SHORT_QUERY
+        if scanned:
+            hits += self.substring(query, limit - len(hits), exclude=set(hits))
+        if len(hits) < limit:
+            fuzzy = self.fuzzy(query, limit - len(hits), exclude=set(hits))
+            if not fuzzy and not scanned:
+                # Every gram of the query is too common to index: fall back to a scan
+                fuzzy = self.substring(query, limit - len(hits), exclude=set(hits))
+            hits += fuzzy
+        return [self.rows[pos] for pos in hits]
+
+
+def load_contact_index(index_path):
+    """ContactIndex for index.json, built once per file version and shared across sessions."""
+    return cached_for_file("contacts", index_path, lambda p: ContactIndex(load_index(p)))
@@ -0,0 +1,213 @@
+import argparse
+import csv
+import html
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import date, timedelta
+from pathlib import Path
+
+from chat_render import CHAT_CSS, render_message
+from chat_store import load_index, stream_chat
+
+FORMATS = {"json": ".json", "ndjson": ".ndjson", "csv": ".csv", "txt": ".txt", "html": ".html"}
+MIME_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "txt": "text/plain",
+    "html": "text/html",
+}
+CSV_FIELDS = ["id", "timestamp", "sender", "is_sender", "type", "content", "transcription"]
+
+
+def safe_name(raw_name, max_len=50):
+    """
+    Filename-safe version of a contact name.
+    Keeps word characters, CJK, spaces and dashes; anything path-like or unusual is dropped
+    (such names tend to trigger macOS quarantine / "malware" false positives).
+    """
+    name = re.sub(r'[^\w\s一-鿿-]', '', str(raw_name or '')).strip()
+    name = re.sub(r'\s+', ' ', name)[:max_len]
+    return name or "unknown_friend"
+
+
+def export_filename(meta, fmt, file_uuid=None):
+    suffix = f"_{file_uuid[:8]}" if file_uuid else ""
+    return f"wechat_{safe_name(meta.get('friend_name'))}{suffix}{FORMATS[fmt]}"
+
+
+def _text(msg):
+    text = str(msg.get("content") or "")
+    if msg.get("type") == 34 and msg.get("transcription"):
+        text = f"[Voice] {msg['transcription']}"
+    return text
+
+
+def _write_json(f, meta, messages):
+    head = json.dumps(meta, ensure_ascii=False, indent=2)[:-2]
+    f.write((head + ",\n" if meta else "{\n") + '  "messages": [')
+    first = True
+    for msg in messages:
+        f.write("\n    " if first else ",\n    ")
+        f.write(json.dumps(msg, ensure_ascii=False))
+        first = False
+    f.write("\n  ]\n}\n")
+
+
+def _write_ndjson(f, meta, messages):
+    for msg in messages:
+        f.write(json.dumps(msg, ensure_ascii=False))
+        f.write("\n")
+
+
+def _write_csv(f, meta, messages):
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(messages)
+
+
+def _write_txt(f, meta, messages):
+    f.write(f"Chat History with {meta.get('friend_name', '')}\n")
+    if meta.get("filter"):
+        f.write(f"Filter: {meta['filter']}\n")
+    f.write("\n")
+    for msg in messages:
+        f.write(f"[{msg.get('timestamp', '')}] {msg.get('sender', '')}: {_text(msg)}\n")
+
+
+def _write_html(f, meta, messages):
+    name = meta.get("friend_name", "")
+    f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(str(name))}</title>')
+    f.write(CHAT_CSS)
+    f.write(f"</head><body><h2>{html.escape(str(name))}</h2>\n")
+    for msg in messages:
+        f.write(render_message(msg, name))
+        f.write("\n")
+    f.write("</body></html>\n")
+
+
+WRITERS = {"json": _write_json, "ndjson": _write_ndjson, "csv": _write_csv, "txt": _write_txt, "html": _write_html}
+
+
+def write_export(f, fmt, meta, messages, include_voice=True):
+    """Write one chat to text stream `f`, one message at a time. Returns the message count."""
+    written = 0
+
+    def counted():
+        nonlocal written
+        for msg in messages:
+            if include_voice or msg.get("type") != 34:
+                written += 1
+                yield msg
+
+    WRITERS[fmt](f, meta, counted())
+    return written
+
+
+def export_chat(chat_path, out_path, fmt="json", include_voice=True, meta=None, messages=None, since=None, until=None):
+    """
+    Export one chat file to out_path (written to a temp file, then renamed).
+    Pass meta/messages to export an already loaded chat instead of streaming it from disk.
+    since / until (until exclusive) export a time window, read via the chat's timestamp index.
+    """
+    if messages is None:
+        meta, messages = stream_chat(chat_path, since=since, until=until)
+        if since is not None or until is not None:
+            # Whole days are shown inclusive, as given on the command line / date picker
+            last = until - timedelta(days=1) if type(until) is date else until
+            meta = dict(meta, filter=f"{since or ''} ~ {last or ''}")
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    # utf-8-sig so Excel detects the encoding of CSV exports
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    with open(tmp_path, "w", encoding=encoding, newline="" if fmt == "csv" else None) as f:
+        count = write_export(f, fmt, meta, messages, include_voice)
+    os.replace(tmp_path, out_path)
+    return count
+
+
+def _export_job(args):
+    chat_path, out_path, fmt, include_voice, since, until = args
+    count = export_chat(chat_path, out_path, fmt, include_voice, since=since, until=until)
+    if not count and (since is not None or until is not None):
+        # Nothing in the window: leave the chat out
+        os.remove(out_path)
+        return None, 0
+    return str(out_path), count
+
+
+def export_all(parsed_dir, output, fmt="json", include_voice=True, workers=None, progress=None, since=None, until=None):
+    """
+    Export every chat in index.json into directory `output`, or into a ZIP if it ends in .zip.
+    Chats are exported in parallel processes; each streams its chat, so memory stays bounded.
+    With since / until (until exclusive) only that window is exported, and chats without
+    messages in it are skipped. Returns (chats, messages).
+    """
+    # Process pool machinery is only needed here; keep it out of the UI's import time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    parsed_dir = Path(parsed_dir)
+    output = Path(output)
+    to_zip = output.suffix.lower() == ".zip"
+    rows = load_index(parsed_dir / "index.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    out_dir = Path(tempfile.mkdtemp(prefix="wechat_export_", dir=output.parent)) if to_zip else output
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    for row in rows:
+        chat_path = parsed_dir / "chats" / f"{row['file_uuid']}.json"
+        if chat_path.exists():
+            name = export_filename(row, fmt, row["file_uuid"])
+            jobs.append((chat_path, out_dir / name, fmt, include_voice, since, until))
+
+    total_msgs = exported = 0
+    zf = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) if to_zip else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(_export_job, job) for job in jobs]
+            for done, future in enumerate(as_completed(futures), 1):
+                out_path, count = future.result()
+                total_msgs += count
+                if out_path is not None:
+                    exported += 1
+                    if zf is not None:
+                        # Finished files move into the archive right away, so the temp dir stays small
+                        zf.write(out_path, Path(out_path).name)
+                        os.remove(out_path)
+                if progress:
+                    progress(done, len(jobs))
+    finally:
+        if zf is not None:
+            zf.close()
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return exported, total_msgs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export parsed chats (streaming, all chats in parallel).")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output directory")
+    parser.add_argument("--output", "-o", type=Path, required=True, help="Output directory, or a .zip file")
+    parser.add_argument("--format", "-f", choices=sorted(FORMATS), default="json")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel processes (default: all cores)")
+    parser.add_argument("--no_voice", action="store_true", help="Skip voice messages")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="First day to export (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="Last day to export (YYYY-MM-DD, inclusive)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    chats, msgs = export_all(
+        args.parsed_dir, args.output, args.format, not args.no_voice, args.workers,
+        progress=lambda done, total: print(f"\r  {done}/{total} chats", end="", flush=True),
+        since=args.since, until=args.until + timedelta(days=1) if args.until else None,
+    )
+    print(f"\nExported {msgs} messages from {chats} chats to {args.output} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,130 +5,198 @@ from pathlib import Path
 from datetime import datetime
 import argparse
 
-# Default iOS Backup path on macOS
-SYSTEM_BACKUP_ROOT = Path.home() / "Library/Application Support/MobileSync/Backup"
-DOWNLOADS_BACKUP_ROOT = Path.home() / "Downloads"
+from backup_discovery import backup_label, get_discovery
+from media_store import MediaStore, copy_file
+from pipeline_jobs import ProgressReporter
 
 def list_backups():
-    candidates = []
-    
-    # Check System Backup Path
-    if SYSTEM_BACKUP_ROOT.exists():
-        try:
-            for d in SYSTEM_BACKUP_ROOT.iterdir():
-                if d.is_dir() and (d / "Manifest.db").exists():
-                    candidates.append(d)
-        except PermissionError:
-            print(f"[Permission Denied] Cannot access {SYSTEM_BACKUP_ROOT}.")
-    
-    # Check Downloads
-    if DOWNLOADS_BACKUP_ROOT.exists():
-        for d in DOWNLOADS_BACKUP_ROOT.iterdir():
-            if d.is_dir() and (d / "Manifest.db").exists():
-                candidates.append(d)
-
-    backups_with_time = []
-    for d in candidates:
-        try:
-            mtime = datetime.fromtimestamp(d.stat().st_mtime)
-            backups_with_time.append((d, mtime))
-        except OSError:
-            pass
-            
-    backups_with_time.sort(key=lambda x: x[1], reverse=True)
-    return backups_with_time
-
-def extract_from_backup(backup_path: Path, output_dir: Path, extract_audio: bool = False):
+    """[(backup folder, backup date)], newest first (see backup_discovery.py)."""
+    discovery = get_discovery()
+    backups = discovery.scan()
+    for root, error in discovery.errors.items():
+        print(f"Cannot access {root}: {error}")
+    return [(Path(b["path"]), datetime.fromisoformat(b["date"])) for b in backups]
+
+
+DOMAIN = 'AppDomain-com.tencent.xin'
+DB_QUERY = (
+    "SELECT fileID, relativePath FROM Files WHERE domain=? AND (relativePath LIKE '%MM.sqlite' "
+    "OR relativePath LIKE '%WCDB_Contact.sqlite' OR relativePath LIKE '%message_%.sqlite')"
+)
+AUDIO_QUERY = "SELECT fileID, relativePath FROM Files WHERE domain=? AND relativePath LIKE '%.aud'"
+# Chat images (.pic, .pic_hd, .pic_thum) and videos (.mp4, .video_thum), named by MesLocalID
+MEDIA_QUERY = (
+    "SELECT fileID, relativePath FROM Files WHERE domain=? AND (relativePath LIKE '%/Img/%' "
+    "OR relativePath LIKE '%/Video/%')"
+)
+MEDIA_SUFFIXES = (".pic", ".pic_hd", ".pic_thum", ".mp4", ".video_thum")
+
+
+def open_manifest(backup_path: Path):
+    """Cursor on the backup's Manifest.db, or None (with the reason printed)."""
     manifest_db = backup_path / "Manifest.db"
     if not manifest_db.exists():
         print(f"Manifest.db not found in {backup_path}")
-        return
-
-    print(f"Reading Manifest from: {backup_path.name}")
-    print(f"Time: {datetime.fromtimestamp(backup_path.stat().st_mtime)}")
-    
+        return None
     try:
-        conn = sqlite3.connect(manifest_db)
-        cursor = conn.cursor()
+        return sqlite3.connect(manifest_db).cursor()
     except sqlite3.DatabaseError as e:
         print(f"Error opening Manifest.db: {e}")
-        return
+        return None
 
-    domain = 'AppDomain-com.tencent.xin'
-    
-    # 1. Extract Databases (MM.sqlite, WCDB_Contact.sqlite, message_*.sqlite)
-    print("Scanning for WeChat databases (MM.sqlite, WCDB, message_*.sqlite)...")
-    cursor.execute(
-        "SELECT fileID, relativePath FROM Files WHERE domain=? AND (relativePath LIKE '%MM.sqlite' OR relativePath LIKE '%WCDB_Contact.sqlite' OR relativePath LIKE '%message_%.sqlite')", 
-        (domain,)
-    )
-    db_rows = cursor.fetchall()
-    
-    for file_id, rel_path in db_rows:
-        # Structure usually: Documents/HASH/DB/FILENAME
+
+def backup_file(backup_path: Path, file_id):
+    # Backup files are stored as <first 2 chars of fileID>/<fileID>
+    return backup_path / file_id[:2] / file_id
+
+
+def db_user_hash(rel_path):
+    # Structure usually: Documents/HASH/DB/FILENAME
+    parts = Path(rel_path).parts
+    if "DB" in parts:
+        idx = parts.index("DB")
+        if idx > 0:
+            return parts[idx-1]
+    elif len(parts) >= 3 and parts[0] == "Documents":
+        # Fallback: Documents/HASH/file.sqlite
+        return parts[1]
+    return "unknown"
+
+
+def audio_user_hash(rel_path):
+    # Structure: Documents/HASH/Audio/...
+    parts = Path(rel_path).parts
+    if "Documents" in parts:
+        idx = parts.index("Documents")
+        if len(parts) > idx + 2:
+            return parts[idx+1]
+    return "common"
+
+
+def db_sort_key(row):
+    # Contact databases first: parsing a message DB needs the names
+    name = Path(row[1]).name
+    return (0 if name.endswith(("MM.sqlite", "WCDB_Contact.sqlite")) else 1, name)
+
+
+def iter_extract_dbs(backup_path: Path, output_dir: Path, db_rows):
+    """Copy the databases one by one (contacts first), yielding (path, user_hash) after each copy."""
+    db_rows = sorted(db_rows, key=db_sort_key)
+    db_progress = ProgressReporter("extract", len(db_rows), phase="databases")
+
+    for n, (file_id, rel_path) in enumerate(db_rows, 1):
         p = Path(rel_path)
-        parts = p.parts
-        user_hash = "unknown"
-        
-        # Try to find user hash from path (usually parent of DB folder or similar)
-        # Standard: Documents/[32-char-hash]/DB/file.sqlite
-        if "DB" in parts:
-            idx = parts.index("DB")
-            if idx > 0:
-                user_hash = parts[idx-1]
-        elif len(parts) >= 3 and parts[0] == "Documents":
-             # Fallback: Documents/HASH/file.sqlite
-             user_hash = parts[1]
-        
+        user_hash = db_user_hash(rel_path)
         print(f"Found DB: {p.name} for user: {user_hash}")
-        
-        file_hash = file_id
-        shard = file_hash[:2]
-        source_file = backup_path / shard / file_hash
-        
+
+        source_file = backup_file(backup_path, file_id)
         target_dir = output_dir / user_hash
         target_dir.mkdir(parents=True, exist_ok=True)
         target_file = target_dir / p.name
-        
+
         if source_file.exists():
             shutil.copy2(source_file, target_file)
             print(f"  -> Extracted to {target_file}")
+            db_progress.update(n)
+            yield target_file, user_hash
         else:
-            print(f"  -> Source file missing in backup: {file_hash}")
+            print(f"  -> Source file missing in backup: {file_id}")
+            db_progress.update(n)
+
+
+def copy_audio(backup_path: Path, output_dir: Path, audio_rows, progress=None, store=None):
+    """
+    Copy .aud files into <output>/<user_hash>/Audio/. Returns the number copied.
+    With a MediaStore, files are kept once in the store and linked into the output.
+    """
+    copied = 0
+    for n, (file_id, rel_path) in enumerate(audio_rows, 1):
+        p = Path(rel_path)
+        source_file = backup_file(backup_path, file_id)
+        target_audio_dir = output_dir / audio_user_hash(rel_path) / "Audio"
+        target_audio_dir.mkdir(parents=True, exist_ok=True)
+
+        if source_file.exists():
+            if store is not None:
+                store.materialize(source_file, file_id, target_audio_dir / p.name)
+            else:
+                # Replaces (never writes through) a view a --media_store run left here
+                copy_file(source_file, target_audio_dir / p.name)
+            copied += 1
+        if progress:
+            progress.update(n)
+    return copied
+
+
+def media_target(output_dir: Path, rel_path):
+    """<output>/<user_hash>/Img|Video/<chat hash>/<file>, or None for files that are not chat media."""
+    parts = Path(rel_path).parts
+    if not rel_path.endswith(MEDIA_SUFFIXES):
+        return None
+    for kind in ("Img", "Video"):
+        if kind in parts:
+            idx = parts.index(kind)
+            if len(parts) > idx + 2:
+                return output_dir.joinpath(audio_user_hash(rel_path), kind, *parts[idx + 1:])
+    return None
+
+
+def copy_media(backup_path: Path, output_dir: Path, media_rows, progress=None, store=None):
+    """Copy chat images, videos and their thumbnails (see media_target). Returns the number copied."""
+    copied = 0
+    for n, (file_id, rel_path) in enumerate(media_rows, 1):
+        target = media_target(output_dir, rel_path)
+        source_file = backup_file(backup_path, file_id)
+        if target is not None and source_file.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if store is not None:
+                store.materialize(source_file, file_id, target)
+            else:
+                copy_file(source_file, target)
+            copied += 1
+        if progress:
+            progress.update(n)
+    return copied
+
+
+def extract_from_backup(backup_path: Path, output_dir: Path, extract_audio: bool = False, media_store: Path = None,
+                        extract_media: bool = False):
+    cursor = open_manifest(backup_path)
+    if cursor is None:
+        return
+
+    print(f"Reading Manifest from: {backup_path.name}")
+    print(f"Time: {datetime.fromtimestamp(backup_path.stat().st_mtime)}")
+
+    # 1. Extract Databases (MM.sqlite, WCDB_Contact.sqlite, message_*.sqlite)
+    print("Scanning for WeChat databases (MM.sqlite, WCDB, message_*.sqlite)...")
+    cursor.execute(DB_QUERY, (DOMAIN,))
+    for _ in iter_extract_dbs(backup_path, output_dir, cursor.fetchall()):
+        pass
+
+    store = MediaStore(media_store) if media_store and (extract_audio or extract_media) else None
 
     # 2. Extract Audio (Optional)
     if extract_audio:
         print("Scanning for Audio (.aud)...")
-        cursor.execute(
-            "SELECT fileID, relativePath FROM Files WHERE domain=? AND relativePath LIKE '%.aud'", 
-            (domain,)
-        )
+        cursor.execute(AUDIO_QUERY, (DOMAIN,))
         audio_rows = cursor.fetchall()
         print(f"Found {len(audio_rows)} audio files.")
-        
-        for file_id, rel_path in audio_rows:
-            p = Path(rel_path)
-            parts = p.parts 
-            # Structure: Documents/HASH/Audio/...
-            user_hash = "common"
-            if "Documents" in parts:
-                idx = parts.index("Documents")
-                if len(parts) > idx + 2:
-                    user_hash = parts[idx+1]
-            
-            file_hash = file_id
-            shard = file_hash[:2]
-            source_file = backup_path / shard / file_hash
-            
-            target_audio_dir = output_dir / user_hash / "Audio"
-            target_audio_dir.mkdir(parents=True, exist_ok=True)
-            
-            dest_file = target_audio_dir / p.name
-            
-            if source_file.exists():
-                shutil.copy2(source_file, dest_file)
-
-    conn.close()
+        copy_audio(backup_path, output_dir, audio_rows, ProgressReporter("extract", len(audio_rows), phase="audio"), store)
+
+    # 3. Extract Images & Videos (Optional)
+    if extract_media:
+        print("Scanning for images and videos...")
+        cursor.execute(MEDIA_QUERY, (DOMAIN,))
+        media_rows = [row for row in cursor.fetchall() if row[1].endswith(MEDIA_SUFFIXES)]
+        print(f"Found {len(media_rows)} image/video files.")
+        copied = copy_media(backup_path, output_dir, media_rows, ProgressReporter("extract", len(media_rows), phase="media"), store)
+        print(f"Copied {copied} image/video files.")
+
+    if store is not None:
+        print(f"Media store: {store.stored} new files stored, {store.reused} already there (linked only).")
+
+    cursor.connection.close()
     print("-" * 30)
     print(f"Extraction finished. Data is in: {output_dir}")
 
@@ -137,7 +205,10 @@ if __name__ == "__main__":
     parser.add_argument("--backup_path", type=Path, help="Explicit path to iTunes backup folder", default=None)
     parser.add_argument("--output_path", type=Path, help="Output directory", default=None)
     parser.add_argument("--extract_audio", action="store_true", help="Extract audio files")
+    parser.add_argument("--extract_media", action="store_true", help="Extract chat images, videos and their thumbnails")
+    parser.add_argument("--media_store", type=Path, default=None, help="Keep audio/media once in this shared store and hardlink it into the output")
     parser.add_argument("--list", action="store_true", help="List available backups")
+    parser.add_argument("--verify", action="store_true", help="Check the backup's WeChat files against Manifest.db first")
     
     args = parser.parse_args()
     
@@ -145,8 +216,8 @@ if __name__ == "__main__":
     
     if args.list:
         print("Available Backups:")
-        for b, date in backups:
-            print(f"- {b} ({date})")
+        for backup in get_discovery().scan(sizes=True):
+            print(f"- {backup['path']}\n    {backup_label(backup)}")
         exit(0)
 
     selected_backup = None
@@ -161,5 +232,13 @@ if __name__ == "__main__":
 
     out_dir = args.output_path if args.output_path else Path(__file__).parent / "extracted_wechat_db"
     out_dir.mkdir(parents=True, exist_ok=True)
-    
-    extract_from_backup(selected_backup, out_dir, args.extract_audio)
+
+    if args.verify:
+        from verify_backup import print_summary, verify_backup, write_report
+
+        report = verify_backup(selected_backup)
+        if report is not None:
+            write_report(report, out_dir / "verify_report.json")
+            print_summary(report)
+
+    extract_from_backup(selected_backup, out_dir, args.extract_audio, args.media_store, args.extract_media)
@@ -0,0 +1,152 @@
+import re
+import sqlite3
+from pathlib import Path
+
+# In group chats, received messages are stored as "<sender wxid>:\n<text>" (system / tip
+# messages have no prefix).
+# GroupMembers maps (chatroom, wxid) -> the name shown for that member: the member's display
+# name in that group if set, else the contact name, else the wxid. Everything is loaded once,
+# one query per table, so parsing never goes back to a database per message.
+SENDER_PREFIX = re.compile(r"([\w\-.@]+):\n", re.ASCII)   # wxids are ASCII: "中文:\n" is text
+# System / tip messages (joins, recalls, ...): never prefixed with a sender
+SYSTEM_TYPES = (10000, 10002)
+# <Member UserName="wxid_x"> ... <DisplayName>name</DisplayName> ... </Member> in the RoomData
+# XML of Friend.dbContactChatRoom
+ROOM_MEMBER = re.compile(r'<Member UserName="([^"]+)"[^>]*>(.*?)</Member>', re.S)
+ROOM_DISPLAY_NAME = re.compile(r"<DisplayName>(.*?)</DisplayName>", re.S)
+# Group-member tables differ between WeChat versions; columns are matched by name
+MEMBER_TABLE_NAMES = ("groupmember", "chatroommember")
+ROOM_COLUMNS = ("chatroomname", "roomname", "chatroom", "groupname")
+MEMBER_COLUMNS = ("username", "usrname", "membername", "memberusername", "wxid")
+DISPLAY_COLUMNS = ("displayname", "groupnickname", "roomnickname", "nickname")
+
+
+def _varint(blob, pos):
+    value = shift = 0
+    while pos < len(blob):
+        byte = blob[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return value, pos
+
+
+def proto_strings(blob):
+    """{field number: bytes} of the top-level length-delimited fields of a protobuf blob."""
+    fields, pos = {}, 0
+    try:
+        while pos < len(blob):
+            key, pos = _varint(blob, pos)
+            wire = key & 7
+            if wire == 0:
+                _value, pos = _varint(blob, pos)
+            elif wire == 1:
+                pos += 8
+            elif wire == 5:
+                pos += 4
+            elif wire == 2:
+                size, pos = _varint(blob, pos)
+                fields.setdefault(key >> 3, blob[pos:pos + size])
+                pos += size
+            else:
+                break
+    except IndexError:
+        pass
+    return fields
+
+
+def _unescape(text):
+    return (text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"')
+            .replace("&apos;", "'").replace("&amp;", "&")).strip()
+
+
+class GroupMembers:
+    def __init__(self, names=None):
+        self.names = names or {}     # wxid -> contact name (parse_db friends map)
+        self.rooms = {}              # chatroom -> {wxid: display name in that room}
+
+    def add(self, room, wxid, display_name=None):
+        members = self.rooms.setdefault(room, {})
+        if display_name or wxid not in members:
+            members[wxid] = display_name or members.get(wxid)
+
+    def name(self, room, wxid):
+        return self.rooms.get(room, {}).get(wxid) or self.names.get(wxid) or wxid
+
+    def split(self, room, content):
+        """(sender wxid, text) of a received group message; (None, content) without a prefix."""
+        match = SENDER_PREFIX.match(content)
+        if not match:
+            return None, content
+        return match.group(1), content[match.end():]
+
+    def load_chatroom_blobs(self, conn):
+        """Friend.dbContactChatRoom (WCDB_Contact): member list and per-group display names."""
+        try:
+            rows = conn.execute(
+                "SELECT userName, dbContactChatRoom FROM Friend WHERE userName LIKE '%@chatroom'"
+            )
+            for room, blob in rows:
+                if not blob:
+                    continue
+                # Field 1: "wxid_a;wxid_b;..."; the RoomData XML follows in a later field
+                member_list = proto_strings(blob).get(1, b"").decode("utf-8", errors="ignore")
+                for wxid in filter(None, member_list.split(";")):
+                    self.add(room, wxid.strip())
+                text = blob.decode("utf-8", errors="ignore")
+                for wxid, body in ROOM_MEMBER.findall(text):
+                    display = ROOM_DISPLAY_NAME.search(body)
+                    self.add(room, wxid, _unescape(display.group(1)) if display else None)
+        except sqlite3.Error as e:
+            print(f"  Could not read chatroom members: {e}")
+
+    def load_member_tables(self, conn):
+        """Any group-member table of the database, matched by column names."""
+        try:
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        except sqlite3.Error as e:
+            print(f"  Could not list tables: {e}")
+            return
+        for table in tables:
+            if not any(t in table.lower() for t in MEMBER_TABLE_NAMES):
+                continue
+            try:
+                columns = {r[1].lower(): r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')}
+                room = next((columns[c] for c in ROOM_COLUMNS if c in columns), None)
+                member = next((columns[c] for c in MEMBER_COLUMNS if c in columns), None)
+                display = next((columns[c] for c in DISPLAY_COLUMNS if c in columns), None)
+                if not room or not member:
+                    continue
+                display_sql = f'"{display}"' if display else "NULL"
+                for room_id, wxid, name in conn.execute(f'SELECT "{room}", "{member}", {display_sql} FROM "{table}"'):
+                    if room_id and wxid:
+                        self.add(room_id, wxid, name if isinstance(name, str) and name else None)
+            except sqlite3.Error as e:
+                print(f"  Could not read {table}: {e}")
+
+    def member_count(self):
+        return sum(len(m) for m in self.rooms.values())
+
+
+def load_group_members(db_dir, names=None):
+    """GroupMembers from the contact databases (WCDB_Contact, MM.sqlite) of an extraction."""
+    members = GroupMembers(names)
+    db_dir = Path(db_dir)
+    for db_path in list(db_dir.rglob("*WCDB_Contact.sqlite")) + list(db_dir.rglob("*MM.sqlite")):
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        except sqlite3.Error as e:
+            print(f"  Could not open {db_path.name}: {e}")
+            continue
+        try:
+            if db_path.name.endswith("WCDB_Contact.sqlite"):
+                members.load_chatroom_blobs(conn)
+            members.load_member_tables(conn)
+        finally:
+            conn.close()
+    if members.rooms:
+        print(f"  Loaded {members.member_count()} members of {len(members.rooms)} group chats.")
+    return members
+
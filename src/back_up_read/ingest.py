@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import heapq
+import time
+from collections import Counter
+from pathlib import Path
+
+import parse_db
+from catalog import is_group_chat
+from group_members import load_group_members
+from chat_store import load_index, stream_chat
+from search_index import update_index as update_search_index
+
+# parse.py's message type names -> WeChat type codes used by parse_db.py
+TYPE_CODES = {
+    "text": 1, "image": 3, "img": 3, "voice": 34, "audio": 34, "video": 43,
+    "emoji": 47, "sticker": 47, "link": 49, "app": 49, "appmsg": 49, "file": 49,
+}
+# WechatExporter conversation keys that hold the contact id / display name, in order of preference
+CHAT_ID_KEYS = ["usrName", "userName", "username", "wxid", "id"]
+CHAT_NAME_KEYS = ["displayName", "remark", "nickName", "name"]
+# Messages of one chat merged per write: a long chat is never held in memory as a whole
+BATCH_SIZE = 50_000
+
+
+def dedup_key(friend_id, msg):
+    """
+    64-bit hash of (chat, timestamp, "me" flag, content digest).
+    Sender names are left out: they differ between sources ("Me" / nickname / remark /
+    group display name). In group chats dedup_sender tells apart different senders.
+    """
+    sender = "me" if msg.get("is_sender") else ""
+    digest = hashlib.blake2b(str(msg.get("content") or "").encode("utf-8"), digest_size=16).digest()
+    head = f"{friend_id}\x1f{msg.get('timestamp') or ''}\x1f{sender}\x1f".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(head + digest, digest_size=8).digest(), "little")
+
+
+def dedup_sender(friend_id, msg):
+    """wxid of a received group message's sender, when the source knows it (parse_db does)."""
+    if msg.get("is_sender") or not is_group_chat(friend_id):
+        return None
+    return msg.get("sender_id") or None
+
+
+def take_existing(pool, key, sender_id):
+    """
+    Consume an existing message matching (key, sender_id) from `pool` ({key: Counter of
+    sender ids}); False if there is none, i.e. the message is new. Sides that don't know the
+    sender match any; two known, different senders never match.
+    """
+    slot = pool.get(key)
+    if not slot:
+        return False
+    if sender_id is not None and slot[sender_id] > 0:
+        match = sender_id
+    elif slot[None] > 0:
+        match = None
+    elif sender_id is None:
+        match = next((s for s, n in slot.items() if n > 0), None)
+        if match is None:
+            return False
+    else:
+        return False
+    slot[match] -= 1
+    return True
+
+
+def normalize_message(m, position):
+    """parse.ChatMessage -> message dict in parse_db.py's shape."""
+    msg_type = str(m.msg_type).strip().lower()
+    return {
+        "id": m.id or position,
+        "timestamp": m.timestamp.replace(microsecond=0).isoformat() if m.timestamp else "",
+        "sender": "Me" if m.is_sender else m.sender,
+        "content": m.content,
+        "type": int(msg_type) if msg_type.isdigit() else TYPE_CODES.get(msg_type, 1),
+        "is_sender": bool(m.is_sender),
+    }
+
+
+# --- sources: each yields conversations {"friend_id", "friend_name", "messages"} ---
+
+def db_conversations(db_dir):
+    """Conversations from extracted message_*.sqlite files (see parse_db.py)."""
+    parse_db.DB_DIR = Path(db_dir)
+    friends = parse_db.load_friends_map_v2()
+    hash_map = parse_db.build_hash_map(friends)
+    members = load_group_members(db_dir, friends)
+    for db_path in sorted(Path(db_dir).rglob("*message_*.sqlite")):
+        print(f"Reading {db_path.name}...")
+        yield from parse_db.parse_message_db(db_path, hash_map, members)
+
+
+def exporter_json_conversations(json_path):
+    """Conversations from a WechatExporter JSON file, one message batch at a time."""
+    from parse import iter_exporter_json
+
+    for chat_info, batch in iter_exporter_json(Path(json_path)):
+        friend_id = next((str(chat_info[k]) for k in CHAT_ID_KEYS if chat_info.get(k)), None)
+        friend_name = next((str(chat_info[k]) for k in CHAT_NAME_KEYS if chat_info.get(k)), None)
+        friend_id = friend_id or friend_name or f"{Path(json_path).stem}#{chat_info['chat_index']}"
+        yield {
+            "friend_id": friend_id,
+            "friend_name": friend_name or friend_id,
+            "messages": [normalize_message(m, i) for i, m in enumerate(batch)],
+        }
+
+
+def csv_conversations(csv_path, friend_id=None, friend_name=None):
+    """One conversation per CSV export (the format has no chat column); named after the file by default."""
+    from parse import iter_wechat_csv
+
+    friend_id = friend_id or Path(csv_path).stem
+    for batch in iter_wechat_csv(Path(csv_path)):
+        yield {
+            "friend_id": friend_id,
+            "friend_name": friend_name or friend_id,
+            "messages": [normalize_message(m, m.id) for m in batch],
+        }
+
+
+class ChatIngest:
+    """
+    Merges conversations from any source into a parse output (chats/ + index.json).
+    Each message is checked against the chat's existing keys (a hash Counter, so repeats of
+    an identical message are kept as often as a source has them); new messages are merged
+    into the time-ordered chat in one linear pass.
+    Consecutive batches of one chat are merged every BATCH_SIZE messages; the keys of the
+    messages that were in the chat before share one pool across those merges.
+    """
+
+    def __init__(self, parsed_dir):
+        self.parsed_dir = Path(parsed_dir)
+        self.chats_dir = self.parsed_dir / "chats"
+        self.chats_dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.parsed_dir / "index.json"
+        rows = load_index(index_path) if index_path.exists() else []
+        self.rows = {row["file_uuid"]: row for row in rows}
+        self.added = 0
+        self.duplicates = 0
+        self._pending = None
+        self._pool = None   # (friend_id, {dedup key: Counter of sender ids}) of the chat being merged
+
+    def add(self, conv):
+        """Queue one conversation (or a batch of one); flushed when another chat comes in or BATCH_SIZE is reached."""
+        if self._pending is not None and self._pending["friend_id"] != conv["friend_id"]:
+            self.flush()
+        if self._pending is None:
+            self._pending = {"friend_id": conv["friend_id"], "friend_name": conv["friend_name"], "messages": []}
+        self._pending["messages"].extend(conv["messages"])
+        if len(self._pending["messages"]) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        conv, self._pending = self._pending, None
+        if conv is None or not conv["messages"]:
+            return
+        friend_id = conv["friend_id"]
+        chat_path = self.chats_dir / f"{parse_db.get_md5(friend_id)}.json"
+        meta, existing = {}, []
+        if chat_path.exists():
+            meta, existing = stream_chat(chat_path)
+            existing = list(existing)
+
+        if self._pool is None or self._pool[0] != friend_id:
+            # Only messages from before this run count: later batches of the same chat may
+            # repeat an identical message the source really has twice
+            pool = {}
+            for m in existing:
+                pool.setdefault(dedup_key(friend_id, m), Counter())[dedup_sender(friend_id, m)] += 1
+            self._pool = (friend_id, pool)
+        pool = self._pool[1]
+        new = [
+            msg for msg in conv["messages"]
+            if not take_existing(pool, dedup_key(friend_id, msg), dedup_sender(friend_id, msg))
+        ]
+        self.duplicates += len(conv["messages"]) - len(new)
+        if not new:
+            return
+
+        new.sort(key=lambda m: m.get("timestamp") or "")
+        # Both sides are in time order; ties keep the existing message first
+        messages = list(heapq.merge(existing, new, key=lambda m: m.get("timestamp") or ""))
+        name = meta.get("friend_name")
+        if not name or name.startswith("Unknown"):
+            name = conv["friend_name"]
+        chat = {**meta, "friend_id": friend_id, "friend_name": name, "messages": messages}
+        row = parse_db.write_conversation(chat, self.chats_dir)
+        self.rows[row["file_uuid"]] = row
+        self.added += len(new)
+
+    def close(self):
+        """Flush, then write index.json / catalog and update the search index."""
+        self.flush()
+        parse_db.write_index(list(self.rows.values()), self.parsed_dir)
+        return update_search_index(self.parsed_dir)
+
+
+def ingest(parsed_dir, sources):
+    """Merge every conversation of every source into parsed_dir. Returns (added, duplicates)."""
+    store = ChatIngest(parsed_dir)
+    for source in sources:
+        for conv in source:
+            store.add(conv)
+    reindexed = store.close()
+    print(f"Search index updated ({reindexed} chats re-indexed).")
+    return store.added, store.duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge message sources into one parse output, skipping duplicates.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="Parse output to merge into (created if missing)")
+    parser.add_argument("--db_dir", type=Path, action="append", default=[], help="Extracted WeChat DB directory")
+    parser.add_argument("--json", type=Path, action="append", default=[], help="WechatExporter JSON export")
+    parser.add_argument("--csv", type=Path, action="append", default=[], help="CSV export (one chat per file)")
+    parser.add_argument("--csv_friend_id", default=None, help="Chat id for the CSV files (default: file name)")
+    args = parser.parse_args()
+
+    sources = [db_conversations(d) for d in args.db_dir]
+    sources += [exporter_json_conversations(p) for p in args.json]
+    sources += [csv_conversations(p, args.csv_friend_id) for p in args.csv]
+    if not sources:
+        parser.error("Give at least one --db_dir, --json or --csv source")
+
+    t0 = time.perf_counter()
+    added, duplicates = ingest(args.parsed_dir, sources)
+    print(f"Added {added} messages, skipped {duplicates} duplicates in {time.perf_counter() - t0:.1f}s -> {args.parsed_dir}")
+
+
+if __name__ == "__main__":
+    main()
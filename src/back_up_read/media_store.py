@@ -0,0 +1,145 @@
+import argparse
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+
+# Media shared by all extractions, stored once:
+#   <store>/objects/<fileID[:2]>/<fileID>-<size>
+# fileID is the SHA-1 Manifest.db already gives every backed-up file (of its domain and
+# path); WeChat never rewrites a media file in place, and the size guards against the rare
+# case where it did. Each extraction's Audio/ folder is a view of hardlinks into the store
+# (symlinks or copies where hardlinks are not possible), so re-extracting a backup copies
+# only media that no earlier backup had.
+OBJECTS_DIR = "objects"
+# Views that had to be symlinks (e.g. output on another filesystem) are listed here: they
+# don't raise a blob's link count, so prune() keeps every blob one of them points to
+SYMLINKS_FILE = "symlinks.txt"
+
+
+def copy_file(source, target):
+    """
+    Copy to a temp file and rename it over `target`. A target that is a view of a store blob
+    (read-only hardlink or symlink) is replaced, never written through.
+    """
+    target = Path(target)
+    tmp_path = target.with_name(f"{target.name}.tmp{os.getpid()}_{threading.get_ident()}")
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class MediaStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.objects = self.root / OBJECTS_DIR
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.stored = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def blob_path(self, file_id, size):
+        return self.objects / file_id[:2] / f"{file_id}-{size}"
+
+    def put(self, source_file, file_id):
+        """Blob for a backup file, copied into the store only if it is not there yet."""
+        size = os.stat(source_file).st_size
+        blob = self.blob_path(file_id, size)
+        if blob.exists():
+            with self._lock:
+                self.reused += 1
+            return blob
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob.with_name(f"{blob.name}.tmp{os.getpid()}_{threading.get_ident()}")
+        shutil.copy2(source_file, tmp_path)
+        # Read-only: every view shares this inode, so an edit through one would change all
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, blob)
+        with self._lock:
+            self.stored += 1
+        return blob
+
+    def link(self, blob, target):
+        """Make `target` a view of `blob`: hardlink, else symlink, else copy."""
+        target = Path(target)
+        if target.exists() or target.is_symlink():
+            try:
+                if os.path.samefile(target, blob):
+                    return
+            except OSError:
+                pass
+            target.unlink()
+        try:
+            os.link(blob, target)
+        except OSError:
+            try:
+                os.symlink(blob, target)
+            except OSError:
+                shutil.copy2(blob, target)
+                return
+            with self._lock, open(self.root / SYMLINKS_FILE, "a", encoding="utf-8") as f:
+                f.write(f"{os.path.abspath(target)}\n")
+
+    def materialize(self, source_file, file_id, target):
+        """Store a backup file (if new) and expose it at `target`."""
+        self.link(self.put(source_file, file_id), target)
+
+    def symlinked(self):
+        """Blobs that recorded symlink views still point to; the record drops views that are gone."""
+        path = self.root / SYMLINKS_FILE
+        try:
+            views = path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return set()
+        live, blobs = [], set()
+        for view in dict.fromkeys(views):
+            if os.path.islink(view):
+                live.append(view)
+                blobs.add(os.path.realpath(view))
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        tmp_path.write_text("".join(f"{v}\n" for v in live), encoding="utf-8")
+        os.replace(tmp_path, path)
+        return blobs
+
+    def _blobs(self):
+        for path in self.objects.rglob("*"):
+            if path.is_file() and ".tmp" not in path.name:
+                yield path
+
+    def usage(self):
+        """(blobs, bytes, blobs not linked from any extraction)."""
+        blobs = size = orphans = 0
+        symlinked = self.symlinked()
+        for path in self._blobs():
+            st = path.stat()
+            blobs += 1
+            size += st.st_size
+            orphans += st.st_nlink == 1 and os.path.realpath(path) not in symlinked
+        return blobs, size, orphans
+
+    def prune(self):
+        """Delete blobs no extraction uses: hardlink count 1 and no recorded symlink view."""
+        symlinked = self.symlinked()
+        removed = 0
+        for path in list(self._blobs()):
+            if path.stat().st_nlink == 1 and os.path.realpath(path) not in symlinked:
+                path.unlink()
+                removed += 1
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or prune the shared media store.")
+    parser.add_argument("--store", type=Path, required=True, help="Media store directory")
+    parser.add_argument("--prune", action="store_true", help="Delete media no extraction uses any more")
+    args = parser.parse_args()
+
+    store = MediaStore(args.store)
+    if args.prune:
+        print(f"Removed {store.prune()} unreferenced files.")
+    blobs, size, orphans = store.usage()
+    print(f"{blobs} files, {size / 1024 / 1024:.1f} MB ({orphans} not used by any extraction)")
+
+
+if __name__ == "__main__":
+    main()
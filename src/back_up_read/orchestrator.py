@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import parse_db
+from audio_converter import check_dependencies as check_converter, convert_one
+from extract_wechat import (
+    AUDIO_QUERY, DB_QUERY, DOMAIN, audio_user_hash, copy_audio, iter_extract_dbs, list_backups, open_manifest,
+)
+from group_members import load_group_members
+from media_store import MediaStore
+from search_index import update_index as update_search_index
+
+# Items waiting between two stages; a full queue blocks the producer (backpressure)
+QUEUE_SIZE = 16
+STATUS_INTERVAL = 5.0
+_STOP = object()
+
+
+class Stage:
+    """
+    Worker threads that take items from `inbox`, call func(item) and pass every value it
+    yields on to the next stage. Once the upstream stage is finished, close() lets the
+    workers drain the queue and exit.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        self.inbox.put(item)
+
+    def close(self):
+        for _ in range(self.workers):
+            self.inbox.put(_STOP)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                return
+            t0 = time.perf_counter()
+            try:
+                for out in self.func(item) or ():
+                    if self.next is not None:
+                        self.next.put(out)
+                ok = True
+            except Exception as e:
+                print(f"[{self.name}] failed: {e}")
+                ok = False
+            with self._lock:
+                self.busy += time.perf_counter() - t0
+                if ok:
+                    self.done += 1
+                else:
+                    self.failed += 1
+
+    def summary(self):
+        return f"{self.name}: {self.done} done, {self.failed} failed, queued {self.inbox.qsize()}"
+
+
+def chain(*stages):
+    for upstream, downstream in zip(stages, stages[1:]):
+        upstream.next = downstream
+    return stages
+
+
+class Pipeline:
+    """
+    Extract -> parse -> voice audio (copy + convert) -> transcribe, overlapped:
+    - each message DB is parsed as soon as it is copied out of the backup
+    - each chat's voice notes are copied and converted as soon as the chat is written
+    - each chat is transcribed as soon as its audio is converted
+    """
+
+    def __init__(self, backup_path, extract_dir, parsed_dir, transcribe=True, model="small",
+                 transcribe_workers=1, convert=True, media_store=None):
+        self.backup_path = Path(backup_path)
+        self.extract_dir = Path(extract_dir)
+        self.parsed_dir = Path(parsed_dir)
+        self.transcribe = transcribe
+        self.model = model
+        self.transcribe_workers = transcribe_workers
+        self.convert = convert
+        self.store = MediaStore(media_store) if media_store else None
+
+        self.index_rows = []
+        self._rows_lock = threading.Lock()
+        self._names_lock = threading.Lock()
+        self._contacts = None
+        # Chats of unknown contacts share one file name, possibly across DBs parsed in parallel
+        self._file_locks = defaultdict(threading.Lock)
+        # (user_hash, chat hash) -> .aud rows, for backups that keep voice under Audio/<chat hash>/
+        self.audio_groups = defaultdict(list)
+        self.loose_audio = []
+        self.loose_audio_done = threading.Event()
+        # Chats whose voice notes are among the loose audio; retried once that is copied.
+        # (Blocking an audio worker on it instead could deadlock through the bounded queues.)
+        self.deferred = []
+        self._defer_lock = threading.Lock()
+        self._runner = None
+        self._store = None
+
+    # --- stages ---
+
+    def extract(self, _item):
+        """Yield (message DB, user_hash) as each one is copied; loose audio goes last."""
+        cursor = open_manifest(self.backup_path)
+        if cursor is None:
+            raise RuntimeError(f"Cannot read backup: {self.backup_path}")
+        cursor.execute(AUDIO_QUERY, (DOMAIN,))
+        for file_id, rel_path in cursor.fetchall():
+            parent = Path(rel_path).parent.name
+            if len(parent) == 32:
+                self.audio_groups[(audio_user_hash(rel_path), parent)].append((file_id, rel_path))
+            else:
+                self.loose_audio.append((file_id, rel_path))
+        cursor.execute(DB_QUERY, (DOMAIN,))
+        db_rows = cursor.fetchall()
+        cursor.connection.close()
+        try:
+            for path, user_hash in iter_extract_dbs(self.backup_path, self.extract_dir, db_rows):
+                if "message_" in path.name:
+                    yield path, user_hash
+            if self.loose_audio:
+                print(f"Copying {len(self.loose_audio)} voice files without a per-chat folder...")
+                copy_audio(self.backup_path, self.extract_dir, self.loose_audio, store=self.store)
+        finally:
+            with self._defer_lock:
+                self.loose_audio_done.set()
+
+    def contacts(self):
+        """(chat hash map, group members), loaded once for all message DBs."""
+        with self._names_lock:
+            if self._contacts is None:
+                # Contact DBs are extracted before any message DB, so they are in place by now
+                parse_db.DB_DIR = self.extract_dir
+                friends = parse_db.load_friends_map_v2()
+                self._contacts = (parse_db.build_hash_map(friends), load_group_members(self.extract_dir, friends))
+            return self._contacts
+
+    def parse(self, item):
+        """Parse one message DB, write its chats, yield chats that have voice messages."""
+        db_path, user_hash = item
+        conversations = parse_db.parse_message_db(db_path, *self.contacts())
+        parse_db.rejoin_transcriptions(conversations, self.parsed_dir)
+        data_dir = self.parsed_dir / "chats"
+        data_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Parsed {db_path.name}: {len(conversations)} chats")
+        for conv in conversations:
+            with self._rows_lock:
+                file_lock = self._file_locks[conv["friend_id"]]
+            with file_lock:
+                row = parse_db.write_conversation(conv, data_dir)
+            with self._rows_lock:
+                self.index_rows.append(row)
+            voice_ids = [m["id"] for m in conv["messages"] if m.get("type") == 34 and not m.get("transcription")]
+            if voice_ids:
+                yield row["file_uuid"], user_hash, voice_ids
+
+    def audio(self, item):
+        """Copy (if needed) and convert one chat's voice notes; yield the chat for transcription."""
+        chat_uuid, user_hash, voice_ids = item
+        rows = self.audio_groups.get((user_hash, chat_uuid))
+        if rows:
+            copy_audio(self.backup_path, self.extract_dir, rows, store=self.store)
+        else:
+            with self._defer_lock:
+                if not self.loose_audio_done.is_set():
+                    self.deferred.append(item)
+                    return
+        audio_dir = self.extract_dir / user_hash / "Audio"
+        if not self.convert:
+            return
+        converted = 0
+        for msg_id in voice_ids:
+            mp3 = audio_dir / f"{msg_id}.mp3"
+            if mp3.exists():
+                converted += 1
+                continue
+            for ext in (".aud", ".silk"):
+                src = audio_dir / f"{msg_id}{ext}"
+                if src.exists() and convert_one(src) and mp3.exists():
+                    converted += 1
+                    break
+        if converted and self.transcribe:
+            yield chat_uuid, audio_dir
+
+    def transcribe_chat(self, item):
+        """Transcribe one chat in place (model and store are created on first use by this thread)."""
+        from transcribe_audio import process_chat, save_chat
+        from transcription_cache import TranscriptionStore
+
+        chat_uuid, audio_dir = item
+        if self._runner is None:
+            if self.transcribe_workers > 1:
+                from transcribe_pool import TranscriptionPool
+                self._runner = TranscriptionPool(self.transcribe_workers, model_name=self.model)
+            else:
+                from transcribe_engine import create_engine
+                self._runner = create_engine(model_name=self.model)
+            self._store = TranscriptionStore.for_output(self.parsed_dir)
+        chat_path = self.parsed_dir / "chats" / f"{chat_uuid}.json"
+        with open(chat_path, "r", encoding="utf-8") as f:
+            chat_data = json.load(f)
+        count = process_chat(chat_data, str(audio_dir), model=self._runner, store=self._store)
+        if count:
+            save_chat(chat_path, chat_data)
+            print(f"Transcribed {count} voice messages in {chat_data.get('friend_name')}")
+        return ()
+
+    # --- driver ---
+
+    def run(self, parse_workers=2, audio_workers=4, queue_size=QUEUE_SIZE):
+        stages = chain(
+            Stage("extract", self.extract, 1, queue_size),
+            Stage("parse", self.parse, parse_workers, queue_size),
+            Stage("audio", self.audio, audio_workers, queue_size),
+            Stage("transcribe", self.transcribe_chat, 1, queue_size),
+        )
+        t0 = time.perf_counter()
+        for stage in stages:
+            stage.start()
+        stages[0].put(self.backup_path)
+        stages[0].close()
+
+        stop_status = threading.Event()
+
+        def status():
+            while not stop_status.wait(STATUS_INTERVAL):
+                print(" | ".join(stage.summary() for stage in stages), flush=True)
+
+        threading.Thread(target=status, daemon=True).start()
+        try:
+            for stage in stages:
+                stage.join()
+                if stage.name == "parse":
+                    # All chats are written: the index can go out while audio work continues
+                    parse_db.write_index(self.index_rows, self.parsed_dir)
+                    # Extraction (incl. loose audio) finished before parsing did
+                    for item in self.deferred:
+                        stage.next.put(item)
+                if stage.next is not None:
+                    stage.next.close()
+        finally:
+            stop_status.set()
+            if hasattr(self._runner, "close"):
+                self._runner.close()
+            if self._store is not None:
+                self._store.close()
+
+        reindexed = update_search_index(self.parsed_dir)
+        wall = time.perf_counter() - t0
+        print("-" * 30)
+        for stage in stages:
+            print(f"{stage.summary()}, busy {stage.busy:.1f}s")
+        print(f"Search index updated ({reindexed} chats re-indexed).")
+        if self.store is not None:
+            print(f"Media store: {self.store.stored} new files stored, {self.store.reused} already there (linked only).")
+        print(f"Pipeline finished in {wall:.1f}s: {len(self.index_rows)} chats -> {self.parsed_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run extract -> parse -> convert -> transcribe as one overlapped pipeline.")
+    parser.add_argument("--backup_path", type=Path, default=None, help="iTunes backup folder (default: newest)")
+    parser.add_argument("--extract_dir", type=Path, required=True, help="Where databases and audio are extracted")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="Where chats/ and index.json are written")
+    parser.add_argument("--parse_workers", type=int, default=2, help="Message DBs parsed at once")
+    parser.add_argument("--audio_workers", type=int, default=min(8, os.cpu_count() or 1), help="Chats converted at once")
+    parser.add_argument("--transcribe_workers", type=int, default=1, help="Transcription processes (one model each)")
+    parser.add_argument("--queue_size", type=int, default=QUEUE_SIZE, help="Max items waiting between two stages")
+    parser.add_argument("--model", default="small", help="Whisper model")
+    parser.add_argument("--no_transcribe", action="store_true", help="Stop after audio conversion")
+    parser.add_argument("--media_store", type=Path, default=None, help="Keep audio once in this shared store and hardlink it into extract_dir")
+    args = parser.parse_args()
+
+    backup_path = args.backup_path
+    if backup_path is None:
+        backups = list_backups()
+        if not backups:
+            print("No iOS backups found.")
+            exit(1)
+        backup_path, date = backups[0]
+        print(f"Using newest backup: {date}")
+
+    ready, msg = check_converter()
+    if not ready:
+        print(f"Audio conversion unavailable ({msg}); voice notes will be copied but not converted.")
+
+    args.extract_dir.mkdir(parents=True, exist_ok=True)
+    args.parsed_dir.mkdir(parents=True, exist_ok=True)
+    pipeline = Pipeline(
+        backup_path, args.extract_dir, args.parsed_dir,
+        transcribe=not args.no_transcribe, model=args.model,
+        transcribe_workers=args.transcribe_workers, convert=ready, media_store=args.media_store,
+    )
+    pipeline.run(args.parse_workers, args.audio_workers, args.queue_size)
+
+
+if __name__ == "__main__":
+    main()
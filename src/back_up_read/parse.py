@@ -1,122 +1,288 @@
 import json
-import csv
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import dataclasses
 
+# Messages handed out per batch; memory use is bounded by this, not by the export size
+BATCH_SIZE = 50_000
+READ_CHUNK = 1024 * 1024
+# Tried in order on values that are not epoch numbers (ISO 8601 first: the common case)
+DATE_FORMATS = [
+    "ISO8601",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y-%m-%d %H:%M",
+    "%Y年%m月%d日 %H:%M:%S",
+    "%Y年%m月%d日 %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+]
+
 @dataclasses.dataclass
 class ChatMessage:
     id: str
     sender: str
     content: str
-    timestamp: datetime
+    timestamp: Optional[datetime]  # None when the export's value could not be parsed
     is_sender: bool
     msg_type: str
 
-def parse_wechat_exporter_json(json_path: Path) -> List[ChatMessage]:
+def parse_timestamps(values) -> List[Optional[datetime]]:
     """
-    Parse JSON output from WechatExporter.
+    Vectorized timestamp parsing for a batch of raw values.
+    Epoch numbers (seconds, or milliseconds) become local time like parse_db.py does;
+    strings are tried against DATE_FORMATS. Unparseable values become None.
     """
-    if not json_path.exists():
-        print(f"File not found: {json_path}")
-        return []
+    import pandas as pd
+    from dateutil.tz import tzlocal
 
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    messages = []
-    # Structure depends on the exporter settings, assuming specific structure
-    # Adjust loop based on actual JSON format
-    # Typically: { "conversations": [ { "messages": [ ... ] } ] }
-    
-    # Generic traverser if structure varies
-    chat_list = data if isinstance(data, list) else data.get('conversations', [])
-    
-    for chat in chat_list:
-        msgs = chat.get('messages', [])
-        for m in msgs:
-            # Normalize timestamp
-            ts_str = m.get('timestamp') or m.get('createTime')
+    raw = pd.Series(list(values), dtype=object).astype(str).str.strip()
+    result = pd.Series(pd.NaT, index=raw.index, dtype="datetime64[ns]")
+
+    numbers = pd.to_numeric(raw, errors="coerce")
+    millis = numbers.where(numbers >= 1e11, numbers * 1000).round()
+    # Up to 2100; larger numbers are not timestamps
+    epoch = millis.notna() & (millis > 0) & (millis < 4.1e12)
+    if epoch.any():
+        local = pd.to_datetime(millis[epoch].astype("int64"), unit="ms", utc=True).dt.tz_convert(tzlocal()).dt.tz_localize(None)
+        result[epoch] = local.astype("datetime64[ns]")
+
+    todo = ~epoch & (raw != "")
+    for fmt in DATE_FORMATS:
+        if not todo.any():
+            break
+        try:
+            parsed = pd.to_datetime(raw[todo], format=fmt, errors="coerce")
+        except ValueError:
+            # Mixed UTC offsets: normalise through UTC
+            parsed = pd.to_datetime(raw[todo], format=fmt, errors="coerce", utc=True)
+        if parsed.dt.tz is not None:
+            parsed = parsed.dt.tz_convert(tzlocal()).dt.tz_localize(None)
+        ok = parsed.notna()
+        result[ok[ok].index] = parsed[ok].astype("datetime64[ns]")
+        todo[ok[ok].index] = False
+
+    return [None if pd.isna(ts) else ts.to_pydatetime() for ts in result]
+
+def _json_messages(rows: List[Dict]) -> List[ChatMessage]:
+    timestamps = parse_timestamps(m.get('timestamp', m.get('createTime', '')) for m in rows)
+    return [
+        ChatMessage(
+            id=str(m.get('id', '')),
+            sender=m.get('sender', 'Unknown'),
+            content=m.get('content', '') or m.get('text', ''),
+            timestamp=ts,
+            is_sender=bool(m.get('isSender', False)),
+            msg_type=m.get('type', 'text'),
+        )
+        for m, ts in zip(rows, timestamps)
+    ]
+
+class _JsonStream:
+    """
+    Reads a JSON document piecewise: the containers we walk through are tokenized by hand,
+    everything else is decoded one value at a time with raw_decode.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        data = self.f.read(size or READ_CHUNK)
+        if not data:
+            self.eof = True
+            return False
+        # Drop what has been consumed so the buffer stays about one chunk long
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Expected one of {chars!r}, found {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
             try:
-                ts = datetime.fromtimestamp(int(ts_str)) if str(ts_str).isdigit() else datetime.now()
-            except:
-                ts = datetime.now()
-
-            msg = ChatMessage(
-                id=str(m.get('id', '')),
-                sender=m.get('sender', 'Unknown'),
-                content=m.get('content', '') or m.get('text', ''),
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number right at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Value spans past the buffer: read more (doubling, so large values stay linear)
+            self._fill(max(READ_CHUNK, len(self.buf)))
+
+    def items(self) -> Iterator[None]:
+        """Step through an array; the caller consumes each element before the next step."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(",]") == "]":
+                return
+
+    def keys(self) -> Iterator[str]:
+        """Step through an object's keys; the caller consumes each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+def _iter_chat(stream: _JsonStream, chat_info: Dict, batch_size: int) -> Iterator[Tuple[Dict, List[ChatMessage]]]:
+    for key in stream.keys():
+        if key != 'messages':
+            chat_info[key] = stream.value()
+            continue
+        rows = []
+        for _ in stream.items():
+            rows.append(stream.value())
+            if len(rows) >= batch_size:
+                yield chat_info, _json_messages(rows)
+                rows = []
+        if rows:
+            yield chat_info, _json_messages(rows)
+
+def iter_exporter_json(json_path: Path, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[Dict, List[ChatMessage]]]:
+    """
+    Stream JSON output from WechatExporter, conversation by conversation.
+    Yields (chat_info, messages) with at most `batch_size` messages per batch; a long
+    conversation comes in several batches that share one chat_info dict.
+    chat_info holds the conversation's other keys read so far, plus "chat_index".
+    Accepts a top-level list of conversations or {"conversations": [...]}.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        first = stream.peek()
+        if not first:
+            # Empty export (e.g. an interrupted run): no conversations, like {}
+            return
+        if first == "[":
+            chats = stream.items()
+        else:
+            chats = None
+            for key in stream.keys():
+                if key == 'conversations':
+                    chats = stream.items()
+                    break
+                stream.value()
+            if chats is None:
+                return
+        for chat_index, _ in enumerate(chats):
+            yield from _iter_chat(stream, {"chat_index": chat_index}, batch_size)
+
+def iter_wechat_csv(csv_path: Path, batch_size: int = BATCH_SIZE) -> Iterator[List[ChatMessage]]:
+    """
+    Stream a CSV export in batches of `batch_size` rows.
+    Assumed columns: CreateTime, Sender, Type, Content, IsSender
+    """
+    import pandas as pd
+
+    row_number = 0
+    chunks = pd.read_csv(csv_path, encoding='utf-8-sig', dtype=str, keep_default_na=False, chunksize=batch_size)
+    for chunk in chunks:
+        column = lambda name, default='': chunk[name] if name in chunk else pd.Series(default, index=chunk.index)
+        timestamps = parse_timestamps(column('CreateTime'))
+        is_sender = column('IsSender', '0').str.strip().str.lower().isin(['1', 'true'])
+        msg_type = column('Type').replace('', 'text')
+        yield [
+            ChatMessage(
+                id=f"csv-{row_number + i}",
+                sender=sender,
+                content=content,
                 timestamp=ts,
-                is_sender=m.get('isSender', False),
-                msg_type=m.get('type', 'text')
+                is_sender=sent,
+                msg_type=kind,
             )
-            messages.append(msg)
-            
+            for i, (sender, content, ts, sent, kind) in enumerate(zip(
+                column('Sender'), column('Content'), timestamps, is_sender.tolist(), msg_type))
+        ]
+        row_number += len(chunk)
+
+def parse_wechat_exporter_json(json_path: Path) -> List[ChatMessage]:
+    """
+    Parse JSON output from WechatExporter into one list (see iter_exporter_json for streaming).
+    """
+    if not json_path.exists():
+        print(f"File not found: {json_path}")
+        return []
+    messages = [m for _chat, batch in iter_exporter_json(json_path) for m in batch]
     print(f"Parsed {len(messages)} JSON messages.")
     return messages
 
 def parse_wechat_csv(csv_path: Path) -> List[ChatMessage]:
     """
-    Parse CSV export.
-    Assumed columns: CreateTime, Sender, Type, Content, IsSender
+    Parse CSV export into one list (see iter_wechat_csv for streaming).
     """
-    messages = []
     if not csv_path.exists():
         print(f"File not found: {csv_path}")
         return []
-        
-    with open(csv_path, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                # Handle timestamp
-                ts_str = row.get('CreateTime', '')
-                try:
-                     # Attempt generic parsing or timestamp
-                    ts = datetime.fromisoformat(ts_str) if 'T' in ts_str else datetime.now()
-                except:
-                    ts = datetime.now()
-
-                msg = ChatMessage(
-                    id=f"csv-{len(messages)}",
-                    sender=row.get('Sender', ''),
-                    content=row.get('Content', ''),
-                    timestamp=ts,
-                    is_sender=row.get('IsSender', '0') == '1',
-                    msg_type=row.get('Type', 'text')
-                )
-                messages.append(msg)
-            except Exception as e:
-                print(f"Skipping row error: {e}")
-
+    messages = [m for batch in iter_wechat_csv(csv_path) for m in batch]
     print(f"Parsed {len(messages)} CSV messages.")
     return messages
 
+def _summarize(batches, label, total, samples):
+    """Count a stream of message batches (kept out of memory), keeping a few samples."""
+    count = undated = 0
+    for batch in batches:
+        count += len(batch)
+        undated += sum(1 for m in batch if m.timestamp is None)
+        samples.extend(batch[:3 - len(samples)])
+    print(f"  {count} {label} messages" + (f" ({undated} without a valid timestamp)" if undated else ""))
+    return total + count
+
 if __name__ == "__main__":
     # Example usage
     base_dir = Path(__file__).parent
-    
+
     # Look for exported files in 'output' folder
     output_dir = base_dir / "output" # User puts WechatExporter data here
-    
+
     json_files = list(output_dir.glob("*.json"))
     csv_files = list(output_dir.glob("*.csv"))
-    
-    all_messages = []
-    
+
+    total = 0
+    samples = []
+
     for f in json_files:
         print(f"Processing JSON: {f.name}")
-        all_messages.extend(parse_wechat_exporter_json(f))
-        
+        total = _summarize((batch for _chat, batch in iter_exporter_json(f)), "JSON", total, samples)
+
     for f in csv_files:
         print(f"Processing CSV: {f.name}")
-        all_messages.extend(parse_wechat_csv(f))
+        total = _summarize(iter_wechat_csv(f), "CSV", total, samples)
 
-    if all_messages:
-        print(f"\nTotal messages loaded: {len(all_messages)}")
+    if total:
+        print(f"\nTotal messages loaded: {total}")
         print("Sample (first 3):")
-        for m in all_messages[:3]:
+        for m in samples:
             print(m)
     else:
         print("No messages parsed. Please convert your backup (using WechatExporter) and place .json/.csv files in the 'output' folder.")
@@ -4,6 +4,13 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+from catalog import Catalog, chat_stats, is_group_chat
+from chat_store import write_chat
+from group_members import SYSTEM_TYPES, load_group_members
+from pipeline_jobs import ProgressReporter, report_progress
+from search_index import update_index as update_search_index
+from transcription_cache import STORE_NAME, TranscriptionStore
+
 # Path to the extracted DB directory
 DB_DIR = Path(__file__).parent / "extracted_wechat_db"
 OUTPUT_FILE = Path(__file__).parent / "parsed_messages.json"
@@ -131,6 +138,112 @@ def load_friends_map():
     conn.close()
     return friends
 
+def build_hash_map(friends_map):
+    """MD5(UsrName) -> (UsrName, NickName); chat tables are named Chat_<md5>."""
+    return {get_md5(usr): (usr, nick) for usr, nick in friends_map.items()}
+
+def parse_message_db(db_path, hash_map, members=None):
+    """
+    All conversations stored in one message_*.sqlite file.
+    With a GroupMembers map, received group messages get their real sender (the "wxid:\n"
+    prefix is split off the content).
+    """
+    conversations = []
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # Get all tables (Exclude ChatExt tables which are auxiliary)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'Chat_%' AND name NOT LIKE 'ChatExt%'")
+    tables = [r[0] for r in cursor.fetchall()]
+    
+    for table_name in tables:
+        # Extract hash from table name (Chat_HASH)
+        chat_hash = table_name.replace("Chat_", "")
+        
+        # Lookup friend
+        friend_info = hash_map.get(chat_hash)
+        if friend_info:
+            usr, nick = friend_info
+        else:
+            usr, nick = ("Unknown", f"Unknown ({chat_hash})")
+        group = members is not None and is_group_chat(usr)
+        
+        # Read messages
+        try:
+            # Type 1=Text, 3=Image, 34=Voice, 47=Emoji, 49=AppMsg
+            # Added MesLocalID for linking media files
+            cursor.execute(f"SELECT CreateTime, Message, Des, Type, MesLocalID FROM {table_name} ORDER BY CreateTime ASC")
+            rows = cursor.fetchall()
+            
+            msgs = []
+            for r in rows:
+                ts = r[0]
+                content = r[1]
+                des = r[2] # 0=Recv, 1=Sent
+                msg_type = r[3]
+                msg_id = r[4]
+                
+                # Clean content to ensure valid JSON
+                if content is None:
+                    content = ""
+                elif isinstance(content, bytes):
+                    content = "[BINARY DATA]" # Or try decode?
+                else:
+                    content = str(content).replace('\x00', '')
+
+                msg = {
+                    "id": msg_id,
+                    "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                    "sender": "Me" if des == 1 else nick,
+                    "content": content,
+                    "type": msg_type,
+                    "is_sender": des == 1
+                }
+                if group and des != 1 and msg_type not in SYSTEM_TYPES:
+                    sender_id, msg["content"] = members.split(usr, content)
+                    if sender_id:
+                        msg["sender_id"] = sender_id
+                        msg["sender"] = members.name(usr, sender_id)
+                msgs.append(msg)
+            if msgs:
+                conversations.append({
+                    "friend_id": usr,
+                    "friend_name": nick,
+                    "messages": msgs
+                })
+                
+        except Exception as e:
+            print(f"  Error reading table {table_name}: {e}")
+            
+    conn.close()
+    return conversations
+
+def write_conversation(conv, data_dir):
+    """Write one chat file (named by MD5 of the friend id) and return its index.json row (with catalog stats)."""
+    # Sanitize filename
+    safe_id = get_md5(conv["friend_id"])
+    
+    # One message per line + offsets sidecar, so viewers can read slices without a full parse
+    write_chat(Path(data_dir) / f"{safe_id}.json", conv)
+    
+    return {
+        "friend_id": conv["friend_id"],
+        "friend_name": conv["friend_name"],
+        "message_count": len(conv["messages"]),
+        "file_uuid": safe_id,
+        **chat_stats(conv["friend_id"], conv["messages"])
+    }
+
+def write_index(index_data, output_dir):
+    with open(Path(output_dir) / "index.json", 'w', encoding='utf-8') as f:
+        json.dump(index_data, f, ensure_ascii=False, indent=2)
+    # Same rows in an indexed table, for sorting/filtering without loading every row
+    catalog = Catalog(output_dir)
+    try:
+        catalog.rebuild(index_data)
+    finally:
+        catalog.close()
+
 def parse_messages(friends_map, output_dir=None):
     if output_dir is None:
         output_dir = OUTPUT_FILE.parent / "parsed_data"
@@ -138,10 +251,9 @@ def parse_messages(friends_map, output_dir=None):
     all_conversations = []
     
     # 1. Map MD5(UsrName) -> NickName for easier lookup
-    hash_map = {}
-    for usr, nick in friends_map.items():
-        h = get_md5(usr)
-        hash_map[h] = (usr, nick)
+    hash_map = build_hash_map(friends_map)
+    # Group members and their display names, loaded once for all message DBs
+    members = load_group_members(DB_DIR, friends_map)
         
     # 2. Iterate all message_*.sqlite files (use rglob for recursion)
     msg_dbs = list(DB_DIR.rglob("*message_*.sqlite"))
@@ -153,104 +265,60 @@ def parse_messages(friends_map, output_dir=None):
     print(f"Found {len(msg_dbs)} message databases.")
     
     total_msgs = 0
+    db_progress = ProgressReporter("parse", len(msg_dbs), phase="databases", interval=0)
     
-    for db_path in msg_dbs:
+    for n, db_path in enumerate(msg_dbs):
+        db_progress.update(n, current=db_path.name)
         print(f"Reading {db_path.name}...")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get all tables (Exclude ChatExt tables which are auxiliary)
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'Chat_%' AND name NOT LIKE 'ChatExt%'")
-        tables = [r[0] for r in cursor.fetchall()]
-        
-        for table_name in tables:
-            # Extract hash from table name (Chat_HASH)
-            chat_hash = table_name.replace("Chat_", "")
-            
-            # Lookup friend
-            friend_info = hash_map.get(chat_hash)
-            if friend_info:
-                usr, nick = friend_info
-            else:
-                usr, nick = ("Unknown", f"Unknown ({chat_hash})")
-            
-            # Read messages
-            try:
-                # Type 1=Text, 3=Image, 34=Voice, 47=Emoji, 49=AppMsg
-                # Added MesLocalID for linking media files
-                cursor.execute(f"SELECT CreateTime, Message, Des, Type, MesLocalID FROM {table_name} ORDER BY CreateTime ASC")
-                rows = cursor.fetchall()
-                
-                msgs = []
-                for r in rows:
-                    ts = r[0]
-                    content = r[1]
-                    des = r[2] # 0=Recv, 1=Sent
-                    msg_type = r[3]
-                    msg_id = r[4]
-                    
-                    # Clean content to ensure valid JSON
-                    if content is None:
-                        content = ""
-                    elif isinstance(content, bytes):
-                        content = "[BINARY DATA]" # Or try decode?
-                    else:
-                        content = str(content).replace('\x00', '')
+        conversations = parse_message_db(db_path, hash_map, members)
+        all_conversations.extend(conversations)
+        total_msgs += sum(len(conv["messages"]) for conv in conversations)
 
-                    msgs.append({
-                        "id": msg_id,
-                        "timestamp": datetime.fromtimestamp(ts).isoformat(),
-                        "sender": "Me" if des == 1 else nick,
-                        "content": content,
-                        "type": msg_type,
-                        "is_sender": des == 1
-                    })
-                if msgs:
-                    all_conversations.append({
-                        "friend_id": usr,
-                        "friend_name": nick,
-                        "messages": msgs
-                    })
-                    total_msgs += len(msgs)
-                    # print(f"  Parsed {len(msgs)} messages with {nick}")
-                    
-            except Exception as e:
-                print(f"  Error reading table {table_name}: {e}")
-                
-        conn.close()
+    # Re-attach transcriptions from earlier runs so re-parsing doesn't throw them away
+    rejoined = rejoin_transcriptions(all_conversations, output_dir)
+    if rejoined:
+        print(f"Restored {rejoined} voice transcriptions from {STORE_NAME}.")
 
     data_dir = output_dir / "chats"
     data_dir.mkdir(exist_ok=True, parents=True)
     
     index_data = []
+    write_progress = ProgressReporter("parse", len(all_conversations), phase="writing")
 
-    for conv in all_conversations:
-        friend_id = conv["friend_id"]
-        friend_name = conv["friend_name"]
-        
-        # Sanitize filename
-        safe_id = get_md5(friend_id)
-        
-        chat_file = data_dir / f"{safe_id}.json"
-        
-        with open(chat_file, 'w', encoding='utf-8') as f:
-            json.dump(conv, f, ensure_ascii=False, indent=2)
-            
-        index_data.append({
-            "friend_id": friend_id,
-            "friend_name": friend_name,
-            "message_count": len(conv["messages"]),
-            "file_uuid": safe_id
-        })
+    for n, conv in enumerate(all_conversations, 1):
+        index_data.append(write_conversation(conv, data_dir))
+        write_progress.update(n)
         
     # Save main index
-    with open(output_dir / "index.json", 'w', encoding='utf-8') as f:
-        json.dump(index_data, f, ensure_ascii=False, indent=2)
+    write_index(index_data, output_dir)
         
+    # Incremental: only chats whose files changed are re-tokenized
+    report_progress("parse", 0, 1, phase="search index")
+    reindexed = update_search_index(output_dir)
+    print(f"Search index updated ({reindexed} chats re-indexed).")
+
     print(f"\nDone! Parsed {total_msgs} messages from {len(all_conversations)} chats.")
     print(f"Saved index to: {output_dir / 'index.json'}")
     print(f"Saved {len(all_conversations)} chat files to: {data_dir}")
 
+def rejoin_transcriptions(conversations, output_dir):
+    """
+    Fill voice messages from the transcription store kept in the output directory.
+    Audio is looked up in every Audio/ folder of the extraction (DB_DIR).
+    """
+    store_path = Path(output_dir) / STORE_NAME
+    if not store_path.exists():
+        return 0
+    audio_dirs = [p for p in DB_DIR.rglob("Audio") if p.is_dir()]
+    if not audio_dirs:
+        return 0
+
+    store = TranscriptionStore(store_path)
+    try:
+        return sum(store.rejoin_chat(conv, audio_dirs) for conv in conversations)
+    finally:
+        store.close()
+
 def load_friends_map_v2():
     # 1. Try WCDB_Contact (often best source for iOS)
     # Use rglob to find files in subdirectories (e.g. user hash folder)
@@ -325,6 +393,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", "-i", type=Path, help="Input directory containing SQLite files", default=DB_DIR)
     parser.add_argument("--output", "-o", type=Path, help="Output directory for JSONs", default=Path(__file__).parent / "parsed_data")
+    parser.add_argument("--archive", type=Path, default=None, help="Also merge this parse into an append-only archive directory")
     
     args = parser.parse_args()
     
@@ -340,3 +409,7 @@ if __name__ == "__main__":
     friends = load_friends_map_v2()
     print(f"Loaded {len(friends)} friends total.")
     parse_messages(friends, OUTPUT_FILE.parent)
+
+    if args.archive:
+        from archive import merge_into_archive
+        merge_into_archive(OUTPUT_FILE.parent, args.archive)
@@ -0,0 +1,192 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+# Pipeline stages (extract, parse, ...) run as detached background processes.
+# Each job is a pair of files in the jobs directory:
+#   <id>.json  state: stage, command, pid, start/finish time, exit code
+#   <id>.log   combined stdout/stderr, streamed as the process runs
+# Structured progress is printed by the stage itself as "@@PROGRESS {json}" lines.
+# Everything lives on disk, so jobs survive page reloads and UI restarts.
+PROGRESS_PREFIX = "@@PROGRESS "
+TAIL_BYTES = 64 * 1024
+
+
+def report_progress(stage, done, total, **extra):
+    """Print one progress event for the job runner / UI to pick up."""
+    event = {"stage": stage, "done": done, "total": total, **extra}
+    print(PROGRESS_PREFIX + json.dumps(event, ensure_ascii=False), flush=True)
+
+
+class ProgressReporter:
+    """report_progress, throttled to one event per `interval` seconds (plus the final one)."""
+
+    def __init__(self, stage, total, interval=0.5, **extra):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.extra = extra
+        self._last = 0.0
+
+    def update(self, done, **extra):
+        now = time.monotonic()
+        if done >= self.total or now - self._last >= self.interval:
+            self._last = now
+            report_progress(self.stage, done, self.total, **self.extra, **extra)
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PipelineJob:
+    """Handle on one background job; every call re-reads the state from disk."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @property
+    def id(self):
+        return self.path.stem
+
+    @property
+    def log_path(self):
+        return self.path.with_suffix(".log")
+
+    def info(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, **fields):
+        info = self.info()
+        info.update(fields)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_alive(self):
+        info = self.info()
+        return "returncode" not in info and _pid_alive(info.get("pid"))
+
+    def state(self):
+        """running / done / failed / cancelled / interrupted (runner died without recording an exit code)."""
+        info = self.info()
+        if info.get("cancelled"):
+            return "running" if self.is_alive() else "cancelled"
+        if "returncode" in info:
+            return "done" if info["returncode"] == 0 else "failed"
+        return "running" if _pid_alive(info.get("pid")) else "interrupted"
+
+    def _read_tail(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - TAIL_BYTES))
+                data = f.read()
+        except OSError:
+            return []
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        # First line may be cut in half by the seek
+        return lines[1:] if size > TAIL_BYTES else lines
+
+    def progress(self):
+        """Latest progress event, or None."""
+        for line in reversed(self._read_tail()):
+            if line.startswith(PROGRESS_PREFIX):
+                try:
+                    return json.loads(line[len(PROGRESS_PREFIX):])
+                except ValueError:
+                    continue
+        return None
+
+    def tail(self, lines=30):
+        """Last log lines, without progress events."""
+        text = [line for line in self._read_tail() if not line.startswith(PROGRESS_PREFIX)]
+        return text[-lines:]
+
+    def cancel(self):
+        """Terminate the runner and the stage process (they share one process group)."""
+        pid = self.info().get("pid")
+        self.update(cancelled=True)
+        if not _pid_alive(pid):
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(pid, signal.SIGTERM)
+            else:
+                os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def start_job(jobs_dir, stage, cmd, label=None):
+    """
+    Launch `cmd` in the background (detached from the caller) and return its PipelineJob.
+    The command runs under this module's runner, which streams output to the log and
+    records the exit code.
+    """
+    jobs_dir = Path(jobs_dir)
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    job_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{stage}_{uuid.uuid4().hex[:6]}"
+    job = PipelineJob(jobs_dir / f"{job_id}.json")
+    job.update(id=job_id, stage=stage, label=label or stage, cmd=[str(c) for c in cmd], started=time.time())
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), str(job.path)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    job.update(pid=proc.pid)
+    return job
+
+
+def list_jobs(jobs_dir, stage=None):
+    """Jobs in `jobs_dir`, newest first."""
+    jobs_dir = Path(jobs_dir)
+    if not jobs_dir.exists():
+        return []
+    jobs = [PipelineJob(p) for p in sorted(jobs_dir.glob("*.json"), reverse=True)]
+    if stage is not None:
+        jobs = [job for job in jobs if job.info().get("stage") == stage]
+    return jobs
+
+
+def latest_job(jobs_dir, stage):
+    jobs = list_jobs(jobs_dir, stage)
+    return jobs[0] if jobs else None
+
+
+def _run(job_path):
+    job = PipelineJob(job_path)
+    info = job.info()
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    with open(job.log_path, "ab") as log:
+        proc = subprocess.Popen(info["cmd"], stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+        def forward(signum, _frame):
+            proc.send_signal(signum)
+
+        signal.signal(signal.SIGTERM, forward)
+        returncode = proc.wait()
+    job.update(returncode=returncode, finished=time.time())
+
+
+if __name__ == "__main__":
+    _run(sys.argv[1])
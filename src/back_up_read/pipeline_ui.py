@@ -1,12 +1,12 @@
 import streamlit as st
-import json
 import os
 import subprocess
 import sys
 from pathlib import Path
 import shutil
 import hashlib
-import re
+import time
+from datetime import timedelta
 
 # Add current dir to sys.path
 current_dir = Path(__file__).parent
@@ -14,9 +14,39 @@ sys.path.append(str(current_dir))
 
 # Imports from local modules
 try:
-    from transcribe_audio import process_chat
+    from transcribe_jobs import TranscriptionJob, job_path, format_eta
 except ImportError:
-    process_chat = None
+    TranscriptionJob = None
+
+try:
+    from transcription_cache import STORE_NAME, TranscriptionStore, store_version
+except ImportError:
+    TranscriptionStore = None
+
+from chat_store import file_key, load_index, memoize, open_chat, stream_chat
+from catalog import open_catalog
+from contact_index import load_contact_index
+from chat_render import ChatSlice, show_chat_pages
+from export_engine import FORMATS, MIME_TYPES, export_all, export_chat, export_filename
+from pipeline_jobs import latest_job, start_job
+from thumbnail_cache import ChatMedia, get_thumbnail_cache
+from backup_discovery import backup_label, default_roots, get_discovery
+
+CONTACT_LIMIT = 500
+# Chat list sort label -> (catalog order, descending)
+CHAT_SORTS = {
+    "最近活跃 (Last active)": ("last_ts", True),
+    "消息数量 (多->少)": ("message_count", True),
+    "消息数量 (少->多)": ("message_count", False),
+    "最早开始 (First message)": ("first_ts", False),
+    "语音最多 (Most voice)": ("voice_count", True),
+}
+CHAT_KINDS = {"全部 (All)": None, "私聊 (Private)": False, "群聊 (Groups)": True}
+
+try:
+    from search_index import SearchIndex
+except ImportError:
+    SearchIndex = None
 
 try:
     from audio_converter import batch_convert, check_dependencies as check_converter
@@ -24,6 +54,114 @@ except ImportError:
     batch_convert = None
     check_converter = lambda: (False, "Module not found")
 
+def launch_transcription_job(parsed_dir, audio_dir, chat_uuid=None, workers=1):
+    """Start transcribe_jobs.py as a background pipeline job."""
+    cmd = [
+        sys.executable, str(current_dir / "transcribe_jobs.py"), "run",
+        "--parsed_dir", str(parsed_dir),
+        "--audio_dir", str(audio_dir),
+        "--workers", str(workers),
+        "--model", "base",
+    ]
+    if chat_uuid:
+        cmd += ["--chat", chat_uuid]
+    start_job(PIPELINE_JOBS_DIR, "transcribe", cmd, label=f"transcribe {chat_uuid or 'all'}")
+
+def show_pipeline_job(job, done_message=None):
+    """Live view of a background pipeline job: latest progress event, log tail, cancel."""
+    def render():
+        state = job.state()
+        info = job.info()
+        event = job.progress()
+        if event and event.get("total"):
+            phase = event.get("phase") or event.get("stage")
+            st.progress(min(1.0, event["done"] / event["total"]), text=f"{phase}: {event['done']}/{event['total']}")
+        elapsed = (info.get("finished") or time.time()) - info.get("started", time.time())
+        st.caption(f"{info.get('label', job.id)} · {state} · {format_duration(elapsed)}")
+        st.code("\n".join(job.tail()) or "...", language=None)
+        if state == "running":
+            if st.button("⏹️ 取消 (Cancel)", key=f"cancel_{job.id}"):
+                job.cancel()
+                st.rerun()
+        elif state == "done" and done_message:
+            st.success(done_message)
+        elif state == "failed":
+            st.error(f"任务失败 (exit code {info.get('returncode')})")
+        elif state in ("cancelled", "interrupted"):
+            st.warning(f"任务已中止 ({state})")
+
+    # Re-render just this block every 2s while the job runs (older Streamlit: refresh manually)
+    fragment = getattr(st, "fragment", None)
+    if job.state() != "running":
+        render()
+    elif fragment is not None:
+        fragment(run_every=2)(render)()
+    else:
+        render()
+        if st.button("🔄 刷新进度 (Refresh)", key=f"refresh_{job.id}"):
+            st.rerun()
+
+def rejoin_transcriptions(parse_out, chat_path, audio_dir):
+    """
+    Fill a chat's voice messages from the transcription store, once per chat + store version.
+    Matches are written back into the chat file, so the View tab just reads it afterwards.
+    """
+    store_path = Path(parse_out) / STORE_NAME
+    if not store_path.exists():
+        return 0
+
+    def build():
+        store = TranscriptionStore(store_path)
+        try:
+            return store.rejoin_file(chat_path, audio_dir)
+        finally:
+            store.close()
+
+    version = store_version(store_path) + (str(audio_dir),)
+    memo_key = lambda: ("rejoin",) + file_key(chat_path) + version
+    count = memoize(memo_key(), build, lambda _n: 64)
+    if count:
+        # The rewritten file (new key) is already complete: don't scan it again on the next rerun
+        memoize(memo_key(), lambda: 0, lambda _n: 64)
+    return count
+
+def voice_messages(chat_path):
+    """[(MesLocalID, transcribed)] of a chat's voice messages, streamed once per file version."""
+    def build():
+        _meta, messages = stream_chat(chat_path)
+        return [
+            (str(m.get("id")), bool(m.get("transcription") or "[Voice]" in str(m.get("content") or "")))
+            for m in messages if m.get("type") == 34
+        ]
+    return memoize(("voice",) + file_key(chat_path), build, lambda v: 64 * len(v) + 64)
+
+def format_duration(seconds):
+    seconds = int(max(0, seconds))
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def show_transcription_job(job, key):
+    """Progress, ETA and pause/resume controls for a transcription job."""
+    status = job.status()
+    if status["total"] == 0:
+        return
+    done = status["done"] + status["failed"]
+    st.progress(done / status["total"], text=f"{status['state']}: {status['done']}/{status['total']} (失败 {status['failed']})")
+    if status["throughput"] and status["remaining"]:
+        st.caption(f"⏱️ {status['throughput']:.2f} 条/秒 | 预计剩余 (ETA) {format_eta(status['eta_seconds'])}")
+
+    col_a, col_b = st.columns(2)
+    if status["state"] == "running":
+        if col_a.button("⏸️ 暂停 (Pause)", key=f"pause_{key}"):
+            job.request_pause()
+            st.rerun()
+        if col_b.button("🔄 刷新进度 (Refresh)", key=f"refresh_{key}"):
+            st.rerun()
+    elif status["state"] in ("paused", "interrupted") and status["remaining"]:
+        if col_a.button("▶️ 继续 (Resume)", key=f"resume_{key}"):
+            chat_uuid = None if key == "all" else key
+            launch_transcription_job(job.get("parsed_dir"), job.get("audio_dir"), chat_uuid)
+            st.rerun()
+
 st.set_page_config(page_title="WeChat Data Pipeline", layout="wide", page_icon="🧩")
 
 st.title("🧩 WeChat Backup Pipeline")
@@ -32,6 +170,12 @@ st.title("🧩 WeChat Backup Pipeline")
 default_root = str(Path.home() / "Downloads")
 # Unified Output Root: always ~/Downloads/wechat-back-up-export/
 FIXED_EXPORT_ROOT = str(Path.home() / "Downloads" / "wechat-back-up-export")
+# State + logs of background pipeline jobs (extract / parse / transcribe)
+PIPELINE_JOBS_DIR = Path(FIXED_EXPORT_ROOT) / "jobs"
+# Audio of every extraction, stored once (see media_store.py)
+MEDIA_STORE_DIR = Path(FIXED_EXPORT_ROOT) / "media_store"
+THUMBNAIL_DIR = Path(FIXED_EXPORT_ROOT) / "thumbnails"
+BACKUP_CACHE = Path(FIXED_EXPORT_ROOT) / "backup_cache.json"
 
 if "backup_path" not in st.session_state:
     st.session_state["backup_path"] = ""
@@ -53,7 +197,7 @@ if "parse_output" not in st.session_state or st.session_state["parse_output"] ==
     st.session_state["parse_output"] = new_default_parse
     
 # Tabs
-tab1, tab2, tab3 = st.tabs(["1️⃣ 提取 (Extract)", "2️⃣ 解析 (Parse)", "3️⃣ 浏览与导出 (View & Export)"])
+tab1, tab2, tab3, tab4 = st.tabs(["1️⃣ 提取 (Extract)", "2️⃣ 解析 (Parse)", "3️⃣ 浏览与导出 (View & Export)", "📊 分析 (Analytics)"])
 
 # --- TAB 1: EXTRACT ---
 with tab1:
@@ -68,36 +212,28 @@ with tab1:
         help="程序将在此目录下寻找 iOS 备份文件夹 (含 Manifest.db)。默认: ~/Downloads"
     )
 
-    # Auto-detect backups
-    def get_backups(user_root):
-        roots = [
-            Path.home() / "Library/Application Support/MobileSync/Backup"
-        ]
-        if user_root:
-            roots.insert(0, Path(user_root))
-            
-        candidates = []
-        for r in roots:
-            if r.exists():
-                try:
-                    for d in r.iterdir():
-                        if d.is_dir() and (d / "Manifest.db").exists():
-                            try:
-                                candidates.append(str(d))
-                            except: pass
-                except PermissionError:
-                    st.warning(f"无法访问目录 (请授予 Full Disk Access): {r}")
-                except Exception:
-                    pass
-        return candidates
-
-    backups = get_backups(scan_root)
-    
+    # Auto-detect backups: cached listing + device metadata, refreshed in the background
+    discovery = get_discovery(default_roots(scan_root), BACKUP_CACHE)
+    col_found, col_rescan = st.columns([4, 1])
+    with col_rescan:
+        if st.button("🔄 重新扫描 (Rescan)"):
+            with st.spinner("Scanning..."):
+                discovery.scan(force=True)
+            discovery.refresh_in_background()
+    backups = {b["path"]: b for b in discovery.backups()}
+    for root, error in discovery.errors.items():
+        st.warning(f"无法访问目录 (请授予 Full Disk Access): {root} ({error})")
+    with col_found:
+        if discovery.refreshing:
+            st.caption("⏳ 正在后台刷新备份信息 (Refreshing backup details in the background)")
+
     col1, col2 = st.columns([3, 1])
     with col1:
         if backups:
-            selected = st.selectbox("检测到的备份:", backups)
+            selected = st.selectbox("检测到的备份:", list(backups), format_func=lambda p: backup_label(backups[p]))
             st.session_state["backup_path"] = selected
+            if backups[selected].get("encrypted"):
+                st.warning("该备份已加密，无法读取。请在 Finder 中关闭“加密本地备份”后重新备份。")
         else:
             st.warning("未检测到默认路径下的备份，请手动输入。")
             
@@ -110,8 +246,12 @@ with tab1:
         st.text_input("Extract Output", key="extract_output", label_visibility="collapsed")
         # Clarified label: "Extract Audio Files (No Parsing/Transcription)"
         extract_audio_opt = st.checkbox("提取语音文件 (Extract Audio Files)", value=True, help="仅复制音频文件，不进行转录 (No Transcription). 耗时较长。")
+        extract_media_opt = st.checkbox("提取图片和视频 (Extract Images & Videos)", value=False, help="复制聊天图片、视频及其缩略图，查看聊天时显示缩略图。")
+        shared_media_opt = st.checkbox("共享媒体库 (Shared media store)", value=True, help=f"语音/媒体文件只保存一份于 {MEDIA_STORE_DIR}，各次提取通过硬链接引用，重复提取不再复制。")
 
-    if st.button("🚀 开始提取 (Start Extraction)"):
+    extract_job = latest_job(PIPELINE_JOBS_DIR, "extract")
+    extract_running = extract_job is not None and extract_job.state() == "running"
+    if st.button("🚀 开始提取 (Start Extraction)", disabled=extract_running):
         if not st.session_state["backup_path"]:
             st.error("请选择或输入备份路径。")
         else:
@@ -123,20 +263,16 @@ with tab1:
             ]
             if extract_audio_opt:
                 cmd.append("--extract_audio")
+            if extract_media_opt:
+                cmd.append("--extract_media")
+            if shared_media_opt and (extract_audio_opt or extract_media_opt):
+                cmd += ["--media_store", str(MEDIA_STORE_DIR)]
             
-            with st.status("正在提取...", expanded=True) as status:
-                st.write(f"运行命令: {' '.join(cmd)}")
-                try:
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    st.text(result.stdout)
-                    if result.returncode == 0:
-                        status.update(label="提取成功!", state="complete", expanded=False)
-                        st.success("提取完成！请前往 Step 2 解析数据。")
-                    else:
-                        status.update(label="提取失败", state="error")
-                        st.error(result.stderr)
-                except Exception as e:
-                    st.error(f"执行出错: {e}")
+            # Runs in the background: the page stays usable and the job survives reloads
+            extract_job = start_job(PIPELINE_JOBS_DIR, "extract", cmd, label=f"extract {Path(st.session_state['backup_path']).name}")
+
+    if extract_job is not None:
+        show_pipeline_job(extract_job, done_message="提取完成！请前往 Step 2 解析数据。")
 
 # --- TAB 2: PARSE ---
 with tab2:
@@ -148,7 +284,9 @@ with tab2:
     
     st.session_state["parse_output"] = output_dir # sync
     
-    if st.button("🧩 开始解析 (Start Parsing)"):
+    parse_job = latest_job(PIPELINE_JOBS_DIR, "parse")
+    parse_running = parse_job is not None and parse_job.state() == "running"
+    if st.button("🧩 开始解析 (Start Parsing)", disabled=parse_running):
         if not os.path.exists(input_dir):
             st.error(f"输入目录不存在: {input_dir}")
         else:
@@ -159,23 +297,10 @@ with tab2:
                 "--output", output_dir
             ]
             
-            with st.status("正在解析...", expanded=True) as status:
-                st.write(f"读取: {input_dir}")
-                st.write(f"写入: {output_dir}")
-                
-                try:
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    # Streamlit subprocess output handling is synchronous here
-                    st.text(result.stdout)
-                    
-                    if result.returncode == 0:
-                        status.update(label="解析成功!", state="complete", expanded=False)
-                        st.success("解析完成！已生成 index.json 和聊天记录文件。请前往 Step 3 浏览。")
-                    else:
-                        st.error(result.stderr)
-                        status.update(label="解析失败", state="error")
-                except Exception as e:
-                    st.error(f"执行出错: {e}")
+            parse_job = start_job(PIPELINE_JOBS_DIR, "parse", cmd, label=f"parse → {output_dir}")
+
+    if parse_job is not None:
+        show_pipeline_job(parse_job, done_message="解析完成！已生成 index.json 和聊天记录文件。请前往 Step 3 浏览。")
 
 # --- TAB 3: VIEW & EXPORT ---
 with tab3:
@@ -190,27 +315,84 @@ with tab3:
     else:
         # Load Index
         try:
-            with open(index_file, 'r', encoding='utf-8') as f:
-                index_data = json.load(f)
+            # Parsed once per index.json version and shared by all sessions
+            index_data = load_index(index_file)
         except Exception as e:
             st.error(f"读取索引失败: {e}")
             st.stop()
             
+        # Same data over HTTP for other local tools (read-only, bound to 127.0.0.1)
+        with st.expander("🌐 本地 API (Local HTTP API)"):
+            if st.toggle("启动 API 服务 (Start API server)", key="api_server_on"):
+                from api_server import DEFAULT_PORT, serve_in_background
+
+                try:
+                    api_url = serve_in_background(parse_out, st.session_state["extract_output"], port=DEFAULT_PORT)
+                    st.caption(f"{api_url}/api/chats · /api/chats/<uuid>/messages · /api/search?q= · /api/media/<uuid>/<id>")
+                except OSError as e:
+                    st.error(f"无法启动 (Cannot start): {e}")
+
+        # Global full-text search across every chat (incl. voice transcriptions)
+        if SearchIndex is not None:
+            with st.expander("🔎 全局消息搜索 (Search All Messages)"):
+                col_q, col_order, col_upd = st.columns([3, 1, 1])
+                with col_q:
+                    global_query = st.text_input("关键词 (Keywords):", key="global_query")
+                with col_order:
+                    global_order = st.selectbox("排序 (Order):", ["relevance", "recent"], key="global_order")
+                search_index = SearchIndex(parse_out)
+                with col_upd:
+                    st.write("")
+                    if st.button("🔄 更新索引 (Update Index)"):
+                        with st.spinner("Indexing..."):
+                            changed = search_index.update()
+                        st.caption(f"已更新 {changed} 个对话")
+                if global_query:
+                    page = st.number_input("页码 (Page)", min_value=1, value=1, key="global_page") - 1
+                    total, hits = search_index.search(global_query, page=page, order=global_order)
+                    st.caption(f"共 {total} 条结果 (Total hits)")
+                    for hit in search_index.load_hits(hits):
+                        msg = hit["message"] or {}
+                        st.markdown(f"**{hit['friend_name']}** · {hit['timestamp'][:16]}  \n{str(msg.get('content', ''))[:200]}")
+                search_index.close()
+
         # Search & Sort
-        col_search, col_sort = st.columns([3, 1])
+        col_search, col_sort, col_kind = st.columns([3, 1, 1])
         with col_search:
             search = st.text_input("🔍 搜索好友 (昵称/ID):")
         with col_sort:
-            sort_by = st.selectbox("排序:", ["消息数量 (多->少)", "消息数量 (少->多)"])
+            sort_by = st.selectbox("排序:", list(CHAT_SORTS))
+        with col_kind:
+            chat_kind = st.selectbox("类型:", list(CHAT_KINDS))
+        col_voice, col_since = st.columns([1, 2])
+        with col_voice:
+            only_voice = st.checkbox("只看有语音 (Has voice)")
+        with col_since:
+            active_since = st.date_input("最近活跃于此日期之后 (Active since)", value=None)
             
-        # Filter & Sort Logic
-        filtered = [f for f in index_data if search.lower() in f['friend_name'].lower() or search.lower() in f['friend_id'].lower()]
-        
-        reverse_sort = True if "多->" in sort_by else False
-        filtered.sort(key=lambda x: x['message_count'], reverse=reverse_sort)
+        # Filter & Sort Logic: statistics come from the catalog, no chat file is opened
+        catalog = open_catalog(parse_out)
+        chat_filters = {"is_group": CHAT_KINDS[chat_kind], "has_voice": only_voice, "active_since": active_since}
+        if search.strip():
+            # Prefix / pinyin / fuzzy matches from the prebuilt index, kept in rank order
+            hits = load_contact_index(index_file).search(search, limit=CONTACT_LIMIT)
+            rank = {h['file_uuid']: i for i, h in enumerate(hits)}
+            filtered = sorted(catalog.query(uuids=rank, **chat_filters), key=lambda x: rank[x['file_uuid']])
+            if len(hits) == CONTACT_LIMIT:
+                st.caption(f"仅显示前 {CONTACT_LIMIT} 个匹配 (Showing top {CONTACT_LIMIT} matches)")
+        else:
+            order, desc = CHAT_SORTS[sort_by]
+            filtered = catalog.query(order=order, desc=desc, limit=CONTACT_LIMIT, **chat_filters)
+            matching = catalog.count(**chat_filters)
+            if matching > CONTACT_LIMIT:
+                st.caption(f"共 {matching} 个对话，显示前 {CONTACT_LIMIT} 个 (Showing {CONTACT_LIMIT} of {matching})")
+        catalog.close()
         
         # Selection
-        options = {f"{item['friend_name']} ({item['message_count']} msgs)": item for item in filtered}
+        options = {
+            f"{item['friend_name']} ({item['message_count']} msgs · {(item.get('last_ts') or '')[:10]})": item
+            for item in filtered
+        }
         
         if not options:
             st.info("没有找到匹配的好友。")
@@ -224,9 +406,6 @@ with tab3:
             if not os.path.exists(chat_path):
                 st.error(f"聊天文件丢失: {chat_path}")
             else:
-                with open(chat_path, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                
                 # Try to locate the real Audio directory (It is usually under the OwnerHash, not FriendHash)
                 # extract_output / <OwnerHash> / Audio
                 # We scan one level deep to find "Audio"
@@ -269,9 +448,35 @@ with tab3:
                 # ... (This logic is now replaced by find_audio_subdir)
 
                 
+                # Re-join transcriptions cached from earlier runs (they survive re-parsing)
+                if TranscriptionStore is not None and real_audio_src and selected_friend.get('voice_count'):
+                    rejoin_transcriptions(parse_out, chat_path, real_audio_src)
+
+                # Cached on (path, mtime): metadata + offsets only, pages are read as slices
+                chat_handle = open_chat(chat_path)
+                chat_meta = chat_handle.meta
+
                 st.divider()
-                st.subheader(f"💬 {chat_data['friend_name']}")
-                st.caption(f"ID: {chat_data['friend_id']} | File: {selected_friend['file_uuid']}.json")
+                st.subheader(f"💬 {chat_meta.get('friend_name', '')}")
+                st.caption(f"ID: {chat_meta.get('friend_id', '')} | File: {selected_friend['file_uuid']}.json")
+                if selected_friend.get('first_ts'):
+                    st.caption(
+                        f"📅 {selected_friend['first_ts'][:10]} → {selected_friend['last_ts'][:10]} | "
+                        f"发送 {selected_friend['sent']} / 接收 {selected_friend['received']} | "
+                        f"语音 {selected_friend['voice_count']}" + (" | 群聊 (Group)" if selected_friend['is_group'] else "")
+                    )
+
+                # Date window: mapped to a message range by binary search on the chat's timestamp index
+                date_range = st.date_input("日期范围 (Date range)", value=(), key=f"date_range_{selected_friend['file_uuid']}")
+                since = until = None
+                msg_start, msg_stop = 0, chat_handle.count
+                range_tag = ""
+                if len(date_range) == 2:
+                    since, until = date_range[0], date_range[1] + timedelta(days=1)
+                    msg_start, msg_stop = chat_handle.range(since, until)
+                    range_tag = f"_{date_range[0]}_{date_range[1]}"
+                    st.caption(f"{date_range[0]} → {date_range[1]}: {msg_stop - msg_start} 条消息 (messages)")
+                chat_source = ChatSlice(chat_handle, msg_start, msg_stop) if range_tag else chat_handle
                 
                 # --- ACTIONS ---
                 col_act1, col_act2 = st.columns([1, 1])
@@ -286,6 +491,8 @@ with tab3:
                     audio_src = real_audio_src
                     mp3_count = 0
                     aud_count = 0
+                    # Voice message ids only (the catalog row says whether there are any)
+                    msgs_with_voice = voice_messages(chat_path) if selected_friend.get('voice_count') else []
                     
                     if not audio_src or not os.path.exists(audio_src):
                         st.warning(
@@ -305,8 +512,7 @@ with tab3:
                         # Better approach: The current `audio_src` (real_audio_src) is a global folder found by scanning. 
                         # We should check if the files *referenced in this chat* exist there as aud/silk vs mp3.
                         
-                        msgs_with_voice = [m for m in chat_data.get("messages", []) if m.get("type") == 34]
-                        voice_ids = [str(m.get("id")) for m in msgs_with_voice]
+                        voice_ids = [vid for vid, _done in msgs_with_voice]
                         
                         # Count how many of THESE specific voice messages are converted
                         chat_aud_count = 0
@@ -359,82 +565,76 @@ with tab3:
 
                     # Transcribe Button
                     # Check transcription status
-                    transcribed_count = len([m for m in msgs_with_voice if m.get("transcription") or "[Voice]" in m.get("content", "")])
+                    transcribed_count = sum(done for _vid, done in msgs_with_voice)
                     is_all_transcribed = (transcribed_count == len(msgs_with_voice)) and (len(msgs_with_voice) > 0)
                     
                     if is_all_transcribed:
                         st.success(f"✅ 语音转录已完成 ({transcribed_count}/{len(msgs_with_voice)})")
                         st.button("🎙️ 转录语音消息 (Transcribe Audio)", disabled=True, key="transcribe_btn_disabled")
                     else:
-                        if st.button("🎙️ 转录语音消息 (Transcribe Audio)", disabled=False, key="transcribe_btn_active"):
+                        transcribe_workers = st.number_input(
+                            "并行进程 (Workers)", min_value=1, max_value=os.cpu_count() or 1, value=1,
+                            help="每个进程各自加载一份模型，线程数按 CPU 核心平均分配。语音很多时调大。"
+                        )
+                        chat_job = None
+                        if TranscriptionJob and job_path(parse_out, selected_friend['file_uuid']).exists():
+                            chat_job = TranscriptionJob(job_path(parse_out, selected_friend['file_uuid']))
+                        job_active = chat_job is not None and chat_job.is_alive()
+                        if st.button("🎙️ 转录语音消息 (Transcribe Audio)", disabled=job_active, key="transcribe_btn_active"):
                             if not audio_src or not os.path.exists(audio_src):
                                  st.error("Audio folder not found.")
                             # Check logic updated to match chat-specific counts
                             elif chat_mp3_count == 0 and chat_aud_count > 0:
                                  st.warning("请先转换音频。")
-                            elif not process_chat:
+                            elif not TranscriptionJob:
                                 st.error("Modules missing.")
                             else:
-                                with st.spinner("Loading Whisper & transcribing..."):
-                                    try:
-                                        if "whisper_model" not in st.session_state:
-                                            import whisper
-                                            st.session_state["whisper_model"] = whisper.load_model("base")
-                                        
-                                        model = st.session_state["whisper_model"]
-                                        # Reload chat_data from disk to ensure freshness before processing
-                                        # (Though usually it matches memory, safer to be sure)
-                                        count = process_chat(chat_data, audio_src, model)
-                                        
-                                        if count > 0:
-                                            # Save to disk
-                                            with open(chat_path, 'w', encoding='utf-8') as f:
-                                                json.dump(chat_data, f, ensure_ascii=False, indent=2)
-                                            st.success(f"✅ 成功转录 {count} 条消息！")
-                                            # Force reload is implicit as script reruns or continues
-                                            st.rerun()
-                                        else:
-                                            st.info("没有新的语音消息需要转录。")
-                                    except Exception as e:
-                                        st.error(f"转录失败: {e}")
-
-                # 2. Export Rendering (Uses latest chat_data state)
+                                # Runs as a background job: the page stays usable and progress survives reloads
+                                launch_transcription_job(parse_out, audio_src, selected_friend['file_uuid'], int(transcribe_workers))
+                                st.rerun()
+                        if chat_job is not None:
+                            show_transcription_job(chat_job, key=selected_friend['file_uuid'])
+
+                    # Whole-account transcription as one resumable background job
+                    if TranscriptionJob and audio_src and os.path.exists(audio_src):
+                        with st.expander("🗂️ 全部对话后台转录 (Transcribe All Chats)"):
+                            all_path = job_path(parse_out, "all")
+                            all_job = TranscriptionJob(all_path) if all_path.exists() else None
+                            all_workers = st.number_input("并行进程 (Workers)", min_value=1, max_value=os.cpu_count() or 1, value=1, key="all_workers")
+                            if st.button("🚀 开始/继续全部转录 (Start All)", disabled=all_job is not None and all_job.is_alive()):
+                                launch_transcription_job(parse_out, audio_src, None, int(all_workers))
+                                st.rerun()
+                            if all_job is not None:
+                                show_transcription_job(all_job, key="all")
+
+                # 2. Export Rendering (streamed from the chat file)
                 with export_container.container():
                     include_voice = st.checkbox("导出包含语音消息 (Include Voice)", value=True, help="如果需要导出语音转成的【文字内容】，请务必先点击右侧的【转录语音消息】按钮。")
-                    
-                    # Prepare export payload based on current in-memory chat_data (which might have been updated above)
-                    export_payload = chat_data
-                    if not include_voice:
-                        export_payload = chat_data.copy()
-                        export_payload["messages"] = [m for m in chat_data["messages"] if m.get("type") != 34]
-                    
-                    # Sanitize filename to prevent macOS security warnings / "malware" false positives
-                    raw_name = chat_data['friend_name']
-                    # Keep only alphanumeric, Chinese characters, spaces, and explicit safe delimiters
-                    # Remove chars that often trigger OS filters or look like system paths
-                    safe_name = re.sub(r'[^\w\s\u4e00-\u9fff-]', '', raw_name).strip()
-                    # Collapse multiple spaces
-                    safe_name = re.sub(r'\s+', ' ', safe_name)
-                    # Truncate length
-                    if len(safe_name) > 50:
-                        safe_name = safe_name[:50]
-                    # Fallback if empty
-                    if not safe_name:
-                        safe_name = "unknown_friend"
-                    
-                    final_filename = f"wechat_{safe_name}.json"
-                    json_str = json.dumps(export_payload, ensure_ascii=False, indent=2)
+                    export_fmt = st.selectbox("导出格式 (Format)", list(FORMATS), key="export_fmt")
+
+                    # Sanitized filename (avoids macOS security warnings / "malware" false positives)
+                    final_filename = export_filename(chat_meta, export_fmt)
+                    if range_tag:
+                        final_filename = final_filename[:-len(FORMATS[export_fmt])] + range_tag + FORMATS[export_fmt]
+
+                    # Streamed to a staging file once per chat version/format/range, instead of one big string per rerun
+                    staging = Path(parse_out) / "exports" / ".staging" / f"{selected_friend['file_uuid']}_{int(include_voice)}{range_tag}{FORMATS[export_fmt]}"
+                    if not staging.exists() or staging.stat().st_mtime_ns < os.stat(chat_path).st_mtime_ns:
+                        staging.parent.mkdir(parents=True, exist_ok=True)
+                        # Only the date window is read, via the chat's timestamp index
+                        export_chat(chat_path, staging, export_fmt, include_voice, since=since, until=until)
 
                     # Split actions: Download via Browser vs Save directly to Disk (Bypass macOS Gatekeeper)
                     col_dl, col_save = st.columns([1, 1.5])
                     
                     with col_dl:
-                        st.download_button(
-                            label="📥 下载 (Download)",
-                            data=json_str,
-                            file_name=final_filename,
-                            mime="application/json"
-                        )
+                        with open(staging, "rb") as f:
+                            st.download_button(
+                                label="📥 下载 (Download)",
+                                data=f,
+                                file_name=final_filename,
+                                mime=MIME_TYPES[export_fmt]
+                            )
                     
                     with col_save:
                         if st.button("💾 直接保存到硬盘 (Save to Disk)"):
@@ -444,8 +644,7 @@ with tab3:
                             
                             save_path = export_dir / final_filename
                             try:
-                                with open(save_path, "w", encoding="utf-8") as f:
-                                    f.write(json_str)
+                                shutil.copyfile(staging, save_path)
                                 st.success(f"已保存! 正在打开文件夹...")
                                 # Auto-reveal in Finder on macOS
                                 if sys.platform == "darwin":
@@ -454,78 +653,76 @@ with tab3:
                                     os.startfile(str(save_path))
                             except Exception as e:
                                 st.error(f"保存失败: {e}")
-                
+
+                    # Whole account: every chat in parallel, streamed into a folder or one ZIP
+                    with st.expander("📦 导出全部对话 (Export All Chats)"):
+                        all_fmt = st.selectbox("格式 (Format)", list(FORMATS), key="export_all_fmt")
+                        as_zip = st.checkbox("打包为 ZIP (Single ZIP file)", value=True)
+                        export_workers = st.number_input("并行进程 (Workers)", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1, key="export_workers")
+                        if range_tag:
+                            st.caption(f"仅导出日期范围内的消息 (Only messages in {date_range[0]} → {date_range[1]})")
+                        if st.button("📦 开始导出 (Export All)"):
+                            stamp = time.strftime("%Y%m%d_%H%M%S")
+                            target = Path(parse_out) / "exports" / (f"wechat_all_{stamp}{range_tag}.zip" if as_zip else f"wechat_all_{stamp}{range_tag}")
+                            export_bar = st.progress(0, text="Exporting...")
+                            chats, msgs = export_all(
+                                parse_out, target, all_fmt, include_voice, int(export_workers),
+                                progress=lambda done, total: export_bar.progress(done / total, text=f"Exporting... {done}/{total}"),
+                                since=since, until=until,
+                            )
+                            export_bar.empty()
+                            st.success(f"已导出 {chats} 个对话 / {msgs} 条消息 → {target}")
+
                 # --- MESSAGE VIEWER ---
-                msgs = chat_data.get("messages", [])
-                st.markdown(f"**显示最近 50 条消息 (共 {len(msgs)} 条)**")
-                
-                # Container for chat messages with custom CSS
-                st.markdown("""
-                <style>
-                    .chat-message {
-                        padding: 10px;
-                        border-radius: 10px;
-                        margin-bottom: 10px;
-                        max-width: 70%;
-                        display: inline-block;
-                        position: relative;
-                        word-wrap: break-word;
-                    }
-                    .chat-container {
-                        display: flex;
-                        width: 100%;
-                        margin-bottom: 5px;
-                    }
-                    .sender-right {
-                        justify-content: flex-end;
-                    }
-                    .sender-left {
-                        justify-content: flex-start;
-                    }
-                    .bubble-right {
-                        background-color: #95ec69; /* WeChat Green */
-                        color: black;
-                        border-top-right-radius: 2px;
-                    }
-                    .bubble-left {
-                        background-color: #ffffff;
-                        color: black;
-                        border: 1px solid #e0e0e0;
-                        border-top-left-radius: 2px;
-                    }
-                    .meta-info {
-                        font-size: 0.7em;
-                        color: #b0b0b0;
-                        margin-bottom: 2px;
-                        text-align: right;
-                    }
-                </style>
-                """, unsafe_allow_html=True)
-                
-                for msg in msgs[-50:]:
-                    is_me = msg["is_sender"]
-                    sender = "我" if is_me else chat_data["friend_name"]
-                    
-                    # Layout classes
-                    container_class = "sender-right" if is_me else "sender-left"
-                    bubble_class = "bubble-right" if is_me else "bubble-left"
-                    
-                    content = msg['content']
-                    
-                    # Simple text processing for better display
-                    # Replace newlines
-                    content = content.replace("\n", "<br>")
-                    
-                    st.markdown(
-                        f"""
-                        <div class="chat-container {container_class}">
-                            <div class="chat-message {bubble_class}">
-                                <div style="font-size: 0.75em; color: #888; margin-bottom: 4px;">
-                                    {msg['timestamp'][5:16]}
-                                </div>
-                                {content}
-                            </div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
+                # Thumbnails of extracted images/videos, built lazily in the background
+                chat_media = None
+                for media_root in dict.fromkeys([st.session_state["extract_output"], os.path.join(FIXED_EXPORT_ROOT, "extracted_wechat_db")]):
+                    chat_media = ChatMedia(media_root, selected_friend['file_uuid'], get_thumbnail_cache(THUMBNAIL_DIR))
+                    if chat_media:
+                        break
+                # Page-at-a-time: only the visible pages are read from disk and rendered
+                show_chat_pages(chat_source, chat_meta.get("friend_name", ""), key=selected_friend['file_uuid'] + range_tag, media=chat_media or None)
+
+# --- TAB 4: ANALYTICS ---
+with tab4:
+    st.header("Account Analytics")
+    parse_out = st.session_state["parse_output"]
+    if not os.path.exists(os.path.join(parse_out, "index.json")):
+        st.warning("请先完成 Step 2 解析。")
+    # pandas/numpy are only imported once the dashboards are switched on
+    elif st.toggle("显示分析 (Show analytics)", key="show_analytics"):
+        import analytics
+
+        # Rollups are cached on disk; only chats changed since the last run are re-read
+        rollup_bar = st.progress(0, text="Updating rollups...")
+        rollups = analytics.load_rollups(
+            parse_out,
+            progress=lambda done, total: rollup_bar.progress(done / total, text=f"Updating rollups... {done}/{total}"),
+        )
+        rollup_bar.empty()
+
+        col_kind, col_top = st.columns([1, 1])
+        with col_kind:
+            stats_kind = CHAT_KINDS[st.selectbox("类型:", list(CHAT_KINDS), key="analytics_kind")]
+        with col_top:
+            top_n = st.slider("常用联系人数量 (Top chats)", 3, 30, 10)
+
+        st.subheader("活跃时段 (Activity by weekday / hour)")
+        st.dataframe(analytics.activity_heatmap(rollups, stats_kind), use_container_width=True)
+
+        st.subheader("每月消息 (Messages per month)")
+        st.bar_chart(analytics.monthly_totals(rollups, stats_kind))
+
+        st.subheader("常用联系人 (Top chats over time)")
+        st.line_chart(analytics.top_contacts_over_time(rollups, top_n, stats_kind))
+
+        col_latency, col_mix = st.columns(2)
+        with col_latency:
+            st.subheader("回复时长 (Reply delays)")
+            latency = analytics.latency_distribution(rollups)
+            st.bar_chart(latency)
+            medians = analytics.median_latency(latency)
+            st.caption(f"私聊中位数 (Median, private chats): 我 {medians['mine'] or '-'} · 对方 {medians['theirs'] or '-'}")
+        with col_mix:
+            st.subheader("消息类型 (Message types)")
+            st.bar_chart(analytics.type_mix(rollups, stats_kind))
@@ -0,0 +1,216 @@
+import argparse
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from chat_store import open_chat
+
+INDEX_NAME = "search.sqlite"
+PAGE_SIZE = 20
+# rowid = chat id << MSG_BITS | message position; lets a chat's rows be dropped by rowid range
+MSG_BITS = 24
+
+# Runs of CJK ideographs (incl. extension A and compatibility ideographs), kana and hangul
+_CJK_RUN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+")
+_WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """
+    Character bigrams for CJK runs (plus each run's last character, so single-character
+    prefix queries can match) and lowercase words for everything else.
+    """
+    if not text:
+        return []
+    tokens = []
+    pos = 0
+    for m in _CJK_RUN.finditer(text):
+        tokens.extend(w.lower() for w in _WORD.findall(text[pos:m.start()]))
+        run = m.group()
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+        pos = m.end()
+    tokens.extend(w.lower() for w in _WORD.findall(text[pos:]))
+    return tokens
+
+
+def message_text(msg):
+    text = str(msg.get("content") or "")
+    transcription = msg.get("transcription")
+    if transcription and transcription not in text:
+        text += " " + transcription
+    return text
+
+
+def build_query(query):
+    """
+    FTS5 MATCH expression: every token must match (AND). A lone CJK character or the last
+    Latin word is matched as a prefix so results show up while typing.
+    """
+    terms = []
+    pos = 0
+    for m in _CJK_RUN.finditer(query):
+        terms.extend(w.lower() for w in _WORD.findall(query[pos:m.start()]))
+        run = m.group()
+        terms.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+        pos = m.end()
+    terms.extend(w.lower() for w in _WORD.findall(query[pos:]))
+    if not terms:
+        return None
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    last = terms[-1]
+    if len(last) == 1 or not _CJK_RUN.fullmatch(last):
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class SearchIndex:
+    """
+    On-disk inverted index over every chat (FTS5 on pre-tokenized text).
+    Chats are re-indexed only when their file size/mtime changes.
+    """
+
+    def __init__(self, parsed_dir):
+        self.parsed_dir = Path(parsed_dir)
+        self.conn = sqlite3.connect(self.parsed_dir / INDEX_NAME, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "id INTEGER PRIMARY KEY, uuid TEXT UNIQUE, friend_name TEXT, size INTEGER, mtime_ns INTEGER)"
+        )
+        # Text is tokenized by tokenize() before insertion; unicode61 then just splits on the spaces.
+        # ts is only stored for sorting by time.
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS msgs USING fts5(tokens, ts UNINDEXED, tokenize='unicode61')"
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, progress=None):
+        """Bring the index in line with chats/*.json. Returns the number of re-indexed chats."""
+        chats_dir = self.parsed_dir / "chats"
+        known = {uuid: (cid, size, mtime) for cid, uuid, size, mtime in
+                 self.conn.execute("SELECT id, uuid, size, mtime_ns FROM chats")}
+        paths = sorted(chats_dir.glob("*.json"))
+        seen = set()
+        changed = 0
+        for n, path in enumerate(paths):
+            uuid = path.stem
+            seen.add(uuid)
+            st = path.stat()
+            entry = known.get(uuid)
+            if entry and entry[1] == st.st_size and entry[2] == st.st_mtime_ns:
+                continue
+            self._index_chat(path, entry[0] if entry else None)
+            changed += 1
+            if progress:
+                progress(n + 1, len(paths))
+
+        for uuid, (cid, _size, _mtime) in known.items():
+            if uuid not in seen:
+                self._drop_chat(cid)
+                self.conn.execute("DELETE FROM chats WHERE id=?", (cid,))
+        self.conn.commit()
+        return changed
+
+    def _drop_chat(self, cid):
+        lo = cid << MSG_BITS
+        self.conn.execute("DELETE FROM msgs WHERE rowid BETWEEN ? AND ?", (lo, lo + (1 << MSG_BITS) - 1))
+
+    def _index_chat(self, path, cid):
+        st = path.stat()
+        # Read directly rather than through chat_store so a rebuild doesn't flush the viewer cache
+        with open(path, "r", encoding="utf-8") as f:
+            chat = json.load(f)
+        messages = chat.get("messages", [])
+        name = chat.get("friend_name", "")
+        if cid is None:
+            cur = self.conn.execute(
+                "INSERT INTO chats (uuid, friend_name, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                (path.stem, name, st.st_size, st.st_mtime_ns),
+            )
+            cid = cur.lastrowid
+        else:
+            self._drop_chat(cid)
+            self.conn.execute(
+                "UPDATE chats SET friend_name=?, size=?, mtime_ns=? WHERE id=?",
+                (name, st.st_size, st.st_mtime_ns, cid),
+            )
+        base = cid << MSG_BITS
+        rows = []
+        for i, msg in enumerate(messages[:1 << MSG_BITS]):
+            tokens = tokenize(message_text(msg))
+            if tokens:
+                rows.append((base + i, " ".join(tokens), msg.get("timestamp", "")))
+        self.conn.executemany("INSERT INTO msgs (rowid, tokens, ts) VALUES (?, ?, ?)", rows)
+
+    def search(self, query, page=0, page_size=PAGE_SIZE, order="relevance"):
+        """
+        Ranked, paginated hits: (total, [{file_uuid, friend_name, index, timestamp}]).
+        order: "relevance" (bm25) or "recent".
+        """
+        match = build_query(query)
+        if not match:
+            return 0, []
+        total = self.conn.execute("SELECT COUNT(*) FROM msgs WHERE msgs MATCH ?", (match,)).fetchone()[0]
+        order_by = "bm25(msgs), ts DESC" if order == "relevance" else "ts DESC"
+        rows = self.conn.execute(
+            f"SELECT rowid, ts FROM msgs WHERE msgs MATCH ? ORDER BY {order_by} LIMIT ? OFFSET ?",
+            (match, page_size, page * page_size),
+        ).fetchall()
+        names = {}
+        hits = []
+        for rowid, ts in rows:
+            cid = rowid >> MSG_BITS
+            if cid not in names:
+                names[cid] = self.conn.execute("SELECT uuid, friend_name FROM chats WHERE id=?", (cid,)).fetchone()
+            uuid, name = names[cid] or ("", "")
+            hits.append({"file_uuid": uuid, "friend_name": name, "index": rowid & ((1 << MSG_BITS) - 1), "timestamp": ts})
+        return total, hits
+
+    def load_hits(self, hits):
+        """Attach the message itself to each hit (one seek per hit via chat_store)."""
+        for hit in hits:
+            path = self.parsed_dir / "chats" / f"{hit['file_uuid']}.json"
+            msgs = open_chat(path).read(hit["index"], hit["index"] + 1) if path.exists() else []
+            hit["message"] = msgs[0] if msgs else None
+        return hits
+
+
+def update_index(parsed_dir):
+    index = SearchIndex(parsed_dir)
+    try:
+        return index.update()
+    finally:
+        index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build/update the cross-chat search index, or query it.")
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output directory")
+    parser.add_argument("--query", "-q", default=None, help="Search instead of updating")
+    parser.add_argument("--page", type=int, default=0)
+    args = parser.parse_args()
+
+    index = SearchIndex(args.parsed_dir)
+    if args.query:
+        t0 = time.perf_counter()
+        total, hits = index.search(args.query, args.page)
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"{total} hits ({elapsed:.1f} ms)")
+        for hit in index.load_hits(hits):
+            content = (hit["message"] or {}).get("content", "")
+            print(f"[{hit['timestamp']}] {hit['friend_name']}: {content[:80]}")
+    else:
+        t0 = time.perf_counter()
+        changed = index.update()
+        print(f"Re-indexed {changed} chats in {time.perf_counter() - t0:.1f}s -> {args.parsed_dir / INDEX_NAME}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
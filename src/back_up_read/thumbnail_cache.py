@@ -0,0 +1,244 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from chat_store import memoize
+
+# Chat images and videos are extracted to <extract>/<user>/Img|Video/<chat hash>/<MesLocalID>.<suffix>
+# (extract_wechat.py --extract_media); the chat hash is the chat's file_uuid.
+MEDIA_SUFFIXES = {"pic_thum": "thumb", "pic": "image", "pic_hd": "image_hd", "video_thum": "thumb", "mp4": "video"}
+IMAGE_TYPE = 3
+VIDEO_TYPE = 43
+THUMB_PX = 240
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+WORKERS = 2
+# Without Pillow, WeChat's own thumbnails (small JPEGs) are used as they are
+RAW_THUMB_LIMIT = 256 * 1024
+EVICT_TO = 0.9   # eviction frees space down to this fraction of max_bytes
+
+
+def image_mime(data):
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def make_thumbnail(source, px=THUMB_PX):
+    """JPEG thumbnail bytes for an image file, or None if it cannot be decoded."""
+    try:
+        from PIL import Image
+    except ImportError:
+        # Pillow is optional (`pip install Pillow`): originals get no thumbnail without it
+        if os.path.getsize(source) > RAW_THUMB_LIMIT:
+            return None
+        data = Path(source).read_bytes()
+        return data if image_mime(data) else None
+    with Image.open(source) as im:
+        # JPEG: decode straight at a reduced scale instead of full resolution
+        im.draft("RGB", (px, px))
+        im = im.convert("RGB")
+        im.thumbnail((px, px))
+        out = BytesIO()
+        im.save(out, "JPEG", quality=80)
+        return out.getvalue()
+
+
+def chat_media_files(extract_root, file_uuid):
+    """{MesLocalID: {"thumb"/"image"/"image_hd"/"video": path}} of one chat, cached per folder version."""
+    root = Path(extract_root)
+    dirs = [d for kind in ("Img", "Video") for d in root.glob(f"*/{kind}/{file_uuid}") if d.is_dir()]
+    key = ("chat_media", str(root), file_uuid) + tuple(os.stat(d).st_mtime_ns for d in dirs)
+
+    def build():
+        files = {}
+        for d in dirs:
+            for entry in os.scandir(d):
+                stem, _dot, suffix = entry.name.partition(".")
+                role = MEDIA_SUFFIXES.get(suffix)
+                if role and stem.isdigit():
+                    files.setdefault(int(stem), {})[role] = entry.path
+        return files
+
+    return memoize(key, build, lambda files: 256 * len(files) + 64)
+
+
+class ThumbnailCache:
+    """
+    On-disk thumbnails, built in a small worker pool on first request and bounded to
+    max_bytes: a file's mtime is its last use, and the least recently used go first.
+    get() never waits for a thumbnail; ready() tells whether one is on disk.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, workers=WORKERS):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._pending = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def path_for(self, source):
+        st = os.stat(source)
+        digest = hashlib.sha1(f"{source}\0{st.st_size}\0{st.st_mtime_ns}\0{THUMB_PX}".encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / f"{digest}.thumb"
+
+    def get(self, source):
+        """Thumbnail bytes, or None while it is being built (or if the file has none)."""
+        try:
+            path = self.path_for(source)
+            data = path.read_bytes()
+        except FileNotFoundError:
+            if os.path.exists(source):
+                self._submit(source, path)
+            return None
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def ready(self, source):
+        """True if the thumbnail is on disk (a stat, no read); starts building it otherwise."""
+        try:
+            path = self.path_for(source)
+        except OSError:
+            return False
+        if path.exists():
+            return True
+        self._submit(source, path)
+        return False
+
+    def _submit(self, source, path):
+        with self._lock:
+            if path in self._pending or path in self._failed:
+                return
+            self._pending.add(path)
+        self._pool.submit(self._build, source, path)
+
+    def _build(self, source, path):
+        try:
+            data = make_thumbnail(source)
+        except Exception as e:
+            print(f"Thumbnail failed for {source}: {e}")
+            data = None
+        try:
+            if data:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f"{path.name}.tmp{threading.get_ident()}")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self._added(len(data))
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+                if not data:
+                    self._failed.add(path)
+
+    def _entries(self):
+        for path in self.root.glob("*/*.thumb"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            yield st.st_mtime_ns, st.st_size, path
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _t, size, _p in self._entries())
+            self._size += nbytes
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used thumbnails until the cache is below EVICT_TO of its budget."""
+        if not self._evict_lock.acquire(blocking=False):
+            return 0
+        try:
+            entries = sorted(self._entries())
+            total = sum(size for _t, size, _p in entries)
+            removed = 0
+            for _mtime, size, path in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            with self._lock:
+                self._size = total
+            return removed
+        finally:
+            self._evict_lock.release()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_thumbnail_cache(root, max_bytes=DEFAULT_MAX_BYTES):
+    """One ThumbnailCache (and worker pool) per directory in this process."""
+    with _caches_lock:
+        cache = _caches.get(str(root))
+        if cache is None:
+            cache = _caches[str(root)] = ThumbnailCache(root, max_bytes)
+        return cache
+
+
+class ChatMedia:
+    """Thumbnails of one chat's image and video messages, for chat_render.page_html."""
+
+    def __init__(self, extract_root, file_uuid, cache):
+        self.files = chat_media_files(extract_root, file_uuid)
+        self.cache = cache
+
+    def __bool__(self):
+        return bool(self.files)
+
+    def _sources(self, messages):
+        """(message id, file to thumbnail) of the image/video messages with extracted media."""
+        for msg in messages:
+            if msg.get("type") not in (IMAGE_TYPE, VIDEO_TYPE):
+                continue
+            files = self.files.get(msg.get("id"))
+            # WeChat's small thumbnail first: the original is only decoded when there is none
+            source = files and (files.get("thumb") or files.get("image"))
+            if source:
+                yield msg["id"], source
+
+    def page_key(self, messages):
+        """
+        Cache key part for a page of `messages`: the ids whose thumbnails are ready. A page is
+        rebuilt when one of its own thumbnails becomes ready, not when any other one does.
+        """
+        ready = tuple(msg_id for msg_id, source in self._sources(messages) if self.cache.ready(source))
+        return ("media", str(self.cache.root), ready)
+
+    def thumbnails(self, messages):
+        """{message id: thumbnail bytes} for the messages whose thumbnail is ready."""
+        thumbs = {}
+        for msg_id, source in self._sources(messages):
+            data = self.cache.get(source)
+            if data:
+                thumbs[msg_id] = data
+        return thumbs
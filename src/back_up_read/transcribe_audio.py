@@ -1,66 +1,237 @@
+import argparse
 import json
 import os
-import whisper
-import tqdm
+from pathlib import Path
+
+from audio_prep import bucket_clips
+from chat_store import write_chat
+from transcribe_engine import DEFAULT_BATCH_SIZE, Clip, as_engine, create_engine
+from transcription_cache import TranscriptionStore
 
 AUDIO_DIR = "/Users/cliff/workspace/wechat-business/src/back_up_read/converted_audio_xiaoxuzi"
 JSON_PATH = "/Users/cliff/workspace/wechat-business/src/back_up_read/parsed_messages.json"
 
 
-def process_chat(chat_data, audio_dir, model=None):
-    if not model:
-        print("Loading Whisper model (small)...")
-        model = whisper.load_model("small")
-        
-    count = 0
-    audio_files = set(f for f in os.listdir(audio_dir) if f.endswith(".mp3"))
-    
-    print(f"Scanning {len(chat_data.get('messages', []))} messages for audio...")
-    
+def find_pending_clips(chat_data, audio_dir, audio_files=None):
+    """
+    Collect untranscribed voice messages that have a converted .mp3.
+    Returns ({key: msg}, [Clip]).
+    """
+    if audio_files is None:
+        audio_files = set(f for f in os.listdir(audio_dir) if f.endswith(".mp3"))
+
+    pending = {}
+    clips = []
     for msg in chat_data.get("messages", []):
         if msg.get("type") == 34 and not msg.get("transcription"):
             msg_id = msg.get("id")
             if msg_id:
                 filename = f"{msg_id}.mp3"
                 if filename in audio_files:
-                    filepath = os.path.join(audio_dir, filename)
-                    try:
-                        # fp16=False solves "FP16 is not supported on CPU" warning on Mac/CPU
-                        result = model.transcribe(filepath, fp16=False)
-                        text = result["text"].strip()
-                        
-                        msg["transcription"] = text
-                        msg["content"] = f"[Voice] {text}"
-                        count += 1
-                    except Exception as e:
-                        print(f"Error transcribing {filename}: {e}")
+                    key = str(msg_id)
+                    pending[key] = msg
+                    clips.append(Clip(key=key, path=os.path.join(audio_dir, filename)))
+    return pending, clips
+
+
+def apply_transcription(msg, text):
+    msg["transcription"] = text
+    msg["content"] = f"[Voice] {text}"
+
+
+def load_runner(model=None):
+    """Resolve what process_chat was given into something run_clips understands."""
+    if hasattr(model, "imap"):
+        return model
+    if not model:
+        print("Loading Whisper model (small)...")
+        return create_engine(model_name="small")
+    return as_engine(model)
+
+
+def run_clips(runner, clips, batch_size=DEFAULT_BATCH_SIZE, trim=True, bucket=True, pack=False):
+    """
+    Yield (key, text) from either an engine or a TranscriptionPool.
+    trim/bucket/pack control the audio_prep stage: silence trimming, length bucketing
+    and packing of short clips into shared windows.
+    """
+    if bucket:
+        clips = bucket_clips(clips)
+    if hasattr(runner, "imap"):
+        # Worker pool: results come back as (key, text)
+        yield from runner.imap(clips, batch_size=batch_size, trim=trim, pack=pack)
+    else:
+        for clip, text in runner.transcribe(clips, batch_size=batch_size, trim=trim, pack=pack):
+            yield clip.key, text
+
+
+def take_cached(store, runner, pending, clips):
+    """
+    Apply transcriptions already in the store and return (clips still to infer, hits, {key: audio hash}).
+    """
+    hashes = {}
+    todo = []
+    hits = 0
+    for clip in clips:
+        audio_hash = store.hash_audio(clip.path)
+        hashes[clip.key] = audio_hash
+        text = store.get(audio_hash, runner.model_name, runner.language)
+        if text is None:
+            todo.append(clip)
+        else:
+            apply_transcription(pending[clip.key], text)
+            hits += 1
+    return todo, hits, hashes
+
+
+def process_chat(chat_data, audio_dir, model=None, batch_size=DEFAULT_BATCH_SIZE, store=None, trim=True, pack=False):
+    """
+    Transcribe all untranscribed voice messages of one chat in place.
+    `model` may be a TranscriptionEngine, a TranscriptionPool or a bare whisper model;
+    None loads the default engine. With a TranscriptionStore, cached results are reused
+    and new ones are saved to it.
+    """
+    print(f"Scanning {len(chat_data.get('messages', []))} messages for audio...")
+    pending, clips = find_pending_clips(chat_data, audio_dir)
+    if not clips:
+        return 0
+
+    runner = load_runner(model)
+    count = 0
+    hashes = {}
+    if store is not None:
+        clips, count, hashes = take_cached(store, runner, pending, clips)
+
+    for key, text in run_clips(runner, clips, batch_size, trim=trim, pack=pack):
+        apply_transcription(pending[key], text)
+        if store is not None:
+            store.put(hashes[key], runner.model_name, runner.language, text)
+        count += 1
     return count
 
+
+def transcribe_parsed_dir(parsed_dir, audio_dir, model, batch_size=DEFAULT_BATCH_SIZE, store=None, trim=True, pack=False):
+    """
+    Transcribe every chat under parsed_dir/chats. Clips of all chats go through one stream,
+    and each chat file is rewritten as soon as its last clip is back.
+    """
+    chats_dir = Path(parsed_dir) / "chats"
+    audio_files = set(f for f in os.listdir(audio_dir) if f.endswith(".mp3"))
+    runner = load_runner(model)
+
+    chats = {}      # chat path -> chat data
+    owner = {}      # clip key -> chat path
+    remaining = {}  # chat path -> clips still in flight
+    pending = {}    # clip key -> msg
+    hashes = {}     # clip key -> audio hash
+    clips = []
+    cached = 0
+    for chat_path in sorted(chats_dir.glob("*.json")):
+        with open(chat_path, "r", encoding="utf-8") as f:
+            chat_data = json.load(f)
+        chat_pending, chat_clips = find_pending_clips(chat_data, audio_dir, audio_files)
+        if not chat_clips:
+            continue
+        if store is not None:
+            chat_clips, hits, chat_hashes = take_cached(store, runner, chat_pending, chat_clips)
+            cached += hits
+            if hits and not chat_clips:
+                save_chat(chat_path, chat_data)
+                continue
+        chats[chat_path] = chat_data
+        remaining[chat_path] = len(chat_clips)
+        for clip in chat_clips:
+            # Message ids are only unique per chat
+            msg_key = clip.key
+            clip.key = f"{chat_path.stem}:{msg_key}"
+            owner[clip.key] = chat_path
+            pending[clip.key] = chat_pending[msg_key]
+            if store is not None:
+                hashes[clip.key] = chat_hashes[msg_key]
+        clips.extend(chat_clips)
+
+    if cached:
+        print(f"Reused {cached} cached transcriptions.")
+    print(f"Found {len(clips)} voice messages to transcribe in {len(chats)} chats.")
+
+    import tqdm
+
+    count = cached
+    for key, text in tqdm.tqdm(run_clips(runner, clips, batch_size, trim=trim, pack=pack), total=len(clips)):
+        apply_transcription(pending[key], text)
+        if store is not None:
+            store.put(hashes[key], runner.model_name, runner.language, text)
+        count += 1
+        chat_path = owner[key]
+        remaining[chat_path] -= 1
+        if remaining[chat_path] == 0:
+            save_chat(chat_path, chats.pop(chat_path))
+
+    # Chats with failed clips never reach zero; save whatever did succeed
+    for chat_path, chat_data in chats.items():
+        save_chat(chat_path, chat_data)
+    return count
+
+
+def save_chat(chat_path, chat_data):
+    # write_chat goes through a temp file, so a crash mid-write never leaves a truncated chat
+    write_chat(chat_path, chat_data)
+
+
 def main():
-    print("Loading Whisper model (small)...")
-    model = whisper.load_model("small")
-    
-    print(f"Loading messages from {JSON_PATH}...")
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        # Assuming JSON_PATH is the old huge file or a list of chats
-        # For compatibility with split files, this script might need adjustment
-        # But for now let's keep it working for the list format
-        messages = json.load(f)
-        
-    count = 0
-    if not os.path.exists(AUDIO_DIR):
-        print(f"Audio directory not found: {AUDIO_DIR}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--json", type=Path, default=Path(JSON_PATH), help="Legacy single JSON file (list of chats)")
+    parser.add_argument("--parsed_dir", type=Path, default=None, help="parse_db.py output directory (contains chats/)")
+    parser.add_argument("--audio_dir", type=Path, default=Path(AUDIO_DIR), help="Directory with converted .mp3 files")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each loads its own model")
+    parser.add_argument("--backend", default="auto", help="auto, whisper or faster-whisper")
+    parser.add_argument("--model", default="small", help="Model size/name")
+    parser.add_argument("--language", default=None, help="Force language (e.g. zh)")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--no_trim", action="store_true", help="Don't trim leading/trailing silence")
+    parser.add_argument("--pack", action="store_true", help="Pack short clips into shared 30s windows")
+    args = parser.parse_args()
+    trim = not args.no_trim
+
+    if not args.audio_dir.exists():
+        print(f"Audio directory not found: {args.audio_dir}")
         return
 
-    # Bulk process
-    for conv in tqdm.tqdm(messages):
-        count += process_chat(conv, AUDIO_DIR, model)
-    
-    print(f"Successfully transcribed {count} messages.")
-    
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=4)
-    print("Saved updated JSON.")
+    print(f"Loading Whisper model ({args.model})...")
+    if args.workers > 1:
+        from transcribe_pool import TranscriptionPool
+        model = TranscriptionPool(args.workers, args.backend, args.model, args.language)
+        print(f"Started {model.workers} workers x {model.threads} threads.")
+    else:
+        model = create_engine(args.backend, model_name=args.model, language=args.language)
+
+    try:
+        if args.parsed_dir:
+            store = TranscriptionStore.for_output(args.parsed_dir)
+            count = transcribe_parsed_dir(args.parsed_dir, str(args.audio_dir), model, args.batch_size, store, trim, args.pack)
+            print(f"Successfully transcribed {count} messages.")
+            return
+
+        print(f"Loading messages from {args.json}...")
+        with open(args.json, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+
+        import tqdm
+
+        count = 0
+        # Bulk process
+        for conv in tqdm.tqdm(messages):
+            count += process_chat(conv, str(args.audio_dir), model, args.batch_size, trim=trim, pack=args.pack)
+
+        print(f"Successfully transcribed {count} messages.")
+
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(messages, f, ensure_ascii=False, indent=4)
+        print("Saved updated JSON.")
+    finally:
+        if hasattr(model, "close"):
+            model.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,230 @@
+import abc
+import dataclasses
+import importlib.util
+import subprocess
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Whisper models work on 16 kHz mono audio in 30 second windows
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+DEFAULT_BATCH_SIZE = 8
+
+
+def load_audio(path, sr=SAMPLE_RATE):
+    """
+    Decode any audio file ffmpeg understands into a float32 mono PCM array.
+    Same approach as whisper.load_audio, but without importing torch.
+    """
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", str(path),
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {path}: {result.stderr.decode(errors='ignore')[-200:]}")
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+@dataclasses.dataclass
+class Clip:
+    """One voice note to transcribe. `key` is whatever the caller uses to map results back (usually the message id)."""
+    key: str
+    path: str
+    audio: Optional[np.ndarray] = None
+
+    def load(self):
+        if self.audio is None:
+            self.audio = load_audio(self.path)
+        return self.audio
+
+    @property
+    def duration(self):
+        return len(self.load()) / SAMPLE_RATE
+
+
+class TranscriptionEngine(abc.ABC):
+    """
+    Base class for transcription backends.
+    Subclasses implement `transcribe_batch`, which receives several clips at once
+    so backends that can batch inference get a chance to do so.
+    """
+    backend = "base"
+
+    def __init__(self, model_name="small", language=None, threads=None):
+        self.model_name = model_name
+        self.language = language
+        self.threads = threads
+
+    @abc.abstractmethod
+    def transcribe_batch(self, clips: List[Clip]) -> List[str]:
+        """One text per clip, in order."""
+
+    @abc.abstractmethod
+    def transcribe_segments(self, audio) -> List[Tuple[float, float, str]]:
+        """Timestamped (start, end, text) segments for one PCM buffer; used for packed clips."""
+
+    def transcribe(self, clips: Iterable[Clip], batch_size=DEFAULT_BATCH_SIZE, trim=False, pack=False) -> Iterator[Tuple[Clip, str]]:
+        """
+        Transcribe clips in batches, yielding (clip, text) as each batch finishes.
+        If a batch fails, its clips are retried one by one so a single bad file doesn't lose the rest.
+        trim: cut leading/trailing silence first (see audio_prep).
+        pack: concatenate short clips of a batch into shared 30s windows.
+        """
+        batch = []
+        for clip in clips:
+            batch.append(clip)
+            if len(batch) >= batch_size:
+                yield from self._run_group(batch, trim, pack)
+                batch = []
+        if batch:
+            yield from self._run_group(batch, trim, pack)
+
+    def _run_group(self, batch, trim, pack):
+        if trim or pack:
+            import audio_prep
+            if trim:
+                batch = audio_prep.trim_clips(batch)
+            if pack:
+                packs, batch = audio_prep.pack_clips(batch)
+                for p in packs:
+                    try:
+                        texts = audio_prep.split_segments(p, self.transcribe_segments(p.audio))
+                    except Exception as e:
+                        print(f"Error transcribing packed clips, retrying one by one: {e}")
+                        batch.extend(p.clips)
+                        continue
+                    for clip, text in zip(p.clips, texts):
+                        clip.audio = None
+                        yield clip, text
+        yield from self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        if not batch:
+            return
+        try:
+            texts = self.transcribe_batch(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Error transcribing {batch[0].path}: {e}")
+                texts = [None]
+            else:
+                for clip in batch:
+                    yield from self._run_batch([clip])
+                return
+        for clip, text in zip(batch, texts):
+            # Free the PCM buffer, results are all we keep
+            clip.audio = None
+            if text is not None:
+                yield clip, text
+
+
+class WhisperEngine(TranscriptionEngine):
+    """
+    openai-whisper backend. Clips up to 30s are padded into one mel batch and decoded
+    in a single forward pass; longer clips go through the regular sliding-window transcribe().
+    """
+    backend = "whisper"
+
+    def __init__(self, model_name="small", language=None, threads=None, model=None):
+        super().__init__(model_name, language, threads)
+        import torch
+        import whisper
+        self._torch = torch
+        self._whisper = whisper
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = model if model is not None else whisper.load_model(model_name, device="cpu")
+
+    def transcribe_batch(self, clips):
+        whisper = self._whisper
+        texts = [None] * len(clips)
+        short_idx = []
+        for i, clip in enumerate(clips):
+            if clip.duration <= WINDOW_SECONDS:
+                short_idx.append(i)
+            else:
+                # fp16=False solves "FP16 is not supported on CPU" warning on Mac/CPU
+                result = self.model.transcribe(clip.load(), fp16=False, language=self.language)
+                texts[i] = result["text"].strip()
+
+        if short_idx:
+            mels = self._torch.stack([
+                whisper.log_mel_spectrogram(
+                    whisper.pad_or_trim(clips[i].load()), n_mels=self.model.dims.n_mels
+                )
+                for i in short_idx
+            ]).to(self.model.device)
+            options = whisper.DecodingOptions(language=self.language, fp16=False, without_timestamps=True)
+            with self._torch.inference_mode():
+                results = whisper.decode(self.model, mels, options)
+            for i, res in zip(short_idx, results):
+                texts[i] = res.text.strip()
+        return texts
+
+    def transcribe_segments(self, audio):
+        result = self.model.transcribe(audio, fp16=False, language=self.language, condition_on_previous_text=False)
+        return [(seg["start"], seg["end"], seg["text"]) for seg in result["segments"]]
+
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """
+    faster-whisper (CTranslate2) backend with int8 weights, usually several times
+    faster than openai-whisper on CPU. CTranslate2 spreads each clip over `threads`
+    cores itself, so clips of a batch are decoded back to back.
+    """
+    backend = "faster-whisper"
+
+    def __init__(self, model_name="small", language=None, threads=None, compute_type="int8"):
+        super().__init__(model_name, language, threads)
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=threads or 0)
+
+    def transcribe_batch(self, clips):
+        texts = []
+        for clip in clips:
+            segments, _info = self.model.transcribe(
+                clip.load(), language=self.language, beam_size=1, condition_on_previous_text=False
+            )
+            texts.append("".join(s.text for s in segments).strip())
+        return texts
+
+    def transcribe_segments(self, audio):
+        segments, _info = self.model.transcribe(audio, language=self.language, beam_size=1, condition_on_previous_text=False)
+        return [(seg.start, seg.end, seg.text) for seg in segments]
+
+
+BACKENDS = {
+    WhisperEngine.backend: (WhisperEngine, "whisper"),
+    FasterWhisperEngine.backend: (FasterWhisperEngine, "faster_whisper"),
+}
+
+
+def available_backends():
+    """Backends whose python package is installed, fastest first."""
+    order = [FasterWhisperEngine.backend, WhisperEngine.backend]
+    return [b for b in order if importlib.util.find_spec(BACKENDS[b][1]) is not None]
+
+
+def create_engine(backend="auto", model_name="small", language=None, threads=None):
+    """
+    Build a transcription engine. backend="auto" picks faster-whisper when it is installed,
+    openai-whisper otherwise.
+    """
+    if backend == "auto":
+        installed = available_backends()
+        if not installed:
+            raise ImportError("No transcription backend installed. Run `pip install openai-whisper` or `pip install faster-whisper`.")
+        backend = installed[0]
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (choose from {', '.join(BACKENDS)})")
+    engine_cls = BACKENDS[backend][0]
+    return engine_cls(model_name=model_name, language=language, threads=threads)
+
+
+def as_engine(model):
+    """Accept either an engine or a bare whisper model (as cached by older UI sessions)."""
+    if isinstance(model, TranscriptionEngine):
+        return model
+    return WhisperEngine(model=model)
@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from search_index import update_index as update_search_index
+from transcription_cache import TranscriptionStore
+
+# transcribe_audio / transcribe_engine (numpy, and through them whisper) are imported
+# where they are used, so the UI can import this module for job status cheaply.
+
+JOBS_DIR_NAME = "jobs"
+DEFAULT_CHECKPOINT_EVERY = 20
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+PAUSE_REQUESTED = "pause_requested"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+
+
+def job_path(parsed_dir, name="all"):
+    """One job per parse output; `name` is "all" or a chat file uuid."""
+    return Path(parsed_dir) / JOBS_DIR_NAME / f"transcribe_{name}.sqlite"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class TranscriptionJob:
+    """
+    A resumable transcription job whose whole state lives in one SQLite file:
+    settings and progress in `job`, one row per voice message in `items`.
+    Results are written to the chat files and marked done every `checkpoint_every` clips,
+    so a crash or a pause loses at most one checkpoint of work.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "id INTEGER PRIMARY KEY, chat_uuid TEXT, msg_id TEXT, path TEXT, "
+            "status TEXT DEFAULT 'pending', text TEXT, UNIQUE (chat_uuid, msg_id))"
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # --- settings / progress ---
+    def get(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM job WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, **values):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO job VALUES (?, ?)",
+            [(k, json.dumps(v)) for k, v in values.items()],
+        )
+        self.conn.commit()
+
+    def counts(self):
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return dict(rows)
+
+    def is_alive(self):
+        """True while the process that runs this job is still around."""
+        pid = self.get("pid")
+        if not pid or self.get("state") not in (RUNNING, PAUSE_REQUESTED):
+            return False
+        try:
+            os.kill(pid, 0)
+        except (OSError, ProcessLookupError):
+            return False
+        return True
+
+    def status(self):
+        counts = self.counts()
+        total = sum(counts.values())
+        done = counts.get(DONE, 0)
+        remaining = counts.get(PENDING, 0)
+        throughput = self.get("throughput")  # clips per second, measured in the current/last run
+        state = self.get("state", PENDING)
+        if state in (RUNNING, PAUSE_REQUESTED) and not self.is_alive():
+            state = "interrupted"
+        return {
+            "state": state,
+            "total": total,
+            "done": done,
+            "failed": counts.get(FAILED, 0),
+            "remaining": remaining,
+            "throughput": throughput,
+            "eta_seconds": remaining / throughput if throughput else None,
+        }
+
+    # --- queue ---
+    def enqueue(self, parsed_dir, audio_dir, chat_uuid=None):
+        """Add every untranscribed voice message (of one chat, or all chats) that has an .mp3."""
+        from transcribe_audio import find_pending_clips
+
+        chats_dir = Path(parsed_dir) / "chats"
+        audio_files = set(f for f in os.listdir(audio_dir) if f.endswith(".mp3"))
+        chat_paths = [chats_dir / f"{chat_uuid}.json"] if chat_uuid else sorted(chats_dir.glob("*.json"))
+
+        rows = []
+        for chat_path in chat_paths:
+            if not chat_path.exists():
+                continue
+            with open(chat_path, "r", encoding="utf-8") as f:
+                chat_data = json.load(f)
+            _pending, clips = find_pending_clips(chat_data, audio_dir, audio_files)
+            rows.extend((chat_path.stem, clip.key, clip.path) for clip in clips)
+
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO items (chat_uuid, msg_id, path) VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def request_pause(self):
+        if self.get("state") == RUNNING:
+            self.set(state=PAUSE_REQUESTED)
+
+    # --- execution ---
+    def checkpoint(self, results):
+        """Write buffered (item id, text) results into their chat files, then mark them done."""
+        if not results:
+            return
+        from transcribe_audio import apply_transcription, save_chat
+
+        parsed_dir = Path(self.get("parsed_dir"))
+        ids = [item_id for item_id, _text in results]
+        texts = dict(results)
+        placeholders = ",".join("?" * len(ids))
+        rows = self.conn.execute(
+            f"SELECT id, chat_uuid, msg_id FROM items WHERE id IN ({placeholders})", ids
+        ).fetchall()
+
+        by_chat = {}
+        for item_id, chat_uuid, msg_id in rows:
+            by_chat.setdefault(chat_uuid, {})[msg_id] = texts[item_id]
+
+        for chat_uuid, chat_texts in by_chat.items():
+            chat_path = parsed_dir / "chats" / f"{chat_uuid}.json"
+            if not chat_path.exists():
+                continue
+            with open(chat_path, "r", encoding="utf-8") as f:
+                chat_data = json.load(f)
+            for msg in chat_data.get("messages", []):
+                text = chat_texts.get(str(msg.get("id")))
+                if text is not None and msg.get("type") == 34:
+                    apply_transcription(msg, text)
+            save_chat(chat_path, chat_data)
+
+        self.conn.executemany(
+            "UPDATE items SET status='done', text=? WHERE id=?",
+            [(text, item_id) for item_id, text in results],
+        )
+        self.conn.commit()
+
+    def run(self, workers=1, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, batch_size=None, trim=True, pack=False):
+        from transcribe_audio import run_clips
+        from transcribe_engine import DEFAULT_BATCH_SIZE, Clip, create_engine
+
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        if self.is_alive():
+            print(f"Job already running (pid {self.get('pid')}).")
+            return
+
+        rows = self.conn.execute(
+            "SELECT id, path FROM items WHERE status='pending' ORDER BY chat_uuid, id"
+        ).fetchall()
+        if not rows:
+            self.set(state=DONE)
+            print("Nothing to transcribe.")
+            return
+
+        self.set(state=RUNNING, pid=os.getpid(), run_started=time.time())
+        backend = self.get("backend", "auto")
+        model_name = self.get("model", "small")
+        language = self.get("language")
+        store = TranscriptionStore.for_output(self.get("parsed_dir"))
+
+        buffer = []
+        run_done = 0
+        run_started = time.time()
+
+        def flush():
+            nonlocal buffer, run_done
+            self.checkpoint(buffer)
+            run_done += len(buffer)
+            buffer = []
+            throughput = run_done / max(time.time() - run_started, 1e-6)
+            self.set(throughput=throughput)
+            st = self.status()
+            print(f"Checkpoint: {st['done']}/{st['total']} done, {throughput:.2f} clips/s, ETA {format_eta(st['eta_seconds'])}", flush=True)
+
+        # Results already in the store cost nothing; only the rest go to the model
+        clips = []
+        hashes = {}
+        missing = []
+        for item_id, path in rows:
+            if not os.path.exists(path):
+                missing.append((item_id,))
+                continue
+            audio_hash = store.hash_audio(path)
+            text = store.get(audio_hash, model_name, language)
+            if text is not None:
+                buffer.append((item_id, text))
+            else:
+                hashes[str(item_id)] = audio_hash
+                clips.append(Clip(key=str(item_id), path=path))
+        if buffer:
+            flush()
+            # Cache hits are free; measure throughput on real inference only
+            run_done = 0
+            run_started = time.time()
+
+        print(f"Transcribing {len(clips)} clips with {workers} worker(s)...", flush=True)
+        if workers > 1:
+            from transcribe_pool import TranscriptionPool
+            runner = TranscriptionPool(workers, backend, model_name, language)
+        else:
+            runner = create_engine(backend, model_name=model_name, language=language)
+
+        finished = False
+        yielded = set()
+        try:
+            for key, text in run_clips(runner, clips, batch_size, trim=trim, pack=pack):
+                yielded.add(key)
+                store.put(hashes[key], model_name, language, text)
+                buffer.append((int(key), text))
+                if len(buffer) >= checkpoint_every:
+                    flush()
+                    if self.get("state") == PAUSE_REQUESTED:
+                        break
+            else:
+                finished = True
+        finally:
+            flush()
+            if hasattr(runner, "terminate"):
+                runner.terminate()
+            store.close()
+
+        if finished:
+            # Clips the engine could not handle are parked instead of retried forever
+            failed = missing + [(int(c.key),) for c in clips if c.key not in yielded]
+            self.conn.executemany("UPDATE items SET status='failed' WHERE id=?", failed)
+            self.conn.commit()
+            self.set(state=DONE, pid=None)
+            # Make the new transcriptions searchable
+            update_search_index(self.get("parsed_dir"))
+            print("Job finished.")
+        else:
+            self.set(state=PAUSED, pid=None)
+            print("Job paused.")
+
+
+DEFAULT_SETTINGS = {"backend": "auto", "model": "small", "language": None}
+
+
+def open_job(parsed_dir, audio_dir=None, chat_uuid=None, backend=None, model=None, language=None):
+    """
+    Open (creating if needed) the job for a parse output and queue any new voice messages.
+    backend / model / language (None: keep the saved setting) replace the saved ones for the
+    clips still to do; changing them while the job is running raises ValueError.
+    """
+    job = TranscriptionJob(job_path(parsed_dir, chat_uuid or "all"))
+    settings = {k: v for k, v in {"backend": backend, "model": model, "language": language}.items() if v is not None}
+    if job.get("parsed_dir") is None:
+        job.set(parsed_dir=str(parsed_dir), audio_dir=str(audio_dir) if audio_dir else None,
+                **{**DEFAULT_SETTINGS, **settings}, state=PENDING, created=time.time())
+    else:
+        changed = {k: v for k, v in settings.items() if job.get(k) != v}
+        if changed and job.is_alive():
+            saved = ", ".join(f"{k}={job.get(k)!r}" for k in changed)
+            raise ValueError(f"Job is running with {saved}; pause it before changing its settings.")
+        if changed:
+            job.set(**changed)
+        if audio_dir:
+            job.set(audio_dir=str(audio_dir))
+    # Jobs created before audio_dir could be empty saved the string "None"
+    audio_dir = audio_dir or (job.get("audio_dir") if job.get("audio_dir") != "None" else None)
+    if audio_dir and os.path.isdir(audio_dir) and not job.is_alive():
+        added = job.enqueue(parsed_dir, str(audio_dir), chat_uuid)
+        if added:
+            print(f"Queued {added} new voice messages.")
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable background transcription job.")
+    parser.add_argument("command", choices=["run", "pause", "status"])
+    parser.add_argument("--parsed_dir", type=Path, required=True, help="parse_db.py output directory")
+    parser.add_argument("--audio_dir", type=Path, default=None, help="Directory with converted .mp3 files")
+    parser.add_argument("--chat", default=None, help="Only this chat (file uuid); default all chats")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--backend", default=None, help="auto, whisper or faster-whisper (default: saved setting, else auto)")
+    parser.add_argument("--model", default=None, help="Model size/name (default: saved setting, else small)")
+    parser.add_argument("--language", default=None, help="Force language (default: saved setting)")
+    parser.add_argument("--checkpoint_every", type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    parser.add_argument("--batch_size", type=int, default=None, help="Clips per forward pass (default: engine default)")
+    parser.add_argument("--no_trim", action="store_true", help="Don't trim leading/trailing silence")
+    parser.add_argument("--pack", action="store_true", help="Pack short clips into shared 30s windows")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        try:
+            job = open_job(args.parsed_dir, args.audio_dir, args.chat, args.backend, args.model, args.language)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        job.run(args.workers, args.checkpoint_every, args.batch_size, trim=not args.no_trim, pack=args.pack)
+        return
+
+    path = job_path(args.parsed_dir, args.chat or "all")
+    if not path.exists():
+        print(f"No job found at {path}")
+        sys.exit(1)
+    job = TranscriptionJob(path)
+    if args.command == "pause":
+        job.request_pause()
+        print("Pause requested; the job stops at its next checkpoint.")
+    else:
+        st = job.status()
+        print(f"State: {st['state']}")
+        print(f"Done: {st['done']}/{st['total']} (failed {st['failed']})")
+        if st["throughput"]:
+            print(f"Throughput: {st['throughput']:.2f} clips/s, ETA {format_eta(st['eta_seconds'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+
+from transcribe_engine import DEFAULT_BATCH_SIZE, create_engine
+
+# Per-process engine, loaded once by the pool initializer
+_engine = None
+
+
+def threads_per_worker(workers, cpu_count=None):
+    """Split the cores evenly so workers x threads never exceeds the machine."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def _init_worker(backend, model_name, language, threads):
+    global _engine
+    # Must be set before torch / CTranslate2 spin up their thread pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    _engine = create_engine(backend, model_name=model_name, language=language, threads=threads)
+
+
+def _transcribe_batch(task):
+    clips, trim, pack = task
+    return [(clip.key, text) for clip, text in _engine.transcribe(clips, batch_size=len(clips), trim=trim, pack=pack)]
+
+
+class TranscriptionPool:
+    """
+    A pool of worker processes, each holding its own model.
+    Clips are sent in batches over a shared queue; results stream back to the caller,
+    which stays the only process writing chat files.
+    """
+
+    def __init__(self, workers=None, backend="auto", model_name="small", language=None, threads=None):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 4)
+        self.threads = threads or threads_per_worker(self.workers)
+        self.model_name = model_name
+        self.language = language
+        # spawn: torch does not survive fork() once its thread pool exists
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = ctx.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(backend, model_name, language, self.threads),
+        )
+
+    def imap(self, clips, batch_size=DEFAULT_BATCH_SIZE, trim=False, pack=False):
+        """Yield (key, text) in completion order."""
+        clips = list(clips)
+        batches = [(clips[i:i + batch_size], trim, pack) for i in range(0, len(clips), batch_size)]
+        for results in self._pool.imap_unordered(_transcribe_batch, batches):
+            yield from results
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
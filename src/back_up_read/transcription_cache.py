@@ -0,0 +1,165 @@
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from chat_store import file_key, stream_chat, write_chat
+
+STORE_NAME = "transcriptions.sqlite"
+# Source formats checked (in order) before falling back to hashing the converted file itself.
+# Hashing the original .aud keeps the key stable no matter how it was converted.
+SOURCE_EXTS = (".aud", ".silk")
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_audio_path(path):
+    """The original voice file next to a converted .mp3, if it is still there."""
+    base = os.path.splitext(str(path))[0]
+    for ext in SOURCE_EXTS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return str(path)
+
+
+def store_version(db_path):
+    """Changes whenever transcriptions are added (WAL mode: new rows land in the -wal file first)."""
+    version = ()
+    for path in (str(db_path), f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            version += (st.st_size, st.st_mtime_ns)
+        except OSError:
+            version += (None, None)
+    return version
+
+
+class TranscriptionStore:
+    """
+    Persistent transcriptions keyed by (audio content hash, model, language).
+    Lives next to index.json but is never touched by parse_db.py, so re-parsing keeps every transcription.
+    File hashes are memoized by (path, size, mtime) so repeated lookups don't re-read audio.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcriptions ("
+            "audio_hash TEXT, model TEXT, language TEXT, text TEXT, created REAL, "
+            "PRIMARY KEY (audio_hash, model, language))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS audio_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, audio_hash TEXT)"
+        )
+        self.conn.commit()
+
+    @classmethod
+    def for_output(cls, parse_output):
+        return cls(Path(parse_output) / STORE_NAME)
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM transcriptions LIMIT 1").fetchone() is None
+
+    def hash_audio(self, path):
+        """Content hash of the voice note behind `path` (prefers the original .aud)."""
+        src = source_audio_path(path)
+        st = os.stat(src)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, audio_hash FROM audio_hashes WHERE path=?", (src,)
+        ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_sha1(src)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO audio_hashes VALUES (?, ?, ?, ?)",
+            (src, st.st_size, st.st_mtime_ns, digest),
+        )
+        self.conn.commit()
+        return digest
+
+    def get(self, audio_hash, model, language=None):
+        row = self.conn.execute(
+            "SELECT text FROM transcriptions WHERE audio_hash=? AND model=? AND language=?",
+            (audio_hash, model, language or ""),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_any(self, audio_hash):
+        """Most recent transcription of this audio by any model."""
+        row = self.conn.execute(
+            "SELECT text FROM transcriptions WHERE audio_hash=? ORDER BY created DESC LIMIT 1",
+            (audio_hash,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, audio_hash, model, language, text):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO transcriptions VALUES (?, ?, ?, ?, ?)",
+            (audio_hash, model, language or "", text, time.time()),
+        )
+        self.conn.commit()
+
+    def rejoin_chat(self, chat_data, audio_dirs):
+        """
+        Fill `transcription` on voice messages from the store.
+        `audio_dirs` is one directory or a list of them holding <MesLocalID>.aud/.mp3.
+        Returns the number of messages updated.
+        """
+        if isinstance(audio_dirs, (str, Path)):
+            audio_dirs = [audio_dirs]
+        audio_dirs = [str(d) for d in audio_dirs if d and os.path.isdir(d)]
+        if not audio_dirs or self.is_empty():
+            return 0
+
+        count = 0
+        for msg in chat_data.get("messages", []):
+            if msg.get("type") != 34 or msg.get("transcription") or not msg.get("id"):
+                continue
+            path = find_voice_file(audio_dirs, msg["id"])
+            if not path:
+                continue
+            text = self.get_any(self.hash_audio(path))
+            if text is not None:
+                msg["transcription"] = text
+                msg["content"] = f"[Voice] {text}"
+                count += 1
+        return count
+
+    def rejoin_file(self, chat_path, audio_dirs):
+        """
+        rejoin_chat for one chat file. The chat is rewritten through write_chat only when
+        something was filled in and the file did not change meanwhile.
+        """
+        version = file_key(chat_path)
+        meta, messages = stream_chat(chat_path)
+        chat_data = dict(meta, messages=list(messages))
+        count = self.rejoin_chat(chat_data, audio_dirs)
+        if count and file_key(chat_path) == version:
+            write_chat(chat_path, chat_data)
+        return count
+
+
+def find_voice_file(audio_dirs, msg_id):
+    for d in audio_dirs:
+        for ext in SOURCE_EXTS + (".mp3",):
+            p = os.path.join(d, f"{msg_id}{ext}")
+            if os.path.exists(p):
+                return p
+    return None
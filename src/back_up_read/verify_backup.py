@@ -0,0 +1,214 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import plistlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from extract_wechat import DOMAIN, backup_file, list_backups, open_manifest
+from pipeline_jobs import ProgressReporter
+
+# Checks every file Manifest.db lists for a domain against the backup folder:
+#   missing        - no <fileID[:2]>/<fileID> on disk
+#   size_mismatch  - size differs from the one recorded in the `file` plist (truncated copy etc.)
+#   unreadable     - (--hash) reading the file failed
+#   digest_mismatch- (--hash) SHA-1 differs from the plist Digest (only older iOS versions store one)
+# Hashing maps each file and hands whole slices to hashlib, which releases the GIL, so a
+# thread pool keeps several reads in flight and runs at disk speed rather than Python speed.
+FLAG_FILE = 1
+HASH_SLICE = 16 * 1024 * 1024
+SMALL_FILE = 64 * 1024   # below this a plain read() is cheaper than a mapping
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+REPORT_DIR = Path(__file__).parent / "verify_reports"
+
+
+def file_info(blob):
+    """(size, digest) from a Files.file blob (NSKeyedArchiver'd MBFile); None where absent."""
+    if not blob:
+        return None, None
+    try:
+        archive = plistlib.loads(blob)
+        objects = archive["$objects"]
+        root = objects[archive["$top"]["root"].data]
+    except (plistlib.InvalidFileException, KeyError, IndexError, TypeError, AttributeError, ValueError):
+        return None, None
+    digest = root.get("Digest")
+    if isinstance(digest, plistlib.UID):
+        digest = objects[digest.data]
+    if isinstance(digest, dict):
+        digest = digest.get("NS.data")
+    return root.get("Size"), digest.hex() if isinstance(digest, bytes) else None
+
+
+def manifest_rows(cursor, domain=DOMAIN):
+    """(fileID, relativePath, expected size, expected digest) of every regular file; domain=None: all."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(Files)")}
+    fields = ["fileID", "relativePath"] + [c for c in ("flags", "file") if c in columns]
+    query = f"SELECT {', '.join(fields)} FROM Files"
+    params = ()
+    if domain:
+        query += " WHERE domain = ?"
+        params = (domain,)
+    rows = []
+    for row in cursor.execute(query, params):
+        record = dict(zip(fields, row))
+        if "flags" in record and record["flags"] != FLAG_FILE:
+            continue   # directories and symlinks have no file in the backup
+        size, digest = file_info(record.get("file"))
+        rows.append((record["fileID"], record["relativePath"], size, digest))
+    return rows
+
+
+def sha1_file(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < SMALL_FILE:
+            digest.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for start in range(0, size, HASH_SLICE):
+                        digest.update(view[start:start + HASH_SLICE])
+                finally:
+                    view.release()
+    return digest.hexdigest()
+
+
+def check_file(backup_path, row, hash_files=False):
+    """Result dict for one manifest row."""
+    file_id, rel_path, expected_size, expected_digest = row
+    result = {"fileID": file_id, "relativePath": rel_path, "status": "ok", "expected_size": expected_size}
+    path = backup_file(backup_path, file_id)
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        result["status"] = "missing"
+        return result
+    result["size"] = size
+    if expected_size is not None and size != expected_size:
+        result["status"] = "size_mismatch"
+        return result
+    if hash_files:
+        try:
+            result["sha1"] = sha1_file(path)
+        except OSError as e:
+            result["status"] = "unreadable"
+            result["error"] = str(e)
+            return result
+        if expected_digest and result["sha1"] != expected_digest:
+            result["status"] = "digest_mismatch"
+            result["expected_sha1"] = expected_digest
+    return result
+
+
+def verify_backup(backup_path, domain=DOMAIN, hash_files=False, workers=DEFAULT_WORKERS, progress=None):
+    """Check every manifest file of `domain` (None: all domains). Returns the report dict (None without a manifest)."""
+    backup_path = Path(backup_path)
+    cursor = open_manifest(backup_path)
+    if cursor is None:
+        return None
+    try:
+        rows = manifest_rows(cursor, domain)
+    finally:
+        cursor.connection.close()
+
+    t0 = time.perf_counter()
+    counts = {"ok": 0, "missing": 0, "size_mismatch": 0, "unreadable": 0, "digest_mismatch": 0}
+    problems, files = [], []
+    checked_bytes = 0
+    # Largest first, so one big file does not run alone at the end
+    rows.sort(key=lambda r: r[2] or 0, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = pool.map(lambda r: check_file(backup_path, r, hash_files), rows)
+        for n, result in enumerate(results, 1):
+            counts[result["status"]] += 1
+            checked_bytes += result.get("size", 0)
+            files.append(result)
+            if result["status"] != "ok":
+                problems.append(result)
+            if progress:
+                progress(n, len(rows))
+    seconds = time.perf_counter() - t0
+
+    return {
+        "backup": str(backup_path),
+        "domain": domain,
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "hashed": hash_files,
+        "summary": {
+            "files": len(rows),
+            **counts,
+            "bytes": checked_bytes,
+            "seconds": round(seconds, 3),
+            "mb_per_s": round(checked_bytes / 1024 / 1024 / seconds, 1) if hash_files and seconds else None,
+        },
+        "problems": problems,
+        "files": files,
+    }
+
+
+def write_report(report, path, include_files=False):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not include_files:
+        report = {k: v for k, v in report.items() if k != "files"}
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def print_summary(report):
+    s = report["summary"]
+    print(f"Verified {s['files']} files ({s['bytes'] / 1024 / 1024:.1f} MB) in {s['seconds']:.1f}s"
+          + (f", {s['mb_per_s']} MB/s" if s["mb_per_s"] else ""))
+    print(f"  ok {s['ok']} | missing {s['missing']} | size mismatch {s['size_mismatch']}"
+          + (f" | unreadable {s['unreadable']} | digest mismatch {s['digest_mismatch']}" if report["hashed"] else ""))
+    for p in report["problems"][:20]:
+        print(f"  [{p['status']}] {p['relativePath']} ({p['fileID']})")
+    if len(report["problems"]) > 20:
+        print(f"  ... {len(report['problems']) - 20} more in the report")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every WeChat file in Manifest.db is present and intact.")
+    parser.add_argument("--backup_path", type=Path, default=None, help="iTunes backup folder (default: newest)")
+    parser.add_argument("--domain", default=DOMAIN, help="Manifest domain to check, or 'all'")
+    parser.add_argument("--hash", action="store_true", help="Also read and SHA-1 every file")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parallel file checks")
+    parser.add_argument("--report", type=Path, default=None, help="JSON report path (default: verify_reports/<backup>.json)")
+    parser.add_argument("--all_files", action="store_true", help="List every file in the report, not only problems")
+    args = parser.parse_args()
+
+    backup_path = args.backup_path
+    if backup_path is None:
+        backups = list_backups()
+        if not backups:
+            print("No iOS backups found.")
+            sys.exit(1)
+        backup_path = backups[0][0]
+    domain = None if args.domain == "all" else args.domain
+
+    reporters = {}
+    report = verify_backup(
+        backup_path, domain, args.hash, args.workers,
+        progress=lambda done, total: reporters.setdefault("verify", ProgressReporter("verify", total)).update(done),
+    )
+    if report is None:
+        sys.exit(1)
+    report_path = args.report or REPORT_DIR / f"{backup_path.name}.json"
+    write_report(report, report_path, args.all_files)
+    print_summary(report)
+    print(f"Report: {report_path}")
+    sys.exit(1 if report["problems"] else 0)
+
+
+if __name__ == "__main__":
+    main()
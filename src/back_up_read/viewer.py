@@ -1,11 +1,18 @@
 import streamlit as st
+import hashlib
 import json
-import pandas as pd
+import os
 from pathlib import Path
 
+from chat_render import MessageList, show_chat_pages
+from contact_index import ContactIndex
+from export_engine import FORMATS, MIME_TYPES, export_chat, safe_name
+
 # Config
 current_dir = Path(__file__).parent
 DATA_FILE = current_dir / "parsed_messages.json"
+# Downloads are staged here once per chat / filter / data version, not rebuilt on every rerun
+STAGING_DIR = current_dir / "exports" / ".staging"
 
 st.set_page_config(page_title="WeChat Backup Viewer", layout="wide")
 
@@ -16,6 +23,15 @@ def load_data():
     with open(DATA_FILE, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+@st.cache_resource
+def load_contacts():
+    """Prebuilt contact finder; `_pos` points into the message-count-sorted data list."""
+    data = sorted(load_data(), key=lambda x: len(x['messages']), reverse=True)
+    return ContactIndex([
+        {"friend_name": c['friend_name'], "friend_id": c['friend_id'], "message_count": len(c['messages']), "_pos": i}
+        for i, c in enumerate(data)
+    ])
+
 def main():
     st.title("📱 WeChat History Viewer")
     
@@ -44,14 +60,8 @@ def main():
     else:
         name_query = st.sidebar.text_input("One-time Search", placeholder="Type name or ID...")
         if name_query:
-            count = 0
-            for i, chat in enumerate(data):
-                if name_query.lower() in chat['friend_name'].lower() or \
-                   name_query.lower() in chat['friend_id'].lower():
-                    candidates_indices.append(i)
-                    count += 1
-                    if count >= 100: # Limit search results
-                        break
+            # Prefix / pinyin / fuzzy matches, top 100 by message count
+            candidates_indices = [row['_pos'] for row in load_contacts().search(name_query, limit=100)]
             if not candidates_indices:
                 st.sidebar.warning("No matches found.")
         else:
@@ -100,117 +110,29 @@ def main():
         ]
         st.info(f"Filtered: {len(filtered_messages)} messages found for '{search_query}'")
 
-    # Export Options (Using filtered data)
+    # Export Options (Using filtered data), written incrementally by export_engine
+    meta = {k: v for k, v in chat.items() if k != "messages"}
+    if search_query:
+        meta["filter"] = search_query
     col1, col2 = st.columns(2)
-    with col1:
-        # JSON Export
-        export_data = {**chat, "messages": filtered_messages}
-        chat_json = json.dumps(export_data, ensure_ascii=False, indent=2)
-        st.download_button(
-            label="⬇️ Download JSON",
-            data=chat_json,
-            file_name=f"wechat_{chat['friend_name']}_filtered.json",
-            mime="application/json"
-        )
-    with col2:
-        # Text Export
-        text_content = f"Chat History with {chat['friend_name']}\n"
-        if search_query:
-            text_content += f"Filter: {search_query}\n"
-        text_content += "\n"
-            
-        for msg in filtered_messages:
-            text_content += f"[{msg['timestamp']}] {msg['sender']}: {msg['content']}\n"
-            
-        st.download_button(
-            label="⬇️ Download Text",
-            data=text_content,
-            file_name=f"wechat_{chat['friend_name']}_filtered.txt",
-            mime="text/plain"
-        )
+    tag = hashlib.blake2b(f"{chat['friend_id']}\x1f{search_query}".encode("utf-8"), digest_size=8).hexdigest()
+    for col, fmt, label in ((col1, "json", "⬇️ Download JSON"), (col2, "txt", "⬇️ Download Text")):
+        staging = STAGING_DIR / f"{tag}{FORMATS[fmt]}"
+        if not staging.exists() or staging.stat().st_mtime_ns < os.stat(DATA_FILE).st_mtime_ns:
+            staging.parent.mkdir(parents=True, exist_ok=True)
+            export_chat(None, staging, fmt, meta=meta, messages=filtered_messages)
+        with col, open(staging, "rb") as f:
+            st.download_button(
+                label=label,
+                data=f,
+                file_name=f"wechat_{safe_name(chat['friend_name'])}_filtered{FORMATS[fmt]}",
+                mime=MIME_TYPES[fmt]
+            )
         
     st.divider()
 
-    # Chat Bubble Styles
-    st.markdown("""
-    <style>
-    .chat-container {
-        display: flex;
-        flex-direction: column;
-        gap: 10px;
-        padding: 10px;
-    }
-    .msg-row {
-        display: flex;
-        width: 100%;
-    }
-    .msg-row.sent {
-        justify-content: flex-end;
-    }
-    .msg-row.received {
-        justify-content: flex-start;
-    }
-    .bubble {
-        max-width: 70%;
-        padding: 10px 15px;
-        border-radius: 15px;
-        position: relative;
-        font-family: sans-serif;
-    }
-    .sent .bubble {
-        background-color: #95ec69; /* WeChat Green */
-        color: black;
-        border-bottom-right-radius: 5px;
-    }
-    .received .bubble {
-        background-color: #ffffff;
-        color: black;
-        border: 1px solid #e0e0e0;
-        border-bottom-left-radius: 5px;
-    }
-    .meta {
-        font-size: 0.75em;
-        color: #888;
-        margin-top: 5px;
-        display: block;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-    # Rendering Messages
-    
-    # Display Limit
-    DISPLAY_LIMIT = 500
-    if len(filtered_messages) > DISPLAY_LIMIT and not search_query:
-        st.warning(f"Showing last {DISPLAY_LIMIT} messages for performance. Use export to key full history or search to find older messages.")
-        to_display = filtered_messages[-DISPLAY_LIMIT:]
-    else:
-        to_display = filtered_messages
-
-    for msg in to_display:
-        # Align: Sender (Me) -> Right, Receiver (Friend) -> Left
-        row_class = "sent" if msg['is_sender'] else "received"
-        sender_name = "Me" if msg['is_sender'] else msg['sender']
-        
-        # Handle different message types (basic text only currently supports full display)
-        content_display = msg['content']
-        if msg['type'] == 3:
-            content_display = "🖼️ [Image]"
-        elif msg['type'] == 34:
-            content_display = "🔊 [Voice]"
-        elif msg['type'] == 49:
-            content_display = "🔗 [Link/AppMsg]"
-        elif msg['type'] == 47:
-            content_display = "😊 [Sticker]"
-            
-        st.markdown(f"""
-        <div class="msg-row {row_class}">
-            <div class="bubble">
-                <div>{content_display}</div>
-                <span class="meta">{msg['timestamp']}</span>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+    # Paged rendering: one HTML block per page, older pages on demand
+    show_chat_pages(MessageList(filtered_messages), chat['friend_name'], key=f"{chat['friend_id']}_{search_query}")
 
 if __name__ == "__main__":
     main()
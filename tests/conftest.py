@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules are flat scripts run from src/back_up_read; import them the same way
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "back_up_read"))
@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import date
+
+import chat_store
+from chat_store import ChatHandle, append_chat, read_idx, stream_chat, ts_key, write_chat
+
+
+def message(i, day=1):
+    return {"id": str(i), "content": f"消息 {i}", "timestamp": f"2024-01-{day:02d}T10:00:{i % 60:02d}"}
+
+
+def chat_file(tmp_path, messages, **meta):
+    path = tmp_path / "chat.json"
+    write_chat(path, dict(meta, messages=messages))
+    return path
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_write_chat_sidecar(tmp_path):
+    messages = [message(i) for i in range(3)]
+    path = chat_file(tmp_path, messages, friend_name="张三")
+    header, offsets, timestamps = read_idx(path)
+    assert header["count"] == 3 and header["meta"] == {"friend_name": "张三"}
+    assert len(offsets) == 4 and list(timestamps) == [ts_key(m["timestamp"]) for m in messages]
+    raw = path.read_bytes()
+    for i, msg in enumerate(messages):
+        line = raw[offsets[i]:offsets[i + 1]].rstrip().rstrip(b",")
+        assert json.loads(line) == msg
+    assert load(path) == {"friend_name": "张三", "messages": messages}
+
+
+def test_append_chat(tmp_path):
+    messages = [message(i) for i in range(3)]
+    path = chat_file(tmp_path, messages[:1], friend_name="a")
+    assert append_chat(path, messages[1:])
+    assert append_chat(path, [])
+    assert load(path) == {"friend_name": "a", "messages": messages}
+    header, offsets, timestamps = read_idx(path)
+    assert header["count"] == 3 and len(offsets) == 4 and len(timestamps) == 3
+    assert ChatHandle(path).read(1, 3) == messages[1:]
+
+
+def test_append_to_empty_chat(tmp_path):
+    path = chat_file(tmp_path, [])
+    assert read_idx(path)[0]["count"] == 0
+    assert append_chat(path, [message(0)])
+    assert append_chat(path, [message(1)])
+    assert load(path) == {"messages": [message(0), message(1)]}
+    assert list(stream_chat(path)[1]) == [message(0), message(1)]
+
+
+def test_stale_sidecar(tmp_path):
+    path = chat_file(tmp_path, [message(0)])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(" ")
+    assert read_idx(path) is None
+    assert not append_chat(path, [message(1)])
+    assert load(path) == {"messages": [message(0)]}
+
+
+def test_sidecar_without_timestamps(tmp_path):
+    # Sidecars written before the timestamp index still load; ranges fall back to reading messages
+    messages = [message(i, day=i + 1) for i in range(5)]
+    path = chat_file(tmp_path, messages)
+    header, offsets, _timestamps = read_idx(path)
+    chat_store.write_idx(path, header, offsets)
+    assert read_idx(path)[2] is None
+    assert append_chat(path, [message(5, day=6)])
+    assert read_idx(path)[2] is None
+    handle = ChatHandle(path)
+    assert handle.range(date(2024, 1, 2), date(2024, 1, 4)) == (1, 3)
+    _meta, found = stream_chat(path, since=date(2024, 1, 5))
+    assert [m["id"] for m in found] == ["4", "5"]
+
+
+def test_range_with_timestamp_index(tmp_path):
+    messages = [message(i, day=i + 1) for i in range(5)]
+    path = chat_file(tmp_path, messages[:2])
+    assert append_chat(path, messages[2:])
+    handle = ChatHandle(path)
+    assert handle.timestamps is not None
+    assert handle.range(date(2024, 1, 2), date(2024, 1, 4)) == (1, 3)
+    assert handle.range(until="2024-01-01") == (0, 0)
+    _meta, found = stream_chat(path, chunk=2, since="2024-01-03")
+    assert [m["id"] for m in found] == ["2", "3", "4"]
+    assert os.path.exists(chat_store.idx_path(path))
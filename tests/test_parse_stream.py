@@ -0,0 +1,88 @@
+import io
+import json
+
+import pytest
+
+import parse
+from parse import _JsonStream, iter_exporter_json
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Tiny reads so values, escapes and numbers land on buffer edges
+    monkeypatch.setattr(parse, "READ_CHUNK", 7)
+
+
+def read_values(text):
+    stream = _JsonStream(io.StringIO(text))
+    return [stream.value() for _ in stream.items()]
+
+
+@pytest.mark.parametrize("values", [
+    [],
+    [{}],
+    [1234567890123, -0.000125, 1e21, 7],
+    ["a long string that spans several chunks", "转义 \"quoted\" \\ é 😀", ""],
+    [{"nested": {"deep": [1, [2, [3]]]}, "text": "中文" * 20}],
+    [True, False, None, 12345678],
+])
+def test_values_match_json_loads(values):
+    text = json.dumps(values, ensure_ascii=False)
+    assert read_values(text) == json.loads(text)
+    spaced = json.dumps(values, ensure_ascii=False, indent=3)
+    assert read_values(spaced) == values
+
+
+def test_number_at_buffer_edge():
+    # "[" + 6 digits fills the first chunk exactly; the number continues in the next one
+    assert read_values("[123456789]") == [123456789]
+    for pad in range(8):
+        assert read_values(" " * pad + "[12, 3456789012]") == [12, 3456789012]
+
+
+def test_object_keys():
+    stream = _JsonStream(io.StringIO('{"a": 1, "long key name": [1, 2], "c": {}}'))
+    assert {key: stream.value() for key in stream.keys()} == {"a": 1, "long key name": [1, 2], "c": {}}
+
+
+def test_truncated_value_raises():
+    stream = _JsonStream(io.StringIO('["unterminated'))
+    with pytest.raises(json.JSONDecodeError):
+        [stream.value() for _ in stream.items()]
+
+
+def write(tmp_path, data):
+    path = tmp_path / "export.json"
+    path.write_text(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def chats(path, batch_size=parse.BATCH_SIZE):
+    return [(dict(info), [m.content for m in batch]) for info, batch in iter_exporter_json(path, batch_size)]
+
+
+@pytest.mark.parametrize("text", ["", "   \n", "{}", "[]", '{"other": [1, 2]}', '{"conversations": []}'])
+def test_empty_exports(tmp_path, text):
+    assert chats(write(tmp_path, text)) == []
+
+
+def test_list_and_wrapped_exports(tmp_path):
+    conversation = {
+        "name": "张三",
+        "messages": [
+            {"id": 1, "content": "你好", "timestamp": 1700000000},
+            {"id": 2, "text": "second", "createTime": "2023-11-14 22:13"},
+        ],
+    }
+    expected = [({"chat_index": 0, "name": "张三"}, ["你好", "second"])]
+    assert chats(write(tmp_path, [conversation])) == expected
+    assert chats(write(tmp_path, {"version": 2, "conversations": [conversation]})) == expected
+
+
+def test_batches_share_chat_info(tmp_path):
+    messages = [{"id": i, "content": f"m{i}", "timestamp": 1700000000 + i} for i in range(5)]
+    path = write(tmp_path, [{"name": "a", "messages": messages}, {"messages": [], "name": "b"}])
+    batches = list(iter_exporter_json(path, batch_size=2))
+    assert [[m.content for m in batch] for _info, batch in batches] == [["m0", "m1"], ["m2", "m3"], ["m4"]]
+    assert all(info is batches[0][0] for info, _batch in batches)
+    assert all(m.timestamp is not None for _info, batch in batches for m in batch)